@@ -0,0 +1,268 @@
+#Offline micro/macro benchmark suite: synthetic schemas and queries, a tiny random T5, JSON baselines
+#and a compare mode that flags benchmarks slower than the baseline by more than a threshold
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from benchmarks.synthetic import build_tiny_model, perturb_sql, synthetic_examples, synthetic_schemas
+from evaluation.exact_match import canonicalize, table_columns
+from models.picard_interface import PicardDecoder
+from preprocess.dataset_builder import build_input_text
+from preprocess.schema_utils import flatten_schema, load_tables
+from training.spider_dataset import SpiderDataset
+
+BASELINE_PATH = "output/benchmarks/baseline.json"
+RESULTS_DIR = "output/benchmarks"
+
+
+class Context:
+    """Synthetic data and the tiny model shared by all benchmarks (built once, deterministically)."""
+
+    def __init__(self, work_dir: str, scale: float = 1.0, seed: int = 0):
+        self.work_dir = work_dir
+        self.scale = scale
+        self.seed = seed
+        self.schemas = synthetic_schemas(200, seed=seed)
+        self.examples = synthetic_examples(self.schemas, self.size(100000), seed=seed)
+        self.flat = {db_id: flatten_schema(schema) for db_id, schema in self.schemas.items()}
+
+        corpus = [build_input_text(question, self.flat[db_id]) for question, _, db_id in self.examples[:2000]]
+        corpus += [sql for _, sql, _ in self.examples[:2000]]
+        self.tokenizer, self.model = build_tiny_model(work_dir, corpus, seed=seed)
+        self.picard = PicardDecoder(tokenizer=self.tokenizer, db_path="", schemas=self.schemas)
+
+    def size(self, count: int) -> int:
+        return max(1, int(count * self.scale))
+
+
+def _load_tables(ctx: Context):
+    path = os.path.join(ctx.work_dir, "tables.json")
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(list(ctx.schemas.values()), f)
+    return lambda: load_tables(path), 1, "files"
+
+
+def _flatten_schema(ctx: Context):
+    schemas = list(ctx.schemas.values())
+    return lambda: [flatten_schema(schema) for schema in schemas], len(schemas), "schemas"
+
+
+def _spider_dataset_items(ctx: Context):
+    path = os.path.join(ctx.work_dir, "train.tsv")
+    examples = ctx.examples[:ctx.size(2000)]
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["input", "target", "db_id"])
+            writer.writerows((build_input_text(q, ctx.flat[db_id]), sql, db_id) for q, sql, db_id in examples)
+
+    def run():
+        dataset = SpiderDataset(path, ctx.tokenizer, pad_to_max_length=False)
+        for i in range(len(dataset)):
+            dataset[i]
+    return run, len(examples), "items"
+
+
+def _picard_decode(ctx: Context):
+    examples = ctx.examples[:ctx.size(40)]
+    inputs = [(ctx.tokenizer(build_input_text(q, ctx.flat[db_id]), return_tensors="pt")["input_ids"], db_id)
+              for q, _, db_id in examples]
+
+    def run():
+        for input_ids, db_id in inputs:
+            ctx.picard.decode(ctx.model, input_ids, torch.ones_like(input_ids), db_id, max_length=32, num_beams=2)
+    return run, len(inputs), "examples"
+
+
+def _constraint_step(ctx: Context):
+    """One PicardLogitsProcessor call per decoder step, replaying gold SQL prefixes for 4 beams."""
+    examples = ctx.examples[:ctx.size(200)]
+    sequences = [[ctx.tokenizer.pad_token_id] + ctx.tokenizer(sql)["input_ids"] for _, sql, _ in examples]
+    generator = torch.Generator().manual_seed(ctx.seed)
+    scores = torch.randn(4, len(ctx.tokenizer), generator=generator)
+    steps = sum(len(ids) for ids in sequences)
+
+    def run():
+        for ids, (_, _, db_id) in zip(sequences, examples):
+            processor = ctx.picard.logits_processor([db_id], num_beams=4)
+            prefix = torch.tensor([ids] * 4)
+            for t in range(1, len(ids) + 1):
+                processor(prefix[:, :t], scores)
+    return run, steps, "steps"
+
+
+def _clean_generated_sql(ctx: Context):
+    queries = [sql.lower() for _, sql, _ in ctx.examples[:ctx.size(10000)]]
+    return lambda: [ctx.picard._clean_generated_sql(sql) for sql in queries], len(queries), "queries"
+
+
+def _exact_match(ctx: Context):
+    """Exact set match of 100k (perturbed prediction, gold) pairs, parsing both sides."""
+    rng = random.Random(ctx.seed)
+    pairs = [(perturb_sql(sql, rng), sql, db_id) for _, sql, db_id in ctx.examples]
+    columns = {db_id: table_columns(schema) for db_id, schema in ctx.schemas.items()}
+
+    def run():
+        matches = 0
+        for pred, gold, db_id in pairs:
+            canonical = canonicalize(pred, columns=columns[db_id])
+            matches += canonical is not None and canonical == canonicalize(gold, columns=columns[db_id])
+        return matches
+    return run, len(pairs), "queries"
+
+
+# name -> setup(ctx) returning (run, operations per run, operation unit)
+BENCHMARKS: Dict[str, Callable] = {
+    "load_tables": _load_tables,
+    "flatten_schema": _flatten_schema,
+    "spider_dataset_items": _spider_dataset_items,
+    "picard_decode": _picard_decode,
+    "constraint_step": _constraint_step,
+    "clean_generated_sql": _clean_generated_sql,
+    "exact_match": _exact_match,
+}
+
+
+def measure(run: Callable, operations: int, unit: str, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """Median/min time per operation over `repeat` rounds (each round loops `run` for at least `min_time`)."""
+    run()  # warm-up
+    per_op = []
+    for _ in range(repeat):
+        loops, start = 0, time.perf_counter()
+        while True:
+            run()
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_op.append(elapsed / (loops * operations))
+    median = statistics.median(per_op)
+    return {
+        "unit": unit,
+        "operations": operations,
+        "median_us": round(1e6 * median, 4),
+        "min_us": round(1e6 * min(per_op), 4),
+        "stdev_us": round(1e6 * statistics.pstdev(per_op), 4),
+        "per_sec": round(1 / median, 2) if median else 0.0,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def run_suite(names: Optional[List[str]] = None, scale: float = 1.0, repeat: int = 5, seed: int = 0) -> dict:
+    names = names or list(BENCHMARKS)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        ctx = Context(work_dir, scale=scale, seed=seed)
+        for name in names:
+            run, operations, unit = BENCHMARKS[name](ctx)
+            results[name] = measure(run, operations, unit, repeat=repeat)
+            print(f"  {name:<22} {results[name]['median_us']:>12.2f} us/op ({results[name]['per_sec']:,.0f} {unit}/s)")
+    return {"environment": environment(), "config": {"scale": scale, "repeat": repeat, "seed": seed},
+            "benchmarks": results}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> List[dict]:
+    """Per-benchmark change of the median time per operation; > threshold slower is a regression."""
+    rows = []
+    for name, result in current["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        change = result["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        rows.append({"benchmark": name, "baseline_us": base["median_us"], "current_us": result["median_us"],
+                     "change": round(change, 4), "regression": change > threshold})
+    return rows
+
+
+def print_comparison(rows: List[dict], threshold: float):
+    for row in rows:
+        flag = "❌ REGRESSION" if row["regression"] else ("✅" if row["change"] < -threshold else "")
+        print(f"  {row['benchmark']:<22} {row['baseline_us']:>12.2f} -> {row['current_us']:>12.2f} us "
+              f"({100 * row['change']:+.1f}%) {flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark suite (synthetic data, tiny random T5)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="data size multiplier (0.1 for a quick run)")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--threads", type=int, default=1, help="torch threads (1 keeps timings stable)")
+    run_parser.add_argument("--output", help=f"results file (default: {RESULTS_DIR}/<commit or time>.json)")
+    run_parser.add_argument("--save-baseline", action="store_true", help=f"also write {BASELINE_PATH}")
+    run_parser.add_argument("--compare", metavar="BASELINE", nargs="?", const=BASELINE_PATH,
+                            help="compare against a baseline after running")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="slowdown flagged as a regression")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--baseline", default=BASELINE_PATH)
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        torch.set_num_threads(args.threads)
+        print(f"Running {len(args.only or BENCHMARKS)} benchmarks (scale {args.scale})...")
+        current = run_suite(args.only, scale=args.scale, repeat=args.repeat, seed=args.seed)
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{current['environment']['commit'] or time.strftime('%Y%m%d-%H%M%S')}.json")
+        for path in [output] + ([BASELINE_PATH] if args.save_baseline else []):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+            print(f"💾 Saved results to {path}")
+        if not args.compare:
+            return
+        baseline_path = args.compare
+    else:
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != current.get("config"):
+        print(f"⚠️ Baseline config {baseline.get('config')} differs from {current.get('config')}")
+    rows = compare(baseline, current, args.threshold)
+    print(f"\n📈 Against {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    print_comparison(rows, args.threshold)
+    regressions = [row["benchmark"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) above {100 * args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+    print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#Deterministic synthetic inputs for the offline benchmarks: Spider-style schemas, questions and SQL,
+#and a tiny randomly initialized T5 with a sentencepiece vocabulary trained on the synthetic corpus
+
+import os
+import random
+from typing import Dict, List, Tuple
+
+WORDS = ["id", "name", "age", "city", "country", "title", "year", "price", "rating", "date", "status", "type",
+         "code", "amount", "score", "level", "color", "size", "owner", "region", "budget", "salary", "genre", "rank"]
+NOUNS = ["singer", "concert", "stadium", "student", "course", "teacher", "employee", "department", "product",
+         "order", "customer", "flight", "airport", "movie", "actor", "team", "player", "match", "book", "author"]
+VALUES = ["France", "Paris", "2015", "10", "Smith", "red", "active", "100", "USA", "John"]
+
+
+def synthetic_schemas(num_databases: int = 200, seed: int = 0) -> Dict[str, dict]:
+    """db_id -> tables.json-style schema with 2-8 tables of 3-10 columns each."""
+    rng = random.Random(seed)
+    schemas = {}
+    for d in range(num_databases):
+        db_id = f"db_{d:04d}"
+        tables = rng.sample(NOUNS, rng.randint(2, 8))
+        columns = [[-1, "*"]]
+        for t, _ in enumerate(tables):
+            columns += [[t, word] for word in ["id"] + rng.sample(WORDS[1:], rng.randint(2, 9))]
+        schemas[db_id] = {
+            "db_id": db_id,
+            "table_names_original": tables,
+            "table_names": [table.replace("_", " ") for table in tables],
+            "column_names_original": columns,
+            "column_names": [[t, name.replace("_", " ")] for t, name in columns],
+            "column_types": ["text"] * len(columns),
+            "primary_keys": [],
+            "foreign_keys": [],
+        }
+    return schemas
+
+
+def _columns(schema: dict, table_index: int) -> List[str]:
+    return [name for t, name in schema["column_names_original"] if t == table_index]
+
+
+def synthetic_query(schema: dict, rng: random.Random) -> Tuple[str, str]:
+    """(question, SQL) over one schema, drawn from the common Spider query shapes."""
+    tables = schema["table_names_original"]
+    t = rng.randrange(len(tables))
+    table, columns = tables[t], _columns(schema, t)
+    column, other = rng.sample(columns, 2)
+    value = rng.choice(VALUES)
+    shape = rng.randrange(6)
+    if shape == 0:
+        return f"How many {table}s are there?", f"SELECT count(*) FROM {table}"
+    if shape == 1:
+        return (f"What is the {column} of {table}s whose {other} is {value}?",
+                f"SELECT {column} FROM {table} WHERE {other} = '{value}'")
+    if shape == 2:
+        return (f"List the {column} and {other} of {table}s ordered by {other}.",
+                f"SELECT {column} ,  {other} FROM {table} ORDER BY {other} DESC LIMIT 3")
+    if shape == 3:
+        return (f"How many {table}s are there for each {column}?",
+                f"SELECT {column} ,  count(*) FROM {table} GROUP BY {column} HAVING count(*) > 1")
+    if shape == 4:
+        t2 = (t + 1) % len(tables)
+        joined = tables[t2]
+        return (f"Show the {column} of {table}s with a {joined}.",
+                f"SELECT T1.{column} FROM {table} AS T1 JOIN {joined} AS T2 ON T1.id = T2.id "
+                f"WHERE T2.id > {rng.randint(1, 100)}")
+    return (f"Which {table}s have {other} above average?",
+            f"SELECT {column} FROM {table} WHERE {other} > (SELECT avg({other}) FROM {table})")
+
+
+def synthetic_examples(schemas: Dict[str, dict], count: int, seed: int = 0) -> List[Tuple[str, str, str]]:
+    """(question, SQL, db_id) triples spread over the given schemas."""
+    rng = random.Random(seed)
+    db_ids = sorted(schemas)
+    examples = []
+    for _ in range(count):
+        db_id = rng.choice(db_ids)
+        question, sql = synthetic_query(schemas[db_id], rng)
+        examples.append((question, sql, db_id))
+    return examples
+
+
+def perturb_sql(sql: str, rng: random.Random) -> str:
+    """A prediction for `sql`: unchanged, re-spaced/re-cased, or with a changed literal or limit."""
+    choice = rng.randrange(4)
+    if choice == 0:
+        return sql
+    if choice == 1:
+        return " ".join(sql.split()).lower().replace("select", "SELECT")
+    if choice == 2:
+        return sql.replace("'", '"')
+    return sql.replace("LIMIT 3", "LIMIT 5").replace("= '", "!= '")
+
+
+def build_tiny_model(work_dir: str, corpus: List[str], seed: int = 0, vocab_size: int = 400):
+    """Train a sentencepiece vocabulary on `corpus` and build a random 2-layer T5 on it (no network needed)."""
+    import sentencepiece as spm
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer
+
+    corpus_path = os.path.join(work_dir, "corpus.txt")
+    with open(corpus_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(corpus) + "\n")
+    spm.SentencePieceTrainer.train(
+        input=corpus_path, model_prefix=os.path.join(work_dir, "spiece"), vocab_size=vocab_size,
+        pad_id=0, eos_id=1, unk_id=2, bos_id=-1, hard_vocab_limit=False, minloglevel=2, seed_sentencepiece_size=100000,
+        num_threads=1,
+    )
+    tokenizer = T5Tokenizer(os.path.join(work_dir, "spiece.model"), extra_ids=0)
+
+    torch.manual_seed(seed)
+    config = T5Config(vocab_size=len(tokenizer), d_model=64, d_ff=128, d_kv=16, num_layers=2, num_heads=4,
+                      decoder_start_token_id=tokenizer.pad_token_id, pad_token_id=tokenizer.pad_token_id,
+                      eos_token_id=tokenizer.eos_token_id)
+    model = T5ForConditionalGeneration(config)
+    model.eval()
+    return tokenizer, model
@@ -0,0 +1,146 @@
+#Single entry point for the pipeline: python cli.py <command> [args]. A command's module is only imported when
+#that command runs, so scoring commands start without torch or transformers. Start-up time is reported on stderr
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+_IMPORTED_AT = time.perf_counter()
+
+# name -> (module with a main(argv), directory searched first for its imports, description)
+COMMANDS = {
+    "build": ("preprocess.dataset_builder", None, "build T5 input/output shards for the Spider splits"),
+    "schemas": ("preprocess.schema_registry", None, "compile tables.json files into a schema registry"),
+    "values": ("preprocess.value_index", None, "build the cell-value index of the Spider databases"),
+    "train": ("train", "training", "fine-tune T5 on the preprocessed Spider data"),
+    "train-ddp": ("training.distributed", None, "launch training as data-parallel gloo ranks"),
+    "evaluate": ("evaluation.evaluate", None, "evaluate the trained model with Picard decoding"),
+    "score": ("evaluation.predictions", None, "join predictions to Spider examples and score them incrementally"),
+    "exact-match": ("evaluation.exact_match", None, "Spider-style exact set match of a predictions file"),
+    "execution": ("evaluation.execution", None, "execution accuracy of Spider-format predictions"),
+    "compare-precision": ("evaluation.compare_precision", None, "latency / memory / accuracy of int8 vs fp32"),
+    "prune-vocab": ("models.vocab_pruning", None, "prune the T5 vocabulary to the tokens Spider SQL needs"),
+    "split-encoding": ("models.split_encoding", None, "encoder work of joint vs schema-once encoding"),
+    "speculative": ("models.speculative", None, "acceptance rate and speedup of prompt-lookup decoding"),
+    "serve": ("serving.server", None, "serve text-to-SQL predictions over HTTP"),
+    "bench": ("benchmarks.suite", None, "offline benchmark suite"),
+}
+# Commands that only read and score files: `startup` fails if they pull in a heavy module or start slowly
+SCORING_COMMANDS = ("score", "exact-match", "execution")
+HEAVY_MODULES = ("torch", "transformers")
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process was started (interpreter start-up included), where /proc provides it."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def load_command(name: str):
+    module_name, search_dir, _ = COMMANDS[name]
+    if search_dir is not None:
+        # training/ scripts import their siblings by bare name
+        sys.path.insert(0, os.path.join(ROOT, search_dir))
+    return importlib.import_module(module_name).main
+
+
+def run_command(name: str, argv: List[str], report: bool = True):
+    start = time.perf_counter()
+    main = load_command(name)
+    imported = time.perf_counter()
+    if report:
+        age = process_age()
+        total = age if age is not None else imported - _IMPORTED_AT
+        print(f"⏱️ {name}: started in {total:.2f}s ({imported - start:.2f}s importing its modules)", file=sys.stderr)
+    # argparse takes the program name for usage lines from argv[0]
+    sys.argv[0] = f"cli.py {name}"
+    return main(argv)
+
+
+def measure_startup(names: List[str], repeat: int = 3) -> Dict[str, dict]:
+    """Cold start of each command in fresh interpreters, up to calling its main (best of `repeat`)."""
+    results = {}
+    for name in names:
+        best, probe = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, os.path.join(ROOT, "cli.py"), "--probe", name],
+                                    capture_output=True, text=True, check=True).stdout
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best, probe = elapsed, json.loads(output.splitlines()[-1])
+        results[name] = {"seconds": best, "import_s": probe["import_s"], "heavy": probe["heavy"]}
+    return results
+
+
+def startup_main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py startup", description="Cold-start time of every command")
+    parser.add_argument("commands", nargs="*", help="commands to measure (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed for the scoring commands")
+    parser.add_argument("--output", help="also write the measurements here as JSON")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.commands if name not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+
+    results = measure_startup(args.commands or sorted(COMMANDS), args.repeat)
+    print(f"⏱️ Cold start per command (best of {args.repeat}, fresh interpreter):")
+    failed = []
+    for name, result in results.items():
+        heavy = ", ".join(result["heavy"])
+        print(f"  {name:<18} {result['seconds']:6.2f}s  imports {result['import_s']:5.2f}s  {heavy}")
+        if name in SCORING_COMMANDS and (result["heavy"] or result["seconds"] > args.budget):
+            failed.append(name)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Saved start-up times to {args.output}")
+    if failed:
+        print(f"⚠️ Scoring commands over the {args.budget:.1f}s budget or importing torch/transformers: "
+              f"{', '.join(failed)}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--probe"]:
+        # Child of `startup`: import one command and report what that loaded
+        start = time.perf_counter()
+        load_command(argv[1])
+        print(json.dumps({"import_s": time.perf_counter() - start,
+                          "heavy": [name for name in HEAVY_MODULES if name in sys.modules]}))
+        return 0
+
+    commands = "\n".join(f"  {name:<18} {description}" for name, (_, _, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Text-to-SQL pipeline commands (`cli.py <command> --help` for a command's options)",
+        epilog=f"commands:\n{commands}\n  {'startup':<18} cold-start time of every command",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--no-timing", action="store_true", help="do not report the start-up time")
+    parser.add_argument("command", choices=sorted(COMMANDS) + ["startup"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the command")
+    args = parser.parse_args(argv)
+
+    if args.command == "startup":
+        return startup_main(args.args)
+    return run_command(args.command, args.args, report=not args.no_timing)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#Compare fp32 and int8-quantized inference on the same dev subset: latency, peak RSS,
+#exact set match and execution accuracy, with deltas against fp32
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from evaluation.evaluate import DB_PATH, TABLES_PATH, decode_batches, encode_inputs, load_evaluation
+from evaluation.exact_match import CanonicalCache
+from evaluation.execution import evaluate_execution
+from models.loading import PRECISIONS, model_size_mb
+from preprocess.schema_utils import load_tables
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def _run_precision(precision, limit, batch_size, threads):
+    """Decode the first `limit` dev examples in a fresh process (so peak RSS is per precision)."""
+    if threads:
+        torch.set_num_threads(threads)
+    start = time.perf_counter()
+    tokenizer, model, dataset, picard = load_evaluation(precision=precision)
+    load_s = time.perf_counter() - start
+
+    indices = list(range(min(limit, len(dataset))))
+    input_ids = encode_inputs(dataset, tokenizer, indices)
+    predictions = [None] * len(indices)
+    per_example_ms = []
+
+    batches = decode_batches(indices, input_ids, dataset, tokenizer, model, picard, batch_size, progress=False)
+    decode_start = time.perf_counter()
+    while True:
+        batch_start = time.perf_counter()
+        rows = next(batches, None)
+        if rows is None:
+            break
+        batch_ms = 1000 * (time.perf_counter() - batch_start)
+        per_example_ms.extend([batch_ms / len(rows)] * len(rows))
+        for idx, row in rows:
+            predictions[idx] = row
+    decode_s = time.perf_counter() - decode_start
+
+    return {
+        "precision": precision,
+        "examples": len(indices),
+        "model_mb": round(model_size_mb(model), 1),
+        "load_s": round(load_s, 2),
+        "decode_s": round(decode_s, 2),
+        "ms_per_example": round(1000 * decode_s / max(len(indices), 1), 2),
+        "p50_ms": round(float(np.percentile(per_example_ms, 50)), 2) if per_example_ms else 0.0,
+        "p90_ms": round(float(np.percentile(per_example_ms, 90)), 2) if per_example_ms else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "predictions": predictions,
+    }
+
+
+def score(run, schemas, cache_path, workers):
+    """Add exact set match and execution accuracy to a run."""
+    items = [{"query": pred, "gold": gold, "db_id": db_id} for pred, gold, db_id, _ in run["predictions"]]
+    cache = CanonicalCache(schemas=schemas)
+    forms = cache.get_many([(item["db_id"], item["query"]) for item in items] +
+                           [(item["db_id"], item["gold"]) for item in items])
+    exact = [pred is not None and pred == gold for pred, gold in zip(forms[:len(items)], forms[len(items):])]
+    execution = evaluate_execution(items, DB_PATH, cache_path=cache_path, workers=workers)
+    run["exact_match"] = round(sum(exact) / max(len(items), 1), 4)
+    run["execution"] = round(sum(execution) / max(len(items), 1), 4)
+    return run
+
+
+def compare(precisions, limit=200, batch_size=16, threads=None, cache_path=None, workers=4):
+    schemas = load_tables(TABLES_PATH)
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for precision in precisions:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            run = executor.submit(_run_precision, precision, limit, batch_size, threads).result()
+        runs.append(score(run, schemas, cache_path, workers))
+        print(f"  {precision}: {run['ms_per_example']} ms/example, peak RSS {run['peak_rss_mb']} MB")
+
+    baseline = next((run for run in runs if run["precision"] == "fp32"), runs[0])
+    base_sql = [row[0] for row in baseline["predictions"]]
+    for run in runs:
+        run["delta_exact_match"] = round(run["exact_match"] - baseline["exact_match"], 4)
+        run["delta_execution"] = round(run["execution"] - baseline["execution"], 4)
+        run["speedup"] = round(baseline["ms_per_example"] / max(run["ms_per_example"], 1e-9), 2)
+        run["same_sql_as_baseline"] = round(
+            sum(row[0] == sql for row, sql in zip(run["predictions"], base_sql)) / max(len(base_sql), 1), 4)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency / memory / accuracy of quantized vs fp32 inference")
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--limit", type=int, default=200, help="number of dev examples")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, help="torch threads per run")
+    parser.add_argument("--cache", default="output/cache/gold_results.sqlite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for execution")
+    parser.add_argument("--output", default="output/reports/precision_report.json")
+    args = parser.parse_args(argv)
+
+    print(f"Comparing {', '.join(args.precisions)} on {args.limit} dev examples...")
+    runs = compare(args.precisions, limit=args.limit, batch_size=args.batch_size, threads=args.threads,
+                   cache_path=args.cache, workers=args.workers)
+
+    columns = ["precision", "model_mb", "peak_rss_mb", "ms_per_example", "p90_ms", "speedup",
+               "exact_match", "delta_exact_match", "execution", "delta_execution", "same_sql_as_baseline"]
+    print("\n📈 " + " | ".join(columns))
+    for run in runs:
+        print("   " + " | ".join(str(run[column]) for column in columns))
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump([{key: value for key, value in run.items() if key != "predictions"} for run in runs], f, indent=2)
+    print(f"💾 Saved report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,401 @@
+import argparse
+import glob
 import os
 import csv
-import torch
-from tqdm import tqdm
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-from training.spider_dataset import SpiderDataset
+# torch, transformers and the modules built on them are imported by the functions that
+# decode, so argument parsing and the shard bookkeeping start without loading them
 from preprocess.schema_utils import load_tables
-from models.picard_interface import PicardDecoder
+from models.loading import PRECISIONS
+from profiling.instrumentation import Instrumentation, ProfilerWindow, parse_window
 
 
-def evaluate_with_picard():
-    # === Configuration ===
-    model_dir = "output/t5-spider-final"
-    dev_tsv = "output/processed/dev.tsv"
-    tables_path = "data/spider_data/tables.json"
-    db_path = "data/spider_data/database"
-    save_output_to = "output/predictions/picard_dev_predictions.tsv"
-    max_tokens = 100
+# === Configuration ===
+MODEL_DIR = "output/t5-spider-final"
+DEV_TSV = "output/processed/dev.tsv"
+DEV_TOKENIZED = "output/processed/dev_tokenized"
+TABLES_PATH = "data/spider_data/tables.json"
+DB_PATH = "data/spider_data/database"
+SCHEMA_INDEX_DIR = "output/schema_index"
+SAVE_OUTPUT_TO = "output/predictions/picard_dev_predictions.tsv"
+SHARD_DIR = "output/predictions/shards"
+PROFILE_DIR = "output/profiles"
+MAX_TOKENS = 100
+PREDICTION_HEADER = ["predicted_sql", "ground_truth_sql", "db_id", "example_id"]
 
-    # === Setup ===
-    tokenizer = T5Tokenizer.from_pretrained(model_dir)
-    model = T5ForConditionalGeneration.from_pretrained(model_dir)
-    model.eval()
-    model.to("cuda" if torch.cuda.is_available() else "cpu")
+
+def length_sorted_batches(lengths, batch_size):
+    """Group example indices into batches of similar input length, longest first."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def example_id(dataset, idx):
+    """The builder's example id, or the matching positional id for older TSV files."""
+    return dataset.example_ids[idx] or f"dev-{idx:05d}"
+
+
+def load_evaluation(execution_guided=False, precision="fp32", instrumentation=None):
+    """Tokenizer, model, dev dataset and Picard decoder used by both evaluation modes."""
+    from transformers import T5Tokenizer
+
+    from models.loading import load_model
+    from models.picard_interface import PicardDecoder
+    from preprocess.schema_index import SchemaTokenIndex
+    from training.spider_dataset import SpiderDataset
+
+    tokenizer = T5Tokenizer.from_pretrained(MODEL_DIR)
+    model = load_model(MODEL_DIR, precision=precision)  # int8 modes quantize for CPU inference
 
     # Load schema
-    schemas = load_tables(tables_path)
+    schemas = load_tables(TABLES_PATH)
 
     # Load dev set
-    dataset = SpiderDataset(file_path=dev_tsv, tokenizer=tokenizer)
+    dataset = SpiderDataset(file_path=DEV_TSV, tokenizer=tokenizer)
 
     # Setup Picard decoder
     picard = PicardDecoder(
         tokenizer=tokenizer,
         schemas=schemas,
-        db_path=db_path,
-        fix_issue_16_primary_keys=True  # Enable known fix if needed
+        db_path=DB_PATH,
+        fix_issue_16_primary_keys=True,  # Enable known fix if needed
+        schema_index=SchemaTokenIndex(SCHEMA_INDEX_DIR, tokenizer=tokenizer, schemas=schemas),
+        execution_guided=execution_guided,  # Rerank beams by whether they execute
+        instrumentation=instrumentation
     )
+    if instrumentation is not None:
+        instrumentation.attach_encoder(model)
+    return tokenizer, model, dataset, picard
 
-    predictions = []
 
-    print(f"Evaluating on {len(dataset)} dev examples...")
+def encode_inputs(dataset, tokenizer, indices):
+    """
+    Unpadded input ids of the given examples (memory-mapped from the pre-tokenized
+    ids when available); each batch is padded to its own longest input.
+    """
+    from training.tokenized_dataset import TokenizedSpiderDataset, is_tokenized_dir, tokenized_mismatch
 
-    for idx in tqdm(range(len(dataset))):
-        sample = dataset[idx]
-        db_id = dataset.examples[idx][2]  # Get DB ID from dataset
-        input_ids = sample["input_ids"].unsqueeze(0).to(model.device)
-        attention_mask = sample["attention_mask"].unsqueeze(0).to(model.device)
+    if is_tokenized_dir(DEV_TOKENIZED):
+        mismatch = tokenized_mismatch(DEV_TOKENIZED, [DEV_TSV], tokenizer, num_examples=len(dataset),
+                                      max_input_length=dataset.max_input_length)
+        if mismatch is None:
+            tokenized = TokenizedSpiderDataset(DEV_TOKENIZED)
+            return [tokenized.input_ids(i).tolist() for i in indices]
+        print(f"⚠️ Not using {DEV_TOKENIZED} ({mismatch}), tokenizing {DEV_TSV} instead")
+    input_texts = [dataset.examples[i][0] for i in indices]
+    return tokenizer(input_texts, max_length=dataset.max_input_length, truncation=True)["input_ids"]
+
+
+def decode_batches(indices, input_ids, dataset, tokenizer, model, picard, batch_size, progress=True,
+                   profiler=None):
+    """
+    Decode the examples at `indices` in length-sorted batches, yielding [(idx, row), ...] per batch.
+    Split-encoding models only encode the questions; each schema is encoded once per run.
+    Batches are timed by the decoder's instrumentation; `profiler` (a ProfilerWindow) steps once per batch.
+    """
+    from tqdm import tqdm
+
+    from models.split_encoding import SchemaStateCache, is_split_encoding
+    from training.spider_dataset import split_input_text
+
+    instrumentation = picard.instrumentation
+    schema_states = SchemaStateCache(model, tokenizer) if is_split_encoding(model) else None
+    batches = length_sorted_batches([len(ids) for ids in input_ids], batch_size)
+    for batch_positions in tqdm(batches, disable=not progress):
+        batch_indices = [indices[p] for p in batch_positions]
+        db_ids = [dataset.examples[i][2] for i in batch_indices]  # Get DB IDs from dataset
+
+        if schema_states is not None:
+            segments = [split_input_text(dataset.examples[i][0]) for i in batch_indices]
+            encoder_outputs, attention_mask = schema_states.encode(
+                [question for question, _ in segments], [schema for _, schema in segments])
+            batch_input_ids = None
+        else:
+            batch = tokenizer.pad(
+                {
+                    "input_ids": [input_ids[p] for p in batch_positions],
+                    "attention_mask": [[1] * len(input_ids[p]) for p in batch_positions],
+                },
+                return_tensors="pt",
+            )
+            encoder_outputs = None
+            batch_input_ids = batch["input_ids"].to(model.device)
+            attention_mask = batch["attention_mask"].to(model.device)
 
         # === Picard decoding ===
-        with torch.no_grad():
-            outputs = picard.decode(
+        with instrumentation.stage("batch"):
+            results = picard.batch_decode(
                 model=model,
-                input_ids=input_ids,
+                input_ids=batch_input_ids,
                 attention_mask=attention_mask,
-                db_id=db_id,
-                max_length=max_tokens,
+                db_ids=db_ids,
+                max_length=MAX_TOKENS,
                 num_beams=4,
-                early_stopping=True
+                early_stopping=True,
+                encoder_outputs=encoder_outputs
             )
+        instrumentation.count(examples=len(batch_indices),
+                              input_tokens=sum(len(input_ids[p]) for p in batch_positions))
+        if profiler is not None:
+            profiler.step()
 
-        predicted_sql = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        ground_truth_sql = dataset.examples[idx][1]
+        yield [
+            (idx, (result["sql"], dataset.examples[idx][1], dataset.examples[idx][2], example_id(dataset, idx)))
+            for idx, result in zip(batch_indices, results)
+        ]
 
-        predictions.append((predicted_sql, ground_truth_sql))
 
-        # Optional: print a few samples
-        if idx < 5:
-            print("\n" + "=" * 60)
-            print("DB ID :", db_id)
-            print("INPUT :", tokenizer.decode(sample["input_ids"], skip_special_tokens=True))
-            print("PRED  :", predicted_sql)
-            print("GT    :", ground_truth_sql)
+def write_predictions(predictions, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        # example_id lets evaluation.predictions join rows to examples without relying on row order
+        writer.writerow(PREDICTION_HEADER)
+        writer.writerows(predictions)
+
+
+def evaluate_with_picard(batch_size=16, execution_guided=False, precision="fp32", instrument_path=None,
+                         profile_window=None):
+    """
+    Decode the dev set in one process. `instrument_path` turns on the stage timers
+    and receives their JSON report; `profile_window` (start, count) traces those
+    batches with the torch profiler.
+    """
+    instrumentation = Instrumentation() if instrument_path else None
+    tokenizer, model, dataset, picard = load_evaluation(execution_guided, precision, instrumentation)
+    profiler = ProfilerWindow(*profile_window, output_dir=PROFILE_DIR) if profile_window else None
+
+    indices = list(range(len(dataset)))
+    picard.instrumentation.start()
+    with picard.instrumentation.stage("tokenization"):
+        input_ids = encode_inputs(dataset, tokenizer, indices)
+    predictions = [None] * len(dataset)
+
+    print(f"Evaluating on {len(dataset)} dev examples in {-(-len(dataset) // batch_size)} batches...")
+
+    for rows in decode_batches(indices, input_ids, dataset, tokenizer, model, picard, batch_size,
+                               profiler=profiler):
+        for idx, row in rows:
+            predictions[idx] = row
+    picard.instrumentation.stop()
+    if profiler is not None:
+        profiler.close()
+
+    # Optional: print a few samples
+    for idx in range(min(5, len(dataset))):
+        print("\n" + "=" * 60)
+        print("DB ID :", dataset.examples[idx][2])
+        print("INPUT :", dataset.examples[idx][0])
+        print("PRED  :", predictions[idx][0])
+        print("GT    :", predictions[idx][1])
+
+    if execution_guided:
+        stats = picard.execution_stats
+        print(f"\nExecution-guided reranking: {stats['total_ms'] / max(stats['queries'], 1):.1f} ms/query "
+              f"(max {stats['max_ms']:.1f} ms), {stats['no_valid_beam']} queries without an executable beam")
 
     # Save predictions
-    os.makedirs(os.path.dirname(save_output_to), exist_ok=True)
-    with open(save_output_to, "w", encoding="utf-8", newline="") as f:
+    write_predictions(predictions, SAVE_OUTPUT_TO)
+
+    print(f"\n✅ Saved {len(predictions)} predictions to {SAVE_OUTPUT_TO}")
+    if instrumentation is not None:
+        instrumentation.report()
+        instrumentation.dump(instrument_path)
+        print(f"💾 Saved stage timings to {instrument_path}")
+
+
+# === Sharded evaluation ===
+
+def shard_path(shard, num_shards):
+    return os.path.join(SHARD_DIR, f"shard-{shard:03d}-of-{num_shards:03d}.tsv")
+
+
+def read_shard(path):
+    """
+    example_id -> row of a shard file. A line cut short by a crash is dropped
+    (and truncated from the file) so the example is decoded again on resume.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+    rows = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader, None)  # header
+        for row in reader:
+            if len(row) == len(PREDICTION_HEADER):
+                rows[row[3]] = tuple(row)
+    return rows
+
+
+def _evaluate_shard(shard, num_shards, batch_size, threads, resume, execution_guided, precision, instrument=False,
+                    profile_window=None):
+    """Decode every `num_shards`-th example starting at `shard`, flushing each batch to the shard file."""
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    instrumentation = Instrumentation() if instrument else None
+    tokenizer, model, dataset, picard = load_evaluation(execution_guided, precision, instrumentation)
+    profiler = ProfilerWindow(*profile_window, output_dir=PROFILE_DIR) if profile_window else None
+
+    path = shard_path(shard, num_shards)
+    done = read_shard(path) if resume else {}
+    indices = [i for i in range(shard, len(dataset), num_shards) if example_id(dataset, i) not in done]
+    with picard.instrumentation.stage("tokenization"):
+        input_ids = encode_inputs(dataset, tokenizer, indices)
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    new_file = not done
+    with open(path, "w" if new_file else "a", encoding="utf-8", newline="") as f:
         writer = csv.writer(f, delimiter="\t")
-        writer.writerow(["predicted_sql", "ground_truth_sql"])
-        writer.writerows(predictions)
+        if new_file:
+            writer.writerow(PREDICTION_HEADER)
+        for rows in decode_batches(indices, input_ids, dataset, tokenizer, model, picard, batch_size,
+                                   progress=shard == 0, profiler=profiler):
+            writer.writerows(row for _, row in rows)
+            f.flush()
+            os.fsync(f.fileno())
+    if profiler is not None:
+        profiler.close()
+
+    summary = {"shard": shard, "decoded": len(indices), "resumed": len(done)}
+    if instrumentation is not None:
+        summary["instrumentation"] = instrumentation.state()
+    return summary
+
+
+def dev_example_ids():
+    """Example ids of the dev TSV in row order (positional ids for older files)."""
+    order = []
+    with open(DEV_TSV, "r", encoding="utf-8") as f:
+        for idx, row in enumerate(csv.DictReader(f, delimiter="\t")):
+            order.append(row.get("example_id") or f"dev-{idx:05d}")
+    return order
+
+
+def prepare_shards(num_shards, resume):
+    """
+    Make the shard files match `num_shards` before the workers start. A fresh run
+    removes every shard file. On resume, the rows of shard files written with a
+    different --workers value are redistributed into this run's shards (then those
+    files are removed), so no finished example is decoded again.
+    """
+    paths = sorted(glob.glob(os.path.join(SHARD_DIR, "shard-*-of-*.tsv")))
+    if not resume:
+        for path in paths:
+            os.remove(path)
+        return
+    current = {shard_path(shard, num_shards) for shard in range(num_shards)}
+    stale = [path for path in paths if path not in current]
+    if not stale:
+        return
+
+    rows = {}
+    # Rows already in this layout win over the older ones
+    for path in stale + [path for path in paths if path in current]:
+        rows.update(read_shard(path))
+    counts = sorted({int(path[:-len(".tsv")].rsplit("-of-", 1)[1]) for path in stale})
+    print(f"⚠️ --resume with --workers {num_shards}, but shard files were written with --workers "
+          f"{', '.join(map(str, counts))}: redistributing their {len(rows)} predictions into {num_shards} shards")
+
+    order = dev_example_ids()
+    for shard in range(num_shards):
+        path = shard_path(shard, num_shards)
+        with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(PREDICTION_HEADER)
+            writer.writerows(rows[key] for key in order[shard::num_shards] if key in rows)
+        os.replace(path + ".tmp", path)
+    for path in stale:
+        os.remove(path)
+
+
+def merge_shard_predictions(num_shards, output_path):
+    """Write the shard rows in dev order, so the file matches a serial run."""
+    rows = {}
+    for shard in range(num_shards):
+        rows.update(read_shard(shard_path(shard, num_shards)))
+
+    order = dev_example_ids()
+    missing = [key for key in order if key not in rows]
+    if missing:
+        raise RuntimeError(f"{len(missing)} examples have no prediction yet (first: {missing[0]}); re-run with --resume")
+    write_predictions([rows[key] for key in order], output_path)
+    return len(order)
+
+
+def evaluate_sharded(num_workers=4, batch_size=16, threads_per_worker=None, resume=False, execution_guided=False,
+                     precision="fp32", instrument_path=None, profile_window=None):
+    """
+    Evaluate with `num_workers` processes, each running its own model (fp32 weights
+    are memory-mapped, so the workers share their pages) and writing its
+    predictions to a shard file as it goes. With `resume`, examples
+    already in the shard files are skipped, whatever `num_workers` wrote them
+    (see prepare_shards). Stage timings of all workers are merged; the profiler
+    window only traces worker 0.
+    """
+    instrumentation = Instrumentation() if instrument_path else None
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    prepare_shards(num_workers, resume)
+
+    # spawn: every worker builds its own model instead of inheriting the parent's torch state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(_evaluate_shard, shard, num_workers, batch_size, threads_per_worker, resume,
+                            execution_guided, precision, instrumentation is not None,
+                            profile_window if shard == 0 else None)
+            for shard in range(num_workers)
+        ]
+        for future in futures:
+            summary = future.result()
+            print(f"Shard {summary['shard']}: decoded {summary['decoded']}, "
+                  f"{summary['resumed']} already done")
+            if instrumentation is not None:
+                instrumentation.merge(summary["instrumentation"])
+
+    count = merge_shard_predictions(num_workers, SAVE_OUTPUT_TO)
+    print(f"\n✅ Saved {count} predictions to {SAVE_OUTPUT_TO}")
+    if instrumentation is not None:
+        # Throughput is over the whole run; stage totals add up the time of every worker
+        instrumentation.stop()
+        instrumentation.report()
+        instrumentation.dump(instrument_path)
+        print(f"💾 Saved stage timings to {instrument_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the trained model with Picard decoding")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="> 1 runs the sharded, resumable mode")
+    parser.add_argument("--threads-per-worker", type=int, help="torch threads per worker (default: cpus / workers)")
+    parser.add_argument("--resume", action="store_true", help="skip examples already in the shard files")
+    parser.add_argument("--execution-guided", action="store_true", help="rerank beams by whether they execute")
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS, help="int8 modes quantize for CPU")
+    parser.add_argument("--instrument", metavar="JSON", help="time every stage and write the report here")
+    parser.add_argument("--profile-steps", metavar="START:COUNT",
+                        help=f"torch profiler trace of these batches, saved to {PROFILE_DIR}")
+    args = parser.parse_args(argv)
+    profile_window = parse_window(args.profile_steps)
 
-    print(f"\n✅ Saved {len(predictions)} predictions to {save_output_to}")
+    if args.workers > 1 or args.resume:
+        evaluate_sharded(num_workers=args.workers, batch_size=args.batch_size,
+                         threads_per_worker=args.threads_per_worker, resume=args.resume,
+                         execution_guided=args.execution_guided, precision=args.precision,
+                         instrument_path=args.instrument, profile_window=profile_window)
+    else:
+        evaluate_with_picard(batch_size=args.batch_size, execution_guided=args.execution_guided,
+                             precision=args.precision, instrument_path=args.instrument,
+                             profile_window=profile_window)
 
 
 if __name__ == "__main__":
-    evaluate_with_picard()
+    main()
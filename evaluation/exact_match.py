@@ -0,0 +1,494 @@
+#Spider-style exact set match: parse SQL into order-insensitive components (select, where, group, ...)
+#with aliases resolved, so "SELECT T1.a, T1.b" and "SELECT b, a" over the same table score as equal
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from preprocess.schema_registry import fingerprint_of
+from preprocess.schema_utils import load_tables
+from preprocess.spider_data import iter_spider_data
+
+# Part of every CanonicalCache key: bump when canonicalize() output changes so stored forms are not reused
+CANONICAL_VERSION = 1
+
+TOKEN_RE = re.compile(r"""
+    '(?:[^']|'')*'                                  # single-quoted string
+  | "(?:[^"]|"")*"                                  # double-quoted string
+  | `[^`]*`                                         # backquoted identifier
+  | \d+(?:\.\d+)?                                   # number
+  | [a-z_][a-z0-9_]*(?:\.(?:[a-z_][a-z0-9_]*|\*))?  # identifier, optionally qualified
+  | !=|<>|>=|<=|[=<>(),*+\-/;%]
+""", re.IGNORECASE | re.VERBOSE)
+
+CLAUSES = ('select', 'from', 'where', 'group', 'having', 'order', 'limit')
+SET_OPS = ('union', 'intersect', 'except')
+FROM_SEPARATORS = ('join', ',', 'inner', 'left', 'right', 'outer', 'cross')
+AGGREGATES = frozenset({'count', 'sum', 'avg', 'min', 'max'})
+# Non-column words that can appear inside expressions and conditions
+EXPR_WORDS = AGGREGATES | {'distinct', 'not', 'in', 'like', 'between', 'and', 'or', 'is', 'null', 'exists', 'asc', 'desc'}
+# Spider's "keywords" component
+KEYWORDS = frozenset({'where', 'group', 'having', 'order', 'limit', 'distinct', 'not', 'in', 'like', 'or',
+                      'asc', 'desc'}) | frozenset(SET_OPS)
+COMPONENTS = ('select', 'from', 'where', 'and_or', 'group', 'having', 'order', 'limit', 'iuen', 'keywords')
+
+
+class SqlParseError(ValueError):
+    pass
+
+
+def tokenize_sql(sql: str) -> List[str]:
+    """Lowercased SQL tokens; string literals keep their case and use single quotes."""
+    tokens = []
+    for token in TOKEN_RE.findall(sql):
+        if token[0] == '"':
+            token = "'" + token[1:-1] + "'"
+        elif token[0] == '`':
+            token = token[1:-1].lower()
+        elif token[0] != "'":
+            token = token.lower()
+        if token != ';':
+            tokens.append(token)
+    return tokens
+
+
+def _is_literal(token: str) -> bool:
+    return token[0] == "'" or token[0].isdigit()
+
+
+def _split_top_level(tokens: List[str], separators) -> List[List[str]]:
+    """Split on separator tokens outside parentheses (the AND of BETWEEN x AND y is not a separator)."""
+    parts, current, depth, in_between = [], [], 0, False
+    for token in tokens:
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        if depth == 0 and token in separators and not (token == 'and' and in_between):
+            parts.append(current)
+            current = []
+            continue
+        if depth == 0 and token == 'between':
+            in_between = True
+        elif depth == 0 and token == 'and':
+            in_between = False
+        current.append(token)
+    parts.append(current)
+    return parts
+
+
+class _QueryParser:
+    """Parses one tokenized query (and its nested queries) into a canonical, hashable tuple."""
+
+    def __init__(self, tokens: List[str], table_columns: Dict[str, set], ignore_values: bool):
+        self.tokens = tokens
+        self.table_columns = table_columns
+        self.ignore_values = ignore_values
+        self.scope = ({}, ())
+
+    def child(self, tokens: List[str]) -> '_QueryParser':
+        """Parser for a nested query, sharing the schema lookups."""
+        return _QueryParser(tokens, self.table_columns, self.ignore_values)
+
+    def parse(self) -> tuple:
+        canonical, end = self.query(0)
+        if end != len(self.tokens):
+            raise SqlParseError(f"unexpected token {self.tokens[end]!r}")
+        return canonical
+
+    def query(self, pos: int) -> Tuple[tuple, int]:
+        """Parse a query starting at `pos`; stops at an unmatched ')' or the end."""
+        if pos >= len(self.tokens) or self.tokens[pos] != 'select':
+            raise SqlParseError("query must start with SELECT")
+
+        clauses, iuen = {}, None
+        current, depth = None, 0
+        while pos < len(self.tokens):
+            token = self.tokens[pos]
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            if depth == 0 and token in SET_OPS:
+                right, pos = self.query(pos + 1)
+                iuen = (token, right)
+                break
+            if depth == 0 and token in CLAUSES and token not in clauses:
+                current = token
+                clauses[current] = []
+                # "group by" / "order by"
+                if token in ('group', 'order') and pos + 1 < len(self.tokens) and self.tokens[pos + 1] == 'by':
+                    pos += 1
+            else:
+                clauses[current].append(token)
+            pos += 1
+
+        return self.components(clauses, iuen), pos
+
+    def components(self, clauses: Dict[str, List[str]], iuen: Optional[tuple]) -> tuple:
+        aliases, tables = self.from_clause(clauses.get('from', []))
+        self.scope = (aliases, tables)
+
+        select_tokens = clauses.get('select', [])
+        distinct = bool(select_tokens) and select_tokens[0] == 'distinct'
+        if distinct:
+            select_tokens = select_tokens[1:]
+        select = (distinct, self.unordered(self.expression(self.strip_alias(item))
+                                           for item in _split_top_level(select_tokens, {','})))
+
+        where, where_ops = self.conditions(clauses.get('where', []))
+        having, having_ops = self.conditions(clauses.get('having', []))
+        group = self.unordered(self.expression(item) for item in _split_top_level(clauses.get('group', []), {','}) if item)
+
+        order = []
+        for item in _split_top_level(clauses.get('order', []), {','}):
+            if not item:
+                continue
+            direction = 'asc'
+            if item[-1] in ('asc', 'desc'):
+                direction = item[-1]
+                item = item[:-1]
+            order.append((self.expression(item), direction))
+
+        limit = None
+        if 'limit' in clauses:
+            limit = 'value' if self.ignore_values else ' '.join(clauses['limit'])
+
+        keywords = {clause for clause in clauses if clause in KEYWORDS}
+        for name, tokens in clauses.items():
+            if name != 'from':
+                keywords.update(token for token in tokens if token in KEYWORDS)
+        if order:
+            keywords.update(direction for _, direction in order)
+        if iuen:
+            keywords.add(iuen[0])
+
+        return (select, tables, where, frozenset(where_ops | having_ops), group, having,
+                tuple(order), limit, iuen, frozenset(keywords))
+
+    def from_clause(self, tokens: List[str]) -> Tuple[Dict[str, str], tuple]:
+        """Alias map and sorted table units; ON conditions are dropped, as in Spider."""
+        aliases, units = {}, []
+        pos = 0
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token in FROM_SEPARATORS:
+                pos += 1
+                continue
+            if token == 'on':
+                # Skip the join condition up to the next JOIN
+                while pos < len(tokens) and tokens[pos] not in FROM_SEPARATORS:
+                    pos += 1
+                continue
+
+            if token == '(' and pos + 1 < len(tokens) and tokens[pos + 1] == 'select':
+                unit, pos = self.child(tokens).query(pos + 1)
+            else:
+                unit = token
+                aliases[token] = token
+            units.append(unit)
+            pos += 1
+
+            # Optional alias: "table AS t1" or "table t1"
+            if pos < len(tokens) and tokens[pos] == 'as':
+                pos += 1
+            if pos < len(tokens) and tokens[pos] not in FROM_SEPARATORS and tokens[pos] not in ('on', '(', ')'):
+                if isinstance(unit, str):
+                    aliases[tokens[pos]] = unit
+                pos += 1
+        return aliases, tuple(sorted(units, key=repr))
+
+    def column(self, token: str) -> str:
+        aliases, tables = self.scope
+        if '.' in token:
+            prefix, name = token.split('.', 1)
+            return f"{aliases.get(prefix, prefix)}.{name}"
+        table_names = [t for t in tables if isinstance(t, str)]
+        owners = [t for t in table_names if token in self.table_columns.get(t, ())]
+        if len(owners) == 1:
+            return f"{owners[0]}.{token}"
+        if len(table_names) == 1:
+            return f"{table_names[0]}.{token}"
+        return token
+
+    def expression(self, tokens: List[str]) -> tuple:
+        items = []
+        pos = 0
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token == '(' and pos + 1 < len(tokens) and tokens[pos + 1] == 'select':
+                subquery, end = self.child(tokens).query(pos + 1)
+                items.append(subquery)
+                pos = end + 1
+                continue
+            if _is_literal(token):
+                items.append('value' if self.ignore_values else token)
+            elif token == '<>':
+                items.append('!=')
+            elif token[0].isalpha() or token[0] == '_':
+                items.append(token if token in EXPR_WORDS else self.column(token))
+            else:
+                items.append(token)
+            pos += 1
+        return tuple(items)
+
+    def conditions(self, tokens: List[str]) -> Tuple[frozenset, set]:
+        if not tokens:
+            return frozenset(), set()
+        parts = _split_top_level(tokens, {'and', 'or'})
+        operators = {token for token in tokens if token in ('and', 'or')} if len(parts) > 1 else set()
+        return frozenset(self.expression(part) for part in parts), operators
+
+    @staticmethod
+    def strip_alias(tokens: List[str]) -> List[str]:
+        if len(tokens) > 2 and tokens[-2] == 'as':
+            return tokens[:-2]
+        return tokens
+
+    @staticmethod
+    def unordered(items) -> tuple:
+        return tuple(sorted(items, key=repr))
+
+
+def table_columns(schema: Optional[dict]) -> Dict[str, set]:
+    """Lowercased table name -> set of its lowercased column names."""
+    columns = {}
+    if schema:
+        tables = [name.lower() for name in schema['table_names_original']]
+        for table_id, column in schema['column_names_original']:
+            if table_id >= 0:
+                columns.setdefault(tables[table_id], set()).add(column.lower())
+    return columns
+
+
+def canonicalize(sql: str, schema: Optional[dict] = None, ignore_values: bool = True,
+                 columns: Optional[Dict[str, set]] = None) -> Optional[tuple]:
+    """
+    Canonical component form of `sql` (a tuple in COMPONENTS order), or None if it
+    cannot be parsed. With a schema, unqualified columns are resolved to their table.
+    Literal values are replaced by a placeholder unless `ignore_values` is False.
+    """
+    if columns is None:
+        columns = table_columns(schema)
+    try:
+        return _QueryParser(tokenize_sql(sql), columns, ignore_values).parse()
+    except (SqlParseError, IndexError):
+        return None
+
+
+def component_matches(pred: Optional[tuple], gold: Optional[tuple]) -> Dict[str, bool]:
+    if pred is None or gold is None:
+        return {name: False for name in COMPONENTS}
+    return {name: p == g for name, p, g in zip(COMPONENTS, pred, gold)}
+
+
+class CanonicalStore:
+    """
+    key -> pickled canonical form in SQLite. Every scoring worker writes to the
+    same file, so it runs in WAL mode (readers do not block the writer) and waits
+    up to `timeout` seconds for another worker's write instead of failing.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS canonical_forms (key TEXT PRIMARY KEY, value BLOB)")
+        self._connection.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[tuple]]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, value in self._connection.execute(
+                    f"SELECT key, value FROM canonical_forms WHERE key IN ({placeholders})", chunk):
+                found[key] = pickle.loads(value)
+        return found
+
+    def put_many(self, items: Dict[str, Optional[tuple]]):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO canonical_forms (key, value) VALUES (?, ?)",
+                [(key, pickle.dumps(value)) for key, value in items.items()],
+            )
+
+    def close(self):
+        self._connection.close()
+
+
+class CanonicalCache:
+    """
+    Canonical forms keyed by (db_id, schema fingerprint, query text): an in-memory
+    LRU in front of an optional on-disk store, so re-scoring a file only parses
+    queries it has not seen. A changed schema or CANONICAL_VERSION misses the store.
+    """
+
+    def __init__(self, schemas: Optional[Dict[str, dict]] = None, path: Optional[str] = None,
+                 max_size: int = 100000, ignore_values: bool = True):
+        self.schemas = schemas or {}
+        self.max_size = max_size
+        self.ignore_values = ignore_values
+        self._memory = OrderedDict()
+        self._store = CanonicalStore(path) if path else None
+        self._columns = {}
+        self._fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, db_id: str, sql: str) -> str:
+        fingerprint = self._fingerprints.get(db_id)
+        if fingerprint is None:
+            fingerprint = fingerprint_of(self.schemas, db_id) if db_id in self.schemas else ""
+            self._fingerprints[db_id] = fingerprint
+        text = f"{db_id}\x00{fingerprint}\x00{CANONICAL_VERSION}\x00{int(self.ignore_values)}\x00{sql}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, canonical: Optional[tuple]):
+        self._memory[key] = canonical
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, queries: List[Tuple[str, str]]) -> List[Optional[tuple]]:
+        """Canonical forms for a list of (db_id, sql) pairs, parsing only cache misses."""
+        keys = [self.key(db_id, sql) for db_id, sql in queries]
+        unknown = sorted({key for key in keys if key not in self._memory})
+        if unknown and self._store:
+            for key, canonical in self._store.get_many(unknown).items():
+                self._remember(key, canonical)
+
+        parsed = {}
+        for key, (db_id, sql) in zip(keys, queries):
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            elif key not in parsed:
+                if db_id not in self._columns:
+                    if hasattr(self.schemas, "entry") and db_id in self.schemas:
+                        self._columns[db_id] = self.schemas.entry(db_id).table_columns
+                    else:
+                        self._columns[db_id] = table_columns(self.schemas.get(db_id))
+                parsed[key] = canonicalize(sql, ignore_values=self.ignore_values, columns=self._columns[db_id])
+                self._remember(key, parsed[key])
+                self.misses += 1
+
+        if parsed and self._store:
+            self._store.put_many(parsed)
+        return [self._memory[key] if key in self._memory else parsed[key] for key in keys]
+
+    def get(self, db_id: str, sql: str) -> Optional[tuple]:
+        return self.get_many([(db_id, sql)])[0]
+
+    def close(self):
+        if self._store:
+            self._store.close()
+
+
+def exact_set_match(pred_sql: str, gold_sql: str, schema: Optional[dict] = None) -> bool:
+    pred = canonicalize(pred_sql, schema)
+    return pred is not None and pred == canonicalize(gold_sql, schema)
+
+
+# === Streaming, multi-process scoring of prediction files ===
+
+_worker_cache = None
+
+
+def _init_worker(tables_path: Optional[str], cache_path: Optional[str]):
+    global _worker_cache
+    schemas = load_tables(tables_path) if tables_path and os.path.exists(tables_path) else None
+    _worker_cache = CanonicalCache(schemas=schemas, path=cache_path)
+
+
+def _score_chunk(items: List[dict]) -> List[dict]:
+    queries = [(item['db_id'], item['query']) for item in items] + [(item['db_id'], item['gold']) for item in items]
+    forms = _worker_cache.get_many(queries)
+    scored = []
+    for item, pred, gold in zip(items, forms[:len(items)], forms[len(items):]):
+        components = component_matches(pred, gold)
+        scored.append({**item, 'exact_match': pred is not None and pred == gold, 'component_match': components})
+    return scored
+
+
+def _chunks(items: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_predictions(items: Iterator[dict], tables_path: Optional[str] = None, cache_path: Optional[str] = None,
+                      workers: int = 4, chunk_size: int = 256) -> Iterator[dict]:
+    """Yield each {"query", "gold", "db_id"} item with exact_match and component_match added, in order."""
+    if workers <= 1:
+        _init_worker(tables_path, cache_path)
+        for chunk in _chunks(items, chunk_size):
+            yield from _score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(tables_path, cache_path)) as executor:
+        # Bounded look-ahead keeps memory flat on large files
+        pending = []
+        for chunk in _chunks(items, chunk_size):
+            pending.append(executor.submit(_score_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spider-style exact set match of a predictions file")
+    parser.add_argument("--predictions", default="output/predictions/t5_dev_predictions_spider.json")
+    parser.add_argument("--output", help="write scored items here (defaults to updating --predictions)")
+    parser.add_argument("--tables", default="data/spider_data/tables.json")
+    parser.add_argument("--cache", default="output/cache/canonical_sql.sqlite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    output_path = args.output or args.predictions
+    temp_path = output_path + ".tmp"
+    start = time.perf_counter()
+    total, correct = 0, 0
+    component_totals = dict.fromkeys(COMPONENTS, 0)
+
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for item in score_predictions(iter_spider_data(args.predictions), tables_path=args.tables,
+                                      cache_path=args.cache, workers=args.workers, chunk_size=args.chunk_size):
+            if total:
+                f.write(",\n")
+            f.write(json.dumps(item, ensure_ascii=False))
+            total += 1
+            correct += item['exact_match']
+            for name, match in item['component_match'].items():
+                component_totals[name] += match
+        f.write("\n]\n")
+    os.replace(temp_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"📈 Exact set match: {100 * correct / max(total, 1):.2f}% ({correct}/{total}) in {elapsed:.1f}s")
+    for name in COMPONENTS:
+        print(f"  {name:<9} {100 * component_totals[name] / max(total, 1):.2f}%")
+    print(f"💾 Saved scored predictions to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
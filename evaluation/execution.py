@@ -0,0 +1,261 @@
+#Execution accuracy: run predicted and gold SQL against the Spider SQLite databases and compare result sets
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from preprocess.value_index import database_file, file_hash
+
+# Result of running one query: (ok, rows or error message)
+ExecResult = Tuple[bool, Any]
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class DatabasePool:
+    """
+    Read-only SQLite connections, opened once per db_id and reused for every query.
+
+    Each query runs under a progress handler that aborts it once `timeout` seconds
+    have passed, so a runaway prediction (e.g. a cartesian join) only costs its own
+    time budget instead of stalling the whole evaluation.
+    """
+
+    def __init__(self, db_dir: str, timeout: float = 5.0, max_rows: Optional[int] = None,
+                 progress_steps: int = 10000):
+        self.db_dir = db_dir
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.progress_steps = progress_steps
+        self._connections = {}
+
+    def db_file(self, db_id: str) -> str:
+        return database_file(self.db_dir, db_id)
+
+    def connection(self, db_id: str) -> sqlite3.Connection:
+        if db_id not in self._connections:
+            uri = f"file:{os.path.abspath(self.db_file(db_id))}?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            # Spider databases contain some non-UTF-8 text
+            connection.text_factory = lambda b: b.decode(errors="ignore")
+            self._connections[db_id] = connection
+        return self._connections[db_id]
+
+    def execute(self, db_id: str, sql: str, timeout: Optional[float] = None) -> ExecResult:
+        """Run `sql` on `db_id`; returns (True, rows) or (False, error message)."""
+        if not os.path.exists(self.db_file(db_id)):
+            return False, f"database not found: {db_id}"
+
+        connection = self.connection(db_id)
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+
+        def check_deadline():
+            # A non-zero return value interrupts the running statement
+            return 1 if time.perf_counter() > deadline else 0
+
+        connection.set_progress_handler(check_deadline, self.progress_steps)
+        try:
+            cursor = connection.execute(sql)
+            rows = cursor.fetchall() if self.max_rows is None else cursor.fetchmany(self.max_rows)
+            return True, rows
+        except sqlite3.OperationalError as e:
+            if time.perf_counter() > deadline:
+                return False, "timeout"
+            return False, str(e)
+        except Exception as e:
+            return False, str(e)
+        finally:
+            connection.set_progress_handler(None, 0)
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = {}
+
+
+class GoldResultCache:
+    """
+    Persistent gold result sets keyed by a hash of (db_id, database contents, query),
+    stored in SQLite. The content hash of each database file is kept alongside with
+    its size and mtime, so it is only recomputed when the file has been touched.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS databases "
+                                 "(db_id TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)")
+        self._connection.commit()
+
+    @staticmethod
+    def key(db_id: str, sql: str, db_hash: str = "") -> str:
+        return hashlib.sha256(f"{db_id}\x00{db_hash}\x00{sql}".encode("utf-8")).hexdigest()
+
+    def database_hash(self, db_id: str, path: str) -> str:
+        """Content hash of a database file ("" if it is missing), rehashed only when its size or mtime changed."""
+        if not os.path.exists(path):
+            return ""
+        stat = os.stat(path)
+        row = self._connection.execute("SELECT size, mtime, hash FROM databases WHERE db_id = ?", (db_id,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        content_hash = file_hash(path)
+        self._connection.execute("INSERT OR REPLACE INTO databases (db_id, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                                 (db_id, stat.st_size, stat.st_mtime, content_hash))
+        self._connection.commit()
+        return content_hash
+
+    def get_many(self, keys: List[str]) -> Dict[str, ExecResult]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, value in self._connection.execute(
+                    f"SELECT key, value FROM results WHERE key IN ({placeholders})", chunk):
+                found[key] = pickle.loads(value)
+        return found
+
+    def put_many(self, items: Dict[str, ExecResult]):
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+            [(key, pickle.dumps(value)) for key, value in items.items()],
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+def results_match(pred: ExecResult, gold: ExecResult, ordered: bool = False) -> bool:
+    """Spider-style result comparison: same rows (as a multiset unless the gold query orders them)."""
+    pred_ok, pred_rows = pred
+    gold_ok, gold_rows = gold
+    if not pred_ok or not gold_ok:
+        return False
+    if ordered:
+        return [tuple(map(repr, row)) for row in pred_rows] == [tuple(map(repr, row)) for row in gold_rows]
+    return Counter(tuple(map(repr, row)) for row in pred_rows) == Counter(tuple(map(repr, row)) for row in gold_rows)
+
+
+# === Process pool workers ===
+
+_worker_pool = None
+
+
+def _init_worker(db_dir: str, timeout: float, max_rows: Optional[int]):
+    global _worker_pool
+    _worker_pool = DatabasePool(db_dir, timeout=timeout, max_rows=max_rows)
+
+
+def _execute_batch(batch: List[Tuple[str, str]]) -> List[ExecResult]:
+    return [_worker_pool.execute(db_id, sql) for db_id, sql in batch]
+
+
+def execute_all(queries: List[Tuple[str, str]], db_dir: str, workers: int = 4, timeout: float = 5.0,
+                max_rows: Optional[int] = None, chunk_size: int = 16) -> List[ExecResult]:
+    """
+    Execute (db_id, sql) pairs in a process pool. Queries are grouped by database so
+    each worker reuses its pooled connection.
+    """
+    order = sorted(range(len(queries)), key=lambda i: queries[i][0])
+    chunks = [order[start:start + chunk_size] for start in range(0, len(order), chunk_size)]
+
+    results = [None] * len(queries)
+    if workers <= 1:
+        _init_worker(db_dir, timeout, max_rows)
+        outputs = map(_execute_batch, ([queries[i] for i in chunk] for chunk in chunks))
+        for chunk, chunk_results in zip(chunks, outputs):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(db_dir, timeout, max_rows)) as executor:
+        outputs = executor.map(_execute_batch, [[queries[i] for i in chunk] for chunk in chunks])
+        for chunk, chunk_results in zip(chunks, outputs):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+    return results
+
+
+def evaluate_execution(items: List[dict], db_dir: str, cache_path: Optional[str] = None,
+                       workers: int = 4, timeout: float = 5.0) -> List[bool]:
+    """
+    Execution match for prediction items with "query", "gold" and "db_id" keys.
+    Gold results come from the on-disk cache when available, so evaluating a new
+    checkpoint only executes its predictions; a database whose file changed since
+    its results were cached has them executed again.
+    """
+    cache = GoldResultCache(cache_path) if cache_path else None
+    db_hashes = {}
+    if cache:
+        for db_id in sorted({item["db_id"] for item in items}):
+            db_hashes[db_id] = cache.database_hash(db_id, database_file(db_dir, db_id))
+    gold_keys = [GoldResultCache.key(item["db_id"], item["gold"], db_hashes.get(item["db_id"], "")) for item in items]
+    gold_results = cache.get_many(sorted(set(gold_keys))) if cache else {}
+
+    missing = {}
+    for key, item in zip(gold_keys, items):
+        if key not in gold_results and key not in missing:
+            missing[key] = (item["db_id"], item["gold"])
+
+    queries = [(item["db_id"], item["query"]) for item in items] + list(missing.values())
+    results = execute_all(queries, db_dir, workers=workers, timeout=timeout)
+
+    pred_results = results[:len(items)]
+    new_gold = dict(zip(missing, results[len(items):]))
+    gold_results.update(new_gold)
+    if cache:
+        # Timeouts are not cached: they depend on the machine rather than the query
+        cache.put_many({key: result for key, result in new_gold.items() if result != (False, "timeout")})
+        cache.close()
+
+    return [
+        results_match(pred, gold_results[key], ordered="order by" in item["gold"].lower())
+        for item, pred, key in zip(items, pred_results, gold_keys)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Execution accuracy of Spider-format predictions")
+    parser.add_argument("--predictions", default="output/predictions/t5_dev_predictions_spider.json")
+    parser.add_argument("--db-dir", default="data/spider_data/database")
+    parser.add_argument("--cache", default="output/cache/gold_results.sqlite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds per query")
+    parser.add_argument("--write", action="store_true", help="store exec_match back into the predictions file")
+    args = parser.parse_args(argv)
+
+    with open(args.predictions, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    start = time.perf_counter()
+    matches = evaluate_execution(items, args.db_dir, cache_path=args.cache,
+                                 workers=args.workers, timeout=args.timeout)
+    elapsed = time.perf_counter() - start
+
+    correct = sum(matches)
+    print(f"📈 Execution accuracy: {100 * correct / max(len(items), 1):.2f}% ({correct}/{len(items)}) "
+          f"in {elapsed:.1f}s")
+
+    if args.write:
+        for item, match in zip(items, matches):
+            item["exec_match"] = match
+        with open(args.predictions, "w", encoding="utf-8") as f:
+            json.dump(items, f, indent=2, ensure_ascii=False)
+        print(f"💾 Saved exec_match to {args.predictions}")
+
+
+if __name__ == "__main__":
+    main()
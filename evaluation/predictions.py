@@ -0,0 +1,211 @@
+#Streaming predictions pipeline: join a predictions TSV to the processed examples by example_id,
+#score it with exact set match and append the results to a JSONL file, re-scoring only rows that changed
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from evaluation.exact_match import CANONICAL_VERSION, COMPONENTS, score_predictions
+from preprocess.schema_registry import fingerprint_of
+from preprocess.schema_utils import load_tables
+
+
+def example_fingerprint(db_id: str, query: str, gold: str, schema_fingerprint: str = "") -> str:
+    """What a score depends on: the example, its database's schema and the canonicalizer version."""
+    text = f"{db_id}\x00{query}\x00{gold}\x00{schema_fingerprint}\x00{CANONICAL_VERSION}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def load_examples(path: str, split: str = "dev") -> Dict[str, Tuple[str, str]]:
+    """
+    example_id -> (db_id, gold SQL) from a processed TSV. Files written before
+    example ids existed get the builder's positional ids ("dev-00042").
+    """
+    examples = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for i, row in enumerate(csv.DictReader(f, delimiter="\t")):
+            example_id = row.get("example_id") or f"{split}-{i:05d}"
+            examples[example_id] = (row.get("db_id", "unknown"), row["target"])
+    return examples
+
+
+def iter_joined(predictions_path: str, examples: Dict[str, Tuple[str, str]], split: str = "dev",
+                stats: Optional[dict] = None) -> Iterator[dict]:
+    """
+    Stream {"example_id", "db_id", "query", "gold"} items for each predictions row.
+
+    Rows are matched by their example_id column. Older files without one are
+    matched by position, but only rows whose ground truth agrees with the example
+    are kept, so one missing row cannot shift every later prediction.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("unmatched", 0)
+    with open(predictions_path, "r", encoding="utf-8") as f:
+        for i, row in enumerate(csv.DictReader(f, delimiter="\t")):
+            example_id = row.get("example_id") or f"{split}-{i:05d}"
+            if example_id not in examples:
+                stats["unmatched"] += 1
+                continue
+            db_id, gold = examples[example_id]
+            if not row.get("example_id") and row.get("ground_truth_sql", gold).strip() != gold.strip():
+                stats["unmatched"] += 1
+                continue
+            yield {"example_id": example_id, "db_id": db_id, "query": row["predicted_sql"], "gold": gold}
+
+
+def scan_scored(path: str) -> Tuple[Dict[str, int], Dict[str, str], int]:
+    """
+    Byte offset and fingerprint of the latest record per example_id in a scored
+    JSONL file, plus the total number of records (superseded ones included).
+    A last line cut short by a crash is dropped (and truncated from the file) so
+    the example is scored again.
+    """
+    offsets, fingerprints = {}, {}
+    records = 0
+    if not os.path.exists(path):
+        return offsets, fingerprints, records
+    with open(path, "rb+") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except json.JSONDecodeError:
+                    record = None
+                if record is None:
+                    if f.read(1):
+                        raise ValueError(f"{path}: unreadable record at byte {offset}")
+                    f.truncate(offset)
+                    break
+                offsets[record["example_id"]] = offset
+                fingerprints[record["example_id"]] = record["fingerprint"]
+                records += 1
+            offset += len(line)
+    return offsets, fingerprints, records
+
+
+def iter_latest(path: str, offsets: Dict[str, int]) -> Iterator[dict]:
+    """Latest record of each example, in example_id order, read by seeking to each offset."""
+    with open(path, "rb") as f:
+        for example_id in sorted(offsets):
+            f.seek(offsets[example_id])
+            yield json.loads(f.readline())
+
+
+def compact(path: str, offsets: Dict[str, int]):
+    """Rewrite the JSONL file with only the latest record of each example."""
+    with open(path + ".tmp", "w", encoding="utf-8") as out:
+        for record in iter_latest(path, offsets):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def update_scores(predictions_path: str, examples_path: str, output_path: str, split: str = "dev",
+                  tables_path: Optional[str] = None, cache_path: Optional[str] = None,
+                  workers: int = 4, chunk_size: int = 256) -> dict:
+    """
+    Score the predictions that are new or changed since the last run and append
+    them to `output_path`. Returns counts and accuracy over the examples in the
+    predictions file (scores of examples it no longer contains are kept but not counted).
+    """
+    examples = load_examples(examples_path, split)
+    _, fingerprints, _ = scan_scored(output_path)
+    schemas = load_tables(tables_path) if tables_path and os.path.exists(tables_path) else {}
+
+    stats = {"unmatched": 0, "unchanged": 0, "scored": 0}
+    predicted = set()
+
+    def changed_items():
+        for item in iter_joined(predictions_path, examples, split, stats):
+            predicted.add(item["example_id"])
+            schema = fingerprint_of(schemas, item["db_id"]) if item["db_id"] in schemas else ""
+            item["fingerprint"] = example_fingerprint(item["db_id"], item["query"], item["gold"], schema)
+            if fingerprints.get(item["example_id"]) == item["fingerprint"]:
+                stats["unchanged"] += 1
+                continue
+            yield item
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "a", encoding="utf-8") as f:
+        for scored in score_predictions(changed_items(), tables_path=tables_path, cache_path=cache_path,
+                                        workers=workers, chunk_size=chunk_size):
+            f.write(json.dumps(scored, ensure_ascii=False) + "\n")
+            stats["scored"] += 1
+            if stats["scored"] % chunk_size == 0:
+                f.flush()
+
+    # Superseded records pile up when predictions change; drop them once they dominate
+    offsets, _, records = scan_scored(output_path)
+    if records > 2 * len(offsets):
+        compact(output_path, offsets)
+        offsets, _, records = scan_scored(output_path)
+    offsets = {example_id: offset for example_id, offset in offsets.items() if example_id in predicted}
+
+    correct = 0
+    component_totals = dict.fromkeys(COMPONENTS, 0)
+    for record in iter_latest(output_path, offsets):
+        correct += record["exact_match"]
+        for name, match in record["component_match"].items():
+            component_totals[name] += match
+
+    stats.update({
+        "examples": len(offsets),
+        "exact_match": correct,
+        "accuracy": correct / max(len(offsets), 1),
+        "components": {name: total / max(len(offsets), 1) for name, total in component_totals.items()},
+    })
+    return stats
+
+
+def export_spider_json(scored_path: str, output_path: str):
+    """Write the latest records as the JSON array read by evaluation.execution and the Spider scripts."""
+    offsets, _, _ = scan_scored(scored_path)
+    with open(output_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i, record in enumerate(iter_latest(scored_path, offsets)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps({key: record[key] for key in ("example_id", "query", "gold", "db_id", "exact_match")},
+                               ensure_ascii=False))
+        f.write("\n]\n")
+    os.replace(output_path + ".tmp", output_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Join predictions to Spider examples and score them incrementally")
+    parser.add_argument("--predictions", default="output/predictions/picard_dev_predictions.tsv")
+    parser.add_argument("--examples", default="output/processed/dev.tsv")
+    parser.add_argument("--split", default="dev", help="split name used for positional example ids")
+    parser.add_argument("--output", help="scored JSONL (defaults to the predictions path with .jsonl)")
+    parser.add_argument("--spider-json", help="also export the scored predictions as a Spider-format JSON array")
+    parser.add_argument("--tables", default="data/spider_data/tables.json")
+    parser.add_argument("--cache", default="output/cache/canonical_sql.sqlite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    output_path = args.output or os.path.splitext(args.predictions)[0] + ".jsonl"
+    start = time.perf_counter()
+    stats = update_scores(args.predictions, args.examples, output_path, split=args.split,
+                          tables_path=args.tables, cache_path=args.cache,
+                          workers=args.workers, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    print(f"🔄 Scored {stats['scored']} new or changed predictions, {stats['unchanged']} unchanged "
+          f"in {elapsed:.1f}s")
+    if stats["unmatched"]:
+        print(f"⚠️ {stats['unmatched']} prediction rows did not match any example and were skipped")
+    print(f"📈 Exact set match: {100 * stats['accuracy']:.2f}% ({stats['exact_match']}/{stats['examples']})")
+    print(f"💾 Saved scores to {output_path}")
+
+    if args.spider_json:
+        export_spider_json(output_path, args.spider_json)
+        print(f"💾 Saved predictions in Spider format to {args.spider_json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#Model loading for evaluation and serving, with optional int8 dynamic quantization for CPU inference.
+#torch and transformers are imported on first use, so command lines can read PRECISIONS without them
+
+import os
+import warnings
+from typing import Optional
+
+WEIGHTS_FILE = "model.safetensors"
+
+# fp32:      the checkpoint as trained
+# int8:      int8 dynamic quantization of every linear layer except the LM head
+# int8-full: also int8 LM head and 8-bit (weight-only) token embeddings
+PRECISIONS = ("fp32", "int8", "int8-full")
+
+
+def quantize_model(model: "T5ForConditionalGeneration", precision: str) -> "T5ForConditionalGeneration":
+    """Apply `precision` to a model in eval mode (int8 modes run on CPU only)."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r}, expected one of {PRECISIONS}")
+    if precision == "fp32":
+        return model
+
+    import torch
+    from torch.ao.quantization import default_dynamic_qconfig, float_qparams_weight_only_qconfig, quantize_dynamic
+
+    model.to("cpu")
+    qconfig_spec = {torch.nn.Linear: default_dynamic_qconfig}
+    if precision == "int8":
+        # The LM head picks every output token, so it stays in full precision
+        qconfig_spec["lm_head"] = None
+
+    with warnings.catch_warnings():
+        # torch.ao eager-mode quantization emits a migration notice on every call
+        warnings.simplefilter("ignore")
+        model = quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+
+        if precision == "int8-full":
+            # Quantize the shared embedding once and point encoder and decoder at it
+            from models.vocab_pruning import PrunedEmbedding
+
+            embeddings = model.get_input_embeddings()
+            if isinstance(embeddings, PrunedEmbedding):
+                embeddings.embedding.qconfig = float_qparams_weight_only_qconfig
+                embeddings.embedding = torch.ao.nn.quantized.Embedding.from_float(embeddings.embedding)
+            else:
+                embeddings.qconfig = float_qparams_weight_only_qconfig
+                model.set_input_embeddings(torch.ao.nn.quantized.Embedding.from_float(embeddings))
+    return model
+
+
+def load_mapped(model_class, config, model_dir: str):
+    """
+    Build `model_class` with its parameters pointing straight into the memory-mapped
+    safetensors file instead of copies of it. The mapping is private, so worker
+    processes loading the same checkpoint share its pages through the page cache
+    until a weight is written. Returns None when the checkpoint cannot be loaded this
+    way (no safetensors file, non-fp32 weights, missing tensors), so the caller can
+    fall back to from_pretrained.
+    """
+    import torch
+    from safetensors.torch import load_file
+    from transformers import GenerationConfig
+
+    path = os.path.join(model_dir, WEIGHTS_FILE)
+    if not os.path.exists(path):
+        return None
+    state_dict = load_file(path)
+    if any(tensor.is_floating_point() and tensor.dtype != torch.float32 for tensor in state_dict.values()):
+        return None  # from_pretrained upcasts these; keep its behaviour
+
+    with torch.device("meta"):
+        model = model_class(config)
+    try:
+        model.load_state_dict(state_dict, strict=False, assign=True)
+    except RuntimeError:
+        return None
+    model.tie_weights()  # the embeddings and LM head are stored once, as shared.weight
+    tensors = list(model.parameters()) + list(model.buffers())
+    if any(tensor.is_meta for tensor in tensors):
+        return None
+    if os.path.exists(os.path.join(model_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(model_dir)
+    return model
+
+
+def load_model(model_dir: str, precision: str = "fp32", device: Optional[str] = None,
+               mmap: bool = True) -> "T5ForConditionalGeneration":
+    """
+    Load a T5 checkpoint (vocabulary-pruned and split-encoding ones included) for inference.
+    With `mmap` the fp32 weights stay memory-mapped from model.safetensors when they
+    are used on the CPU (see load_mapped).
+    """
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration
+
+    from models.split_encoding import SplitEncoderT5, is_split_encoding
+    from models.vocab_pruning import apply_vocab_pruning, load_vocab_pruning
+
+    config = T5Config.from_pretrained(model_dir)
+    model_class = SplitEncoderT5 if is_split_encoding(config) else T5ForConditionalGeneration
+    model = load_mapped(model_class, config, model_dir) if mmap else None
+    if model is None:
+        model = model_class.from_pretrained(model_dir)
+    pruning = load_vocab_pruning(model_dir)
+    if pruning is not None:
+        model = apply_vocab_pruning(model, pruning["kept_ids"], pruning["full_vocab_size"], pruning["unk_id"])
+    model.eval()
+    if precision != "fp32":
+        return quantize_model(model, precision)
+    model.to(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    return model
+
+
+def model_size_mb(model) -> float:
+    """Size of the serialized weights (packed int8 weights included)."""
+    import torch
+
+    total = 0
+    for value in model.state_dict().values():
+        if isinstance(value, tuple):
+            total += sum(v.element_size() * v.nelement() for v in value if isinstance(v, torch.Tensor))
+        elif isinstance(value, torch.Tensor):
+            total += value.element_size() * value.nelement()
+    return total / 2 ** 20
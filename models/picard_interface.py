@@ -1,37 +1,245 @@
+import time
+from collections import OrderedDict
+
 import torch
-from transformers import PreTrainedTokenizer
-from typing import Optional, List, Dict, Any
+from transformers import PreTrainedTokenizer, LogitsProcessor, LogitsProcessorList
+from typing import Optional, List, Dict, Any, Tuple
 import re
 
+from evaluation.execution import DatabasePool
+from models.speculative import new_stats, speculative_greedy, summarize
+from models.sql_state import SQL_KEYWORDS, SqlPrefixState, new_state
+from preprocess.schema_index import DatabaseTokenIndex, SchemaTokenIndex
+from profiling.instrumentation import Instrumentation
+
+
+def token_texts(tokenizer: PreTrainedTokenizer) -> List[str]:
+    """
+    Surface text contributed by every vocabulary id, so parser states can be
+    advanced one token at a time without re-decoding the whole prefix.
+    """
+    texts = []
+    special_ids = set(tokenizer.all_special_ids)
+    for token_id, piece in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+        if token_id == tokenizer.unk_token_id:
+            texts.append(' ')  # T5 maps characters such as '<' to <unk>
+        elif token_id in special_ids or piece is None:
+            texts.append('')
+        else:
+            texts.append(piece.replace('\u2581', ' '))
+    return texts
+
+
+class PicardLogitsProcessor(LogitsProcessor):
+    """
+    Constrained decoding hook for `model.generate`.
+
+    Keeps one SqlPrefixState per hypothesis of the previous step. Beam search
+    reorders hypotheses between steps, so each row's parent is found among the
+    previous rows of its example by comparing their last few tokens (the whole
+    prefix only when those cannot tell two hypotheses apart), and its state is
+    advanced by the newest token only. Only the previous step's states are kept. While a table name is being generated the allowed tokens
+    come straight from the database's token trie; otherwise the top-k candidate
+    tokens of every hypothesis are checked against the parser state. Everything
+    else is masked to -inf.
+    """
+
+    def __init__(self, picard: 'PicardDecoder', db_ids: List[str], num_beams: int = 1,
+                 top_k: int = 16):
+        self.picard = picard
+        self.token_texts = picard.token_texts
+        self.eos_token_id = picard.tokenizer.eos_token_id
+        self.db_ids = db_ids
+        self.num_beams = num_beams
+        self.top_k = top_k
+        # Previous step: its input_ids, their last TAIL + 1 tokens per row, and one hypothesis per row
+        self._prev_ids = None
+        self._prev_tails = None
+        self._states = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        with self.picard.instrumentation.stage("constraints"):
+            return self._constrain(input_ids, scores)
+
+    def _constrain(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        hypotheses = self._advance(input_ids)
+        vocab_size = scores.shape[-1]
+        mask = torch.zeros_like(scores, dtype=torch.bool)
+
+        # Table names: one cached vocabulary mask per trie node
+        checked_rows = []
+        for row, (state, node) in enumerate(hypotheses):
+            index = self.picard.token_index(self.db_ids[row // self.num_beams])
+            if index is not None and (node is not None or state.table_name_next()):
+                mask[row] = self._identifier_mask(index.tables, state, node, vocab_size).to(mask.device)
+            else:
+                checked_rows.append(row)
+
+        # Everything else: check the top-k candidates against the parser state
+        if checked_rows:
+            top_k = min(self.top_k, vocab_size)
+            candidates = scores[checked_rows].topk(top_k, dim=-1).indices
+            allowed = [
+                [self._accepts(hypotheses[row][0], token_id) for token_id in candidate_ids]
+                for row, candidate_ids in zip(checked_rows, candidates.tolist())
+            ]
+            allowed = torch.tensor(allowed, dtype=torch.bool, device=scores.device)
+            mask[checked_rows] = mask[checked_rows].scatter_(1, candidates, allowed)
+
+        # A hypothesis with no valid continuation is ended rather than left without any token
+        mask[~mask.any(dim=-1), self.eos_token_id] = True
+
+        return scores.masked_fill(~mask, float('-inf'))
+
+    # Tokens compared when looking for a row's parent before falling back to the whole prefix
+    TAIL = 16
+
+    def _advance(self, input_ids: torch.LongTensor) -> List[Tuple[SqlPrefixState, Optional[int]]]:
+        tails = input_ids[:, -(self.TAIL + 1):].tolist()
+        follows = (self._prev_ids is not None and self._prev_ids.shape[0] == input_ids.shape[0]
+                   and self._prev_ids.shape[1] == input_ids.shape[1] - 1)
+        hypotheses = []
+        for row, tail in enumerate(tails):
+            example = row // self.num_beams
+            parent = self._parent(input_ids, row, tail) if follows else None
+            if parent is None:
+                # First step (or a prefix not generated step by step): replay everything after the start token
+                hypothesis = (self.picard.new_state(self.db_ids[example]), None)
+                for token_id in input_ids[row, 1:].tolist():
+                    hypothesis = self._transition(example, hypothesis, token_id)
+            else:
+                hypothesis = self._transition(example, self._states[parent], tail[-1])
+            hypotheses.append(hypothesis)
+
+        # Only the live hypotheses can be parents at the next step
+        self._prev_ids, self._prev_tails, self._states = input_ids, tails, hypotheses
+        return hypotheses
+
+    def _parent(self, input_ids: torch.LongTensor, row: int, tail: List[int]) -> Optional[int]:
+        """Previous-step row whose tokens are this row's prefix (hypotheses never move between examples)."""
+        prefix_tail = tail[:-1]
+        first = (row // self.num_beams) * self.num_beams
+        candidates = [
+            j for j in range(first, min(first + self.num_beams, len(self._prev_tails)))
+            if self._prev_tails[j][len(self._prev_tails[j]) - len(prefix_tail):] == prefix_tail
+        ]
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        if len(prefix_tail) == self._prev_ids.shape[1]:
+            return candidates[0]  # identical prefixes, so identical states
+        prefix = input_ids[row, :-1]
+        return next((j for j in candidates if torch.equal(self._prev_ids[j], prefix)), None)
+
+    def _transition(self, example: int, hypothesis, token_id: int):
+        """Advance (parser state, table trie node) by one token."""
+        state, node = hypothesis
+        index = self.picard.token_index(self.db_ids[example])
+        if index is not None and (node is not None or state.table_name_next()):
+            node = index.tables.child(DatabaseTokenIndex.ROOT if node is None else node, token_id)
+        else:
+            node = None
+
+        state = state.copy()
+        state.feed(self.token_texts[token_id])
+        return state, node
+
+    def _identifier_mask(self, trie, state: SqlPrefixState, node: Optional[int], vocab_size: int) -> torch.Tensor:
+        if node is None:
+            # Start of a table name: any table, or a sub-query
+            allowed = trie.mask(DatabaseTokenIndex.ROOT) | self.picard.open_paren_mask
+            if state.word:
+                # FROM/JOIN has not ended yet and may still grow into an identifier (from_date, joined)
+                allowed = allowed | self.picard.continuation_mask
+        elif trie.is_terminal(node):
+            # Complete table name: a longer name or anything that ends the identifier
+            allowed = trie.mask(node) | self.picard.boundary_mask
+            allowed[self.eos_token_id] = state.can_finish()
+        else:
+            allowed = trie.mask(node)
+
+        if allowed.shape[0] < vocab_size:
+            allowed = torch.cat([allowed, allowed.new_zeros(vocab_size - allowed.shape[0])])
+        return allowed[:vocab_size]
+
+    def _accepts(self, state: SqlPrefixState, token_id: int) -> bool:
+        if token_id == self.eos_token_id:
+            return state.can_finish()
+        if not state.valid:
+            return False
+        return state.copy().feed(self.token_texts[token_id])
+
 
 class PicardDecoder:
     def __init__(self, tokenizer: PreTrainedTokenizer, db_path: str, schemas: dict, 
-                 fix_issue_16_primary_keys: bool = False):
+                 fix_issue_16_primary_keys: bool = False, schema_index: Optional[SchemaTokenIndex] = None,
+                 execution_guided: bool = False, execution_timeout: float = 0.5,
+                 execution_max_rows: int = 100, execution_budget: float = 2.0,
+                 execution_cache_size: int = 10000, speculative: bool = False,
+                 instrumentation: Optional[Instrumentation] = None):
         self.tokenizer = tokenizer
         self.schemas = schemas
         self.db_path = db_path
         self.fix_issue_16_primary_keys = fix_issue_16_primary_keys
+
+        # Execution-guided reranking: candidates are run row-limited and time-boxed,
+        # with at most `execution_budget` seconds spent per query
+        self.execution_guided = execution_guided
+        self.execution_timeout = execution_timeout
+        self.execution_max_rows = execution_max_rows
+        self.execution_budget = execution_budget
+        self.execution_cache_size = execution_cache_size
+        self._db_pool = None
+        self._execution_cache = OrderedDict()
+        self.execution_stats = {"queries": 0, "executed": 0, "cache_hits": 0, "no_valid_beam": 0,
+                                "total_ms": 0.0, "max_ms": 0.0}
+
+        # Greedy decoding with drafts looked up in the prompt, verified several tokens per forward
+        self.speculative = speculative
+        self.speculative_stats = new_stats()
+
+        # Stage timers (generate, constraints, sql_cleanup, execution); a no-op unless enabled
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
         
         # SQL keywords for basic validation
-        self.sql_keywords = {
-            'SELECT', 'FROM', 'WHERE', 'GROUP', 'BY', 'HAVING', 'ORDER', 
-            'LIMIT', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'OUTER', 'ON', 'AS',
-            'AND', 'OR', 'NOT', 'IN', 'LIKE', 'BETWEEN', 'IS', 'NULL',
-            'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'DISTINCT', 'ALL'
-        }
+        self.sql_keywords = SQL_KEYWORDS
+
+        # Per-token surface text and per-database table name sets for the parser states
+        self.token_texts = token_texts(tokenizer)
+        self._table_sets = {}
+
+        # Token-id tries of schema identifiers, precomputed or built on first use per database
+        self.schema_index = schema_index or SchemaTokenIndex(tokenizer=tokenizer, schemas=schemas)
+        self.boundary_mask = torch.tensor(
+            [bool(text) and not (text[0].isalnum() or text[0] in '_.') for text in self.token_texts]
+        )
+        self.open_paren_mask = torch.tensor([text.lstrip().startswith('(') for text in self.token_texts])
+        self.continuation_mask = torch.tensor(
+            [bool(text) and (text[0].isalnum() or text[0] in '_.') for text in self.token_texts]
+        )
+
+    def new_state(self, db_id: str) -> SqlPrefixState:
+        """Empty incremental parser state for a query against `db_id`."""
+        return new_state(self.schemas, db_id, self._table_sets)
+
+    def token_index(self, db_id: str) -> Optional[DatabaseTokenIndex]:
+        return self.schema_index.get(db_id)
+
+    def logits_processor(self, db_ids: List[str], num_beams: int = 1) -> PicardLogitsProcessor:
+        """Constraint hook to pass to `model.generate` for a batch of `db_ids`."""
+        return PicardLogitsProcessor(self, db_ids, num_beams=num_beams)
 
     def step(self, input_ids, decoded_ids, db_id):
         """
         Given the current input_ids and decoded_ids, return allowed token ids.
-        This is a simplified version without full Picard grammar constraints.
+        None means every token is allowed, an empty list that the prefix is invalid.
         """
         try:
-            # Decode current output (partial SQL)
-            decoded_text = self.tokenizer.decode(decoded_ids, skip_special_tokens=True)
-            trimmed_sql = decoded_text.split("<pad>")[-1].strip()
+            state = self.new_state(db_id)
+            for token_id in torch.as_tensor(decoded_ids).view(-1).tolist():
+                if not state.feed(self.token_texts[token_id]):
+                    break
 
-            # Basic validation - check if SQL looks reasonable
-            if self._is_valid_partial_sql(trimmed_sql, db_id):
+            if state.valid:
                 # Return None to allow all tokens (fallback behavior)
                 return None
             else:
@@ -46,44 +254,76 @@ class PicardDecoder:
         """
         Basic SQL validation without full grammar parsing.
         """
-        if not sql.strip():
-            return True  # Empty SQL is valid for starting
-            
-        # Check for basic SQL structure
-        sql_upper = sql.upper()
-        
-        # Must start with SELECT for Spider dataset
-        if not sql_upper.strip().startswith('SELECT'):
-            return False
-            
-        # Check for balanced parentheses
-        if sql.count('(') != sql.count(')'):
-            # Allow unbalanced during generation
-            return True
-            
-        # Check if table/column names exist in schema
-        if db_id in self.schemas:
-            schema = self.schemas[db_id]
-            table_names = [name.lower() for name in schema.get('table_names_original', [])]
-            
-            # Basic check - if FROM is present, check if table exists
-            from_match = re.search(r'from\s+(\w+)', sql_upper.lower())
-            if from_match:
-                table_name = from_match.group(1).lower()
-                if table_name not in table_names and table_name not in ['(', 'select']:
-                    return False
-        
-        return True
+        return self.new_state(db_id).feed(sql)
+
+    def executes(self, db_id: str, sql: str) -> bool:
+        """Whether `sql` runs without error on `db_id` (memoised per (db_id, sql))."""
+        key = (db_id, sql)
+        if key in self._execution_cache:
+            self._execution_cache.move_to_end(key)
+            self.execution_stats["cache_hits"] += 1
+            return self._execution_cache[key]
+
+        if self._db_pool is None:
+            self._db_pool = DatabasePool(self.db_path, timeout=self.execution_timeout,
+                                         max_rows=self.execution_max_rows)
+        ok, _ = self._db_pool.execute(db_id, sql)
+        self.execution_stats["executed"] += 1
+
+        self._execution_cache[key] = ok
+        if len(self._execution_cache) > self.execution_cache_size:
+            self._execution_cache.popitem(last=False)
+        return ok
+
+    def rerank_by_execution(self, db_id: str, beams: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Pick the first beam (in score order) that executes without error, falling back
+        to the top beam. Returns the chosen beam with the n-best list and the time spent.
+        """
+        start = time.perf_counter()
+        chosen = None
+        for beam in beams:
+            if self.executes(db_id, beam["sql"]):
+                chosen = beam
+                break
+            if time.perf_counter() - start > self.execution_budget:
+                break
+        if chosen is None:
+            chosen = beams[0]
+            self.execution_stats["no_valid_beam"] += 1
+
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        self.execution_stats["queries"] += 1
+        self.execution_stats["total_ms"] += elapsed_ms
+        self.execution_stats["max_ms"] = max(self.execution_stats["max_ms"], elapsed_ms)
+        return {**chosen, "beams": beams, "exec_ms": elapsed_ms}
 
     def decode(self, model, input_ids, attention_mask, db_id: str, 
-               max_length: int = 100, num_beams: int = 4, early_stopping: bool = True, **kwargs):
+               max_length: int = 100, num_beams: int = 4, early_stopping: bool = True,
+               use_constraints: bool = True, execution_guided: Optional[bool] = None, **kwargs):
         """
         Decode using the model with basic SQL constraints.
         Falls back to standard beam search if constraints fail.
         """
+        if execution_guided if execution_guided is not None else self.execution_guided:
+            result = self.batch_decode(model, input_ids, attention_mask, [db_id] * input_ids.shape[0],
+                                       max_length=max_length, num_beams=num_beams,
+                                       early_stopping=early_stopping, use_constraints=use_constraints,
+                                       execution_guided=True, **kwargs)[0]
+            return [self.tokenizer.encode(result["sql"], return_tensors='pt')[0]]
+        if self.speculative and num_beams == 1 and not kwargs:
+            result = self._speculative_decode(model, input_ids, attention_mask, [db_id], max_length,
+                                              use_constraints)[0]
+            return [self.tokenizer.encode(result["sql"], return_tensors='pt')[0]]
+
         try:
-            # Use standard beam search generation
-            with torch.no_grad():
+            if use_constraints:
+                kwargs["logits_processor"] = self._with_constraints(
+                    kwargs.get("logits_processor"), [db_id] * input_ids.shape[0], num_beams
+                )
+
+            # Constrained beam search generation
+            with torch.no_grad(), self.instrumentation.stage("generate"):
                 outputs = model.generate(
                     input_ids=input_ids,
                     attention_mask=attention_mask,
@@ -99,7 +339,8 @@ class PicardDecoder:
             decoded_sql = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
             
             # Basic SQL cleanup
-            cleaned_sql = self._clean_generated_sql(decoded_sql)
+            with self.instrumentation.stage("sql_cleanup"):
+                cleaned_sql = self._clean_generated_sql(decoded_sql)
             
             # Re-encode the cleaned SQL
             cleaned_ids = self.tokenizer.encode(cleaned_sql, return_tensors='pt')[0]
@@ -120,6 +361,114 @@ class PicardDecoder:
                 )
             return [outputs[0]]
 
+    def batch_decode(self, model, input_ids, attention_mask, db_ids: List[str],
+                     max_length: int = 100, num_beams: int = 4, early_stopping: bool = True,
+                     use_constraints: bool = True, execution_guided: Optional[bool] = None,
+                     speculative: Optional[bool] = None, encoder_outputs=None, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Decode a dynamically padded batch in a single generate call.
+        Returns one {"sql", "score"} dict per example, in input order. With
+        execution-guided decoding every dict also carries the n-best "beams" and
+        the "exec_ms" spent picking the first beam that executes.
+
+        Split-encoding models pass precomputed `encoder_outputs` (input_ids=None)
+        together with the matching attention mask.
+        """
+        if execution_guided is None:
+            execution_guided = self.execution_guided
+        if speculative is None:
+            speculative = self.speculative
+        if speculative and num_beams == 1 and not execution_guided and not kwargs and encoder_outputs is None:
+            return self._speculative_decode(model, input_ids, attention_mask, db_ids, max_length, use_constraints)
+        num_return_sequences = num_beams if execution_guided else 1
+
+        if use_constraints:
+            kwargs["logits_processor"] = self._with_constraints(
+                kwargs.get("logits_processor"), db_ids, num_beams
+            )
+
+        generate_kwargs = dict(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_length=max_length,
+            num_beams=num_beams,
+            early_stopping=early_stopping,
+            do_sample=False,
+            num_return_sequences=num_return_sequences,
+            return_dict_in_generate=True,
+            output_scores=True,
+        )
+        if encoder_outputs is not None:
+            generate_kwargs["encoder_outputs"] = encoder_outputs
+        try:
+            with torch.no_grad(), self.instrumentation.stage("generate"):
+                outputs = model.generate(**generate_kwargs, **kwargs)
+        except Exception as e:
+            print(f"⚠️ Picard batch decoding failed: {e}")
+            # Fallback to standard generation
+            with torch.no_grad(), self.instrumentation.stage("generate"):
+                outputs = model.generate(**generate_kwargs)
+        if self.instrumentation.enabled:
+            self.instrumentation.count(
+                output_tokens=int((outputs.sequences[::num_return_sequences, 1:] != self.tokenizer.pad_token_id).sum()))
+
+        scores = self._sequence_scores(model, outputs)
+        decoded = self.tokenizer.batch_decode(outputs.sequences, skip_special_tokens=True)
+        with self.instrumentation.stage("sql_cleanup"):
+            candidates = [
+                {"sql": self._clean_generated_sql(sql), "score": float(score)}
+                for sql, score in zip(decoded, scores)
+            ]
+        if not execution_guided:
+            return candidates
+
+        # generate returns the n-best of each example consecutively, best first
+        with self.instrumentation.stage("execution"):
+            return [
+                self.rerank_by_execution(db_id, candidates[i * num_return_sequences:(i + 1) * num_return_sequences])
+                for i, db_id in enumerate(db_ids)
+            ]
+
+    def _speculative_decode(self, model, input_ids, attention_mask, db_ids: List[str], max_length: int,
+                            use_constraints: bool) -> List[Dict[str, Any]]:
+        """Prompt-lookup greedy decoding, one example at a time (same output as greedy generate)."""
+        results = []
+        for row, db_id in enumerate(db_ids):
+            length = int(attention_mask[row].sum()) if attention_mask is not None else input_ids.shape[1]
+            logits_processor = self.logits_processor([db_id]) if use_constraints else None
+            with self.instrumentation.stage("generate"):
+                sequence, score = speculative_greedy(
+                    model, input_ids[row:row + 1, :length], max_length=max_length,
+                    logits_processor=logits_processor, stats=self.speculative_stats,
+                )
+            self.instrumentation.count(output_tokens=len(sequence) - 1)
+            sql = self.tokenizer.decode(sequence, skip_special_tokens=True)
+            with self.instrumentation.stage("sql_cleanup"):
+                results.append({"sql": self._clean_generated_sql(sql), "score": score})
+        return results
+
+    def speculative_summary(self) -> dict:
+        return summarize(self.speculative_stats)
+
+    def _with_constraints(self, logits_processor, db_ids: List[str], num_beams: int) -> LogitsProcessorList:
+        processors = LogitsProcessorList(logits_processor or [])
+        processors.append(self.logits_processor(db_ids, num_beams=num_beams))
+        return processors
+
+    def _sequence_scores(self, model, outputs):
+        """
+        Beam search already reports length-normalised sequence scores; for greedy
+        decoding sum the per-token log-probabilities instead.
+        """
+        if getattr(outputs, "sequences_scores", None) is not None:
+            return outputs.sequences_scores.tolist()
+
+        transition_scores = model.compute_transition_scores(
+            outputs.sequences, outputs.scores, normalize_logits=True
+        )
+        transition_scores = transition_scores.masked_fill(torch.isinf(transition_scores), 0.0)
+        return transition_scores.sum(dim=-1).tolist()
+
     def _clean_generated_sql(self, sql: str) -> str:
         """
         Clean up generated SQL to fix common issues.
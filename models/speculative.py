@@ -0,0 +1,160 @@
+#Prompt-lookup speculative decoding. The next tokens are drafted by matching the end of the generated SQL
+#against the input prompt (schema names and question literals get copied), then the whole draft is
+#verified in one decoder forward pass. Greedy outputs are identical to model.generate.
+
+import argparse
+import csv
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+
+NgramIndex = Dict[Tuple[int, ...], int]
+
+
+def build_ngram_index(prompt_ids: List[int], max_ngram: int = 3) -> NgramIndex:
+    """n-gram (n <= max_ngram) -> position right after its first occurrence in the prompt."""
+    index = {}
+    for n in range(1, max_ngram + 1):
+        for start in range(len(prompt_ids) - n):
+            index.setdefault(tuple(prompt_ids[start:start + n]), start + n)
+    return index
+
+
+def lookup_draft(prompt_ids: List[int], index: NgramIndex, generated: List[int], max_ngram: int = 3,
+                 num_draft: int = 10) -> List[int]:
+    """Continuation in the prompt of the longest suffix of `generated` that occurs there."""
+    for n in range(min(max_ngram, len(generated)), 0, -1):
+        position = index.get(tuple(generated[-n:]))
+        if position is not None:
+            return prompt_ids[position:position + num_draft]
+    return []
+
+
+def new_stats() -> dict:
+    return {"sequences": 0, "tokens": 0, "forwards": 0, "drafted": 0, "accepted": 0}
+
+
+def summarize(stats: dict) -> dict:
+    return {
+        **stats,
+        "acceptance_rate": round(stats["accepted"] / stats["drafted"], 4) if stats["drafted"] else 0.0,
+        # Plain greedy decoding needs one forward per token
+        "tokens_per_forward": round(stats["tokens"] / stats["forwards"], 3) if stats["forwards"] else 0.0,
+    }
+
+
+@torch.no_grad()
+def speculative_greedy(model, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                       max_length: int = 100, logits_processor=None, num_draft: int = 10, max_ngram: int = 3,
+                       stats: Optional[dict] = None) -> Tuple[List[int], float]:
+    """
+    Greedy decoding of one example (input_ids of shape (1, n), no padding).
+    Returns (token ids starting with the decoder start token, sum of log-probs).
+
+    `logits_processor` is called per verified position with the exact prefix it
+    would see in model.generate, so constrained decoding gives the same output.
+    """
+    stats = stats if stats is not None else new_stats()
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+    eos_token_id = model.config.eos_token_id
+
+    prompt_ids = input_ids[0].tolist()
+    index = build_ngram_index(prompt_ids, max_ngram)
+    sequence = [model.config.decoder_start_token_id]
+    score = 0.0
+    # Self-attention entries of rejected draft tokens are cropped after every pass
+    past_key_values = EncoderDecoderCache(DynamicCache(), DynamicCache())
+
+    while len(sequence) < max_length:
+        # Room for the draft plus the token the verification pass adds itself
+        draft = lookup_draft(prompt_ids, index, sequence[1:], max_ngram, num_draft)[:max_length - len(sequence) - 1]
+        decoder_input_ids = torch.tensor([[sequence[-1]] + draft], device=input_ids.device)
+        outputs = model(encoder_outputs=encoder_outputs, attention_mask=attention_mask,
+                        decoder_input_ids=decoder_input_ids, past_key_values=past_key_values, use_cache=True)
+        stats["forwards"] += 1
+        stats["drafted"] += len(draft)
+
+        # Position i predicts the token after draft[:i]; keep going while the draft agrees
+        for position in range(len(draft) + 1):
+            scores = outputs.logits[:, position, :]
+            if logits_processor is not None:
+                scores = logits_processor(torch.tensor([sequence], device=input_ids.device), scores)
+            token = int(scores.argmax(-1))
+            score += float(torch.log_softmax(scores.float(), dim=-1)[0, token])
+            sequence.append(token)
+            if position < len(draft) and token == draft[position] and token != eos_token_id \
+                    and len(sequence) < max_length:
+                stats["accepted"] += 1
+                continue
+            break
+
+        if sequence[-1] == eos_token_id:
+            break
+        past_key_values.crop(len(sequence) - 1)
+
+    stats["sequences"] += 1
+    stats["tokens"] += len(sequence) - 1
+    return sequence, score
+
+
+def main(argv=None):
+    from transformers import LogitsProcessorList, T5Tokenizer
+    from models.loading import load_model
+    from models.picard_interface import PicardDecoder
+    from preprocess.schema_utils import load_tables
+
+    parser = argparse.ArgumentParser(description="Acceptance rate and speedup of prompt-lookup decoding on dev")
+    parser.add_argument("--model-dir", default="output/t5-spider-final")
+    parser.add_argument("--dev-tsv", default="output/processed/dev.tsv")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--max-length", type=int, default=100)
+    parser.add_argument("--num-draft", type=int, default=10)
+    parser.add_argument("--max-ngram", type=int, default=3)
+    parser.add_argument("--use-constraints", action="store_true", help="decode with the Picard constraints")
+    parser.add_argument("--tables", default="data/spider_data/tables.json")
+    parser.add_argument("--db-path", default="data/spider_data/database")
+    args = parser.parse_args(argv)
+
+    tokenizer = T5Tokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir)
+    with open(args.dev_tsv, "r", encoding="utf-8") as f:
+        rows = [row for _, row in zip(range(args.limit), csv.DictReader(f, delimiter="\t"))]
+    picard = None
+    if args.use_constraints:
+        picard = PicardDecoder(tokenizer=tokenizer, db_path=args.db_path, schemas=load_tables(args.tables))
+
+    stats = new_stats()
+    identical = 0
+    greedy_s = speculative_s = 0.0
+    for row in rows:
+        input_ids = tokenizer(row["input"], max_length=512, truncation=True,
+                              return_tensors="pt")["input_ids"].to(model.device)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            reference = model.generate(
+                input_ids=input_ids, max_length=args.max_length, num_beams=1, do_sample=False,
+                logits_processor=LogitsProcessorList([picard.logits_processor([row["db_id"]])] if picard else []),
+            )[0].tolist()
+        greedy_s += time.perf_counter() - start
+
+        start = time.perf_counter()
+        sequence, _ = speculative_greedy(model, input_ids, max_length=args.max_length, num_draft=args.num_draft,
+                                         max_ngram=args.max_ngram, stats=stats,
+                                         logits_processor=picard.logits_processor([row["db_id"]]) if picard else None)
+        speculative_s += time.perf_counter() - start
+        identical += sequence == reference
+
+    report = summarize(stats)
+    print(f"✅ {identical}/{len(rows)} outputs identical to greedy generate")
+    print(f"📈 Acceptance rate {100 * report['acceptance_rate']:.1f}%, "
+          f"{report['tokens_per_forward']:.2f} tokens per decoder forward, "
+          f"wall clock {greedy_s:.1f}s -> {speculative_s:.1f}s ({greedy_s / max(speculative_s, 1e-9):.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#Schema-once encoding. The question and the flattened schema go through the T5 encoder as separate
+#sequences and the decoder cross-attends over both, so a database's schema states are computed once and reused
+
+import argparse
+import csv
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import T5ForConditionalGeneration
+from transformers.modeling_outputs import BaseModelOutput
+
+from training.spider_dataset import split_input_text
+
+
+def is_split_encoding(model_or_config) -> bool:
+    config = getattr(model_or_config, "config", model_or_config)
+    return bool(getattr(config, "split_encoding", False))
+
+
+def fuse(question_states: torch.Tensor, question_mask: torch.Tensor, schema_states: torch.Tensor,
+         schema_mask: torch.Tensor) -> Tuple[BaseModelOutput, torch.Tensor]:
+    """
+    Concatenate question and schema encoder states along the sequence axis.
+    T5 cross-attention has no position bias, so padding between the two
+    segments is simply masked out.
+    """
+    hidden = torch.cat([question_states, schema_states.to(question_states.dtype)], dim=1)
+    mask = torch.cat([question_mask, schema_mask.to(question_mask.dtype)], dim=1)
+    return BaseModelOutput(last_hidden_state=hidden), mask
+
+
+class SplitEncoderT5(T5ForConditionalGeneration):
+    """
+    T5 trained on separately encoded question and schema segments.
+
+    Checkpoints are ordinary T5 weights with `config.split_encoding = True`.
+    Inference passes pre-computed `encoder_outputs` to generate (see
+    SchemaStateCache.encode); training passes `schema_input_ids` and
+    `schema_attention_mask` next to the question's `input_ids`.
+    """
+
+    # forward takes **kwargs for the schema inputs only, not for loss arguments
+    accepts_loss_kwargs = False
+
+    def encode_split(self, input_ids, attention_mask, schema_input_ids, schema_attention_mask):
+        encoder = self.get_encoder()
+        question = encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+        schema = encoder(input_ids=schema_input_ids, attention_mask=schema_attention_mask, return_dict=True)
+        return fuse(question.last_hidden_state, attention_mask, schema.last_hidden_state, schema_attention_mask)
+
+    def forward(self, input_ids=None, attention_mask=None, schema_input_ids=None, schema_attention_mask=None,
+                encoder_outputs=None, **kwargs):
+        if encoder_outputs is None and schema_input_ids is not None:
+            if attention_mask is None:
+                attention_mask = torch.ones_like(input_ids)
+            if schema_attention_mask is None:
+                schema_attention_mask = torch.ones_like(schema_input_ids)
+            encoder_outputs, attention_mask = self.encode_split(input_ids, attention_mask, schema_input_ids,
+                                                                schema_attention_mask)
+            input_ids = None
+        return super().forward(input_ids=input_ids, attention_mask=attention_mask, encoder_outputs=encoder_outputs,
+                               **kwargs)
+
+
+class SchemaStateCache:
+    """
+    Encoder states of schema segments: an in-memory LRU in front of an optional
+    SQLite store that keeps the `max_disk_entries` most recently used entries.
+
+    Keys hash the model fingerprint and the schema segment text, so states of
+    another model or an edited (or pruned) schema are never reused.
+    """
+
+    def __init__(self, model, tokenizer, model_fp: Optional[str] = None, path: Optional[str] = None,
+                 max_size: int = 64, max_disk_entries: int = 1024, max_input_length: int = 512):
+        if path and not model_fp:
+            raise ValueError("an on-disk schema state cache needs the model fingerprint")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_fp = model_fp or ""
+        self.max_size = max_size
+        self.max_disk_entries = max_disk_entries
+        self.max_input_length = max_input_length
+        self._memory = OrderedDict()
+
+        self._connection = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS schema_states (key TEXT PRIMARY KEY, value BLOB, last_used REAL)"
+            )
+            self._connection.commit()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "encoded": 0, "evictions": 0, "disk_evictions": 0,
+                      "question_tokens": 0, "schema_tokens_encoded": 0, "schema_tokens_reused": 0}
+
+    def key(self, schema_text: str) -> str:
+        return hashlib.sha256(f"{self.model_fp}\x00{schema_text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, states: torch.Tensor):
+        self._memory[key] = states
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _store(self, key: str, states: torch.Tensor):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO schema_states (key, value, last_used) VALUES (?, ?, ?)",
+            (key, pickle.dumps(states.cpu()), time.time()),
+        )
+        count = self._connection.execute("SELECT COUNT(*) FROM schema_states").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.stats["disk_evictions"] += self._connection.execute(
+                "DELETE FROM schema_states WHERE key IN "
+                "(SELECT key FROM schema_states ORDER BY last_used LIMIT ?)",
+                (count - self.max_disk_entries,)).rowcount
+        self._connection.commit()
+
+    def states(self, schema_text: str) -> torch.Tensor:
+        """Encoder states (length, d_model) of one schema segment."""
+        key = self.key(schema_text)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            states = self._memory[key]
+            self.stats["schema_tokens_reused"] += states.shape[0]
+            return states
+
+        row = None
+        if self._connection is not None:
+            row = self._connection.execute("SELECT value FROM schema_states WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            states = pickle.loads(row[0]).to(self.model.device)
+            self._connection.execute("UPDATE schema_states SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self._remember(key, states)
+            self.stats["disk_hits"] += 1
+            self.stats["schema_tokens_reused"] += states.shape[0]
+            return states
+
+        input_ids = self.tokenizer(schema_text, max_length=self.max_input_length, truncation=True,
+                                   return_tensors="pt")["input_ids"].to(self.model.device)
+        with torch.no_grad():
+            states = self.model.get_encoder()(input_ids=input_ids, return_dict=True).last_hidden_state[0]
+        self._remember(key, states)
+        if self._connection is not None:
+            self._store(key, states)
+        self.stats["encoded"] += 1
+        self.stats["schema_tokens_encoded"] += states.shape[0]
+        return states
+
+    def encode(self, question_texts: List[str], schema_texts: List[str]) -> Tuple[BaseModelOutput, torch.Tensor]:
+        """Encoder outputs and attention mask for a batch: only the questions go through the encoder."""
+        questions = self.tokenizer(question_texts, max_length=self.max_input_length, truncation=True,
+                                   padding=True, return_tensors="pt").to(self.model.device)
+        with torch.no_grad():
+            question_states = self.model.get_encoder()(input_ids=questions["input_ids"],
+                                                       attention_mask=questions["attention_mask"],
+                                                       return_dict=True).last_hidden_state
+        self.stats["question_tokens"] += int(questions["attention_mask"].sum())
+
+        schema_states = [self.states(text) for text in schema_texts]
+        padded = torch.nn.utils.rnn.pad_sequence(schema_states, batch_first=True)
+        schema_mask = torch.nn.utils.rnn.pad_sequence(
+            [torch.ones(len(states), dtype=torch.long, device=padded.device) for states in schema_states],
+            batch_first=True,
+        )
+        return fuse(question_states, questions["attention_mask"], padded, schema_mask)
+
+    def summary(self) -> dict:
+        encoder_tokens = (self.stats["question_tokens"] + self.stats["schema_tokens_encoded"]
+                          + self.stats["schema_tokens_reused"])
+        return {
+            **self.stats,
+            "size": len(self._memory),
+            # Share of the encoder input that was served from cached schema states
+            "encoder_tokens_saved": round(self.stats["schema_tokens_reused"] / encoder_tokens, 4)
+            if encoder_tokens else 0.0,
+        }
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def main(argv=None):
+    from transformers import T5Tokenizer
+    from models.loading import load_model
+
+    parser = argparse.ArgumentParser(description="Encoder work of joint vs schema-once (split) encoding on dev")
+    parser.add_argument("--model-dir", default="output/t5-spider-final")
+    parser.add_argument("--dev-tsv", default="output/processed/dev.tsv")
+    parser.add_argument("--limit", type=int, default=0, help="number of dev examples (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    tokenizer = T5Tokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir)
+    with open(args.dev_tsv, "r", encoding="utf-8") as f:
+        rows = [row for i, row in enumerate(csv.DictReader(f, delimiter="\t")) if not args.limit or i < args.limit]
+    encoder = model.get_encoder()
+
+    joint_tokens = 0
+    start = time.perf_counter()
+    for offset in range(0, len(rows), args.batch_size):
+        batch = tokenizer([row["input"] for row in rows[offset:offset + args.batch_size]], max_length=512,
+                          truncation=True, padding=True, return_tensors="pt").to(model.device)
+        with torch.no_grad():
+            encoder(**batch)
+        joint_tokens += int(batch["attention_mask"].sum())
+    joint_s = time.perf_counter() - start
+
+    cache = SchemaStateCache(model, tokenizer)
+    start = time.perf_counter()
+    for offset in range(0, len(rows), args.batch_size):
+        segments = [split_input_text(row["input"]) for row in rows[offset:offset + args.batch_size]]
+        cache.encode([question for question, _ in segments], [schema for _, schema in segments])
+    split_s = time.perf_counter() - start
+
+    report = cache.summary()
+    split_tokens = report["question_tokens"] + report["schema_tokens_encoded"]
+    print(f"📈 {len(rows)} questions over {report['encoded']} distinct schemas: encoder tokens "
+          f"{joint_tokens} -> {split_tokens} ({100 * (1 - split_tokens / max(joint_tokens, 1)):.1f}% fewer), "
+          f"wall clock {joint_s:.2f}s -> {split_s:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
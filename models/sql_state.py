@@ -0,0 +1,160 @@
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+# SQL keywords for basic validation and keyword casing
+SQL_KEYWORDS = frozenset({
+    'SELECT', 'FROM', 'WHERE', 'GROUP', 'BY', 'HAVING', 'ORDER',
+    'LIMIT', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'OUTER', 'ON', 'AS',
+    'AND', 'OR', 'NOT', 'IN', 'LIKE', 'BETWEEN', 'IS', 'NULL',
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'DISTINCT', 'ALL'
+})
+
+# Keywords that must be followed by a table name (or a sub-query)
+TABLE_CLAUSES = frozenset({'FROM', 'JOIN'})
+
+# Every Spider query starts with this keyword
+FIRST_KEYWORD = 'SELECT'
+FIRST_KEYWORD_PREFIXES = frozenset(FIRST_KEYWORD[:i] for i in range(1, len(FIRST_KEYWORD) + 1))
+
+QUOTES = frozenset("'\"")
+
+
+def table_name_sets(schema: dict) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """Return (lowercased table names, every non-empty prefix of those names)."""
+    names = frozenset(name.lower() for name in schema.get('table_names_original', []))
+    prefixes = frozenset(name[:i] for name in names for i in range(1, len(name) + 1))
+    return names, prefixes
+
+
+class SqlPrefixState:
+    """
+    Incremental lexer state for a partially generated SQL query.
+
+    Text is fed in as it is generated (one token piece at a time) and every
+    character is processed exactly once, so checking a new token costs O(len(piece))
+    instead of re-scanning the whole prefix. The checks mirror the old regex
+    validation: the query must start with SELECT and every identifier following
+    FROM/JOIN must be a table of the current database.
+    """
+
+    __slots__ = ('tables', 'table_prefixes', 'word', 'quote', 'depth',
+                 'first_word', 'expect_table', 'valid')
+
+    def __init__(self, tables: Optional[FrozenSet[str]] = None,
+                 table_prefixes: Optional[FrozenSet[str]] = None):
+        # Schema checks are skipped when the database is unknown
+        self.tables = tables
+        self.table_prefixes = table_prefixes
+        self.word = ''
+        self.quote = None
+        self.depth = 0
+        self.first_word = None
+        self.expect_table = False
+        self.valid = True
+
+    def copy(self) -> 'SqlPrefixState':
+        state = SqlPrefixState.__new__(SqlPrefixState)
+        state.tables = self.tables
+        state.table_prefixes = self.table_prefixes
+        state.word = self.word
+        state.quote = self.quote
+        state.depth = self.depth
+        state.first_word = self.first_word
+        state.expect_table = self.expect_table
+        state.valid = self.valid
+        return state
+
+    def feed(self, text: str) -> bool:
+        """Advance the state over `text`; returns False once the prefix is invalid."""
+        for ch in text:
+            if not self.valid:
+                break
+
+            if self.quote is not None:
+                if ch == self.quote:
+                    self.quote = None
+                continue
+
+            if ch.isalnum() or ch == '_' or ch == '.':
+                self.word += ch
+                self._check_partial_word()
+                continue
+
+            self._end_word()
+            if ch in QUOTES:
+                if self.first_word is None:
+                    self.valid = False
+                self.expect_table = False
+                self.quote = ch
+            elif ch == '(':
+                # FROM ( ... ) introduces a sub-query instead of a table name
+                self.expect_table = False
+                self.depth += 1
+            elif ch == ')':
+                self.depth -= 1
+                if self.depth < 0:
+                    self.valid = False
+
+        return self.valid
+
+    def can_finish(self) -> bool:
+        """Whether the query may end here (i.e. EOS is an allowed next token)."""
+        state = self.copy()
+        state._end_word()
+        return (state.valid and state.first_word == FIRST_KEYWORD and not state.expect_table
+                and state.quote is None and state.depth == 0)
+
+    def table_name_next(self) -> bool:
+        """
+        Whether the next word to be generated is a table name: right after FROM/JOIN,
+        including while that keyword is still the pending word (it may yet become from_date).
+        """
+        if not self.valid or self.quote is not None:
+            return False
+        if self.expect_table:
+            return not self.word
+        return self.first_word is not None and self.word.upper() in TABLE_CLAUSES
+
+    def _check_partial_word(self):
+        if self.first_word is None:
+            if self.word.upper() not in FIRST_KEYWORD_PREFIXES:
+                self.valid = False
+        elif self.expect_table and self.table_prefixes is not None:
+            if self.word.lower() not in self.table_prefixes and self.word.upper() not in FIRST_KEYWORD_PREFIXES:
+                self.valid = False
+
+    def _end_word(self):
+        if not self.word:
+            return
+
+        word_upper = self.word.upper()
+        if self.first_word is None:
+            self.first_word = word_upper
+            if word_upper != FIRST_KEYWORD:
+                self.valid = False
+        elif self.expect_table:
+            self.expect_table = False
+            if self.tables is not None and self.word.lower() not in self.tables and word_upper != FIRST_KEYWORD:
+                self.valid = False
+            self.word = ''
+            return
+
+        if word_upper in TABLE_CLAUSES:
+            self.expect_table = True
+        self.word = ''
+
+
+def new_state(schemas: Dict[str, dict], db_id: str, cache: Optional[dict] = None) -> SqlPrefixState:
+    """Create an empty state for `db_id`, memoising the table name sets in `cache`."""
+    if db_id not in schemas:
+        return SqlPrefixState()
+
+    if hasattr(schemas, 'entry'):
+        # SchemaRegistry: the sets are precomputed with the entry
+        entry = schemas.entry(db_id)
+        return SqlPrefixState(entry.table_names, entry.table_prefixes)
+    if cache is None:
+        return SqlPrefixState(*table_name_sets(schemas[db_id]))
+    if db_id not in cache:
+        cache[db_id] = table_name_sets(schemas[db_id])
+    return SqlPrefixState(*cache[db_id])
@@ -0,0 +1,236 @@
+#SQL-domain vocabulary pruning: keep only the token ids that Spider inputs and SQL outputs use,
+#so the embedding and LM-head matrices shrink and each decoder step projects onto far fewer rows
+
+import argparse
+import csv
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+import torch
+from torch import nn
+from transformers import PreTrainedTokenizer, T5ForConditionalGeneration
+
+from models.sql_state import SQL_KEYWORDS
+
+VOCAB_FILE = "vocab_pruning.json"
+SQL_SYMBOLS = ["=", "!=", "<>", ">=", "<=", ">", "<", "(", ")", ",", ".", "*", "'", '"', "%", "-", "+", "/", ";"]
+ALIASES = [f"T{i}" for i in range(1, 10)]
+
+
+class PrunedEmbedding(nn.Module):
+    """Embedding over the kept ids; any other original id is looked up as <unk>."""
+
+    def __init__(self, embedding: nn.Module, kept_ids: torch.Tensor, full_vocab_size: int, unk_row: int):
+        super().__init__()
+        self.embedding = embedding
+        remap = torch.full((full_vocab_size,), unk_row, dtype=torch.long)
+        remap[kept_ids] = torch.arange(len(kept_ids))
+        self.register_buffer("remap", remap, persistent=False)
+
+    @property
+    def weight(self):
+        return self.embedding.weight
+
+    def __setattr__(self, name, value):
+        # PreTrainedModel.tie_weights assigns the shared weight to the wrapper; it belongs to the wrapped module
+        if name == "weight":
+            setattr(self.embedding, name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def forward(self, input_ids):
+        return self.embedding(self.remap[input_ids])
+
+
+class PrunedLMHead(nn.Module):
+    """
+    LM head over the kept ids. Logits are scattered back into the original
+    vocabulary (other ids get the lowest float), so generate, the tokenizer and
+    PicardDecoder keep working with the original token ids.
+    """
+
+    def __init__(self, linear: nn.Module, kept_ids: torch.Tensor, full_vocab_size: int):
+        super().__init__()
+        self.linear = linear
+        self.full_vocab_size = full_vocab_size
+        self.register_buffer("kept_ids", kept_ids.clone(), persistent=False)
+
+    @property
+    def weight(self):
+        return self.linear.weight
+
+    def __setattr__(self, name, value):
+        # See PrunedEmbedding.__setattr__
+        if name == "weight":
+            setattr(self.linear, name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def forward(self, hidden_states):
+        logits = self.linear(hidden_states)
+        full = logits.new_full(logits.shape[:-1] + (self.full_vocab_size,), torch.finfo(logits.dtype).min)
+        return full.index_copy_(-1, self.kept_ids, logits)
+
+
+def _texts_ids(tokenizer: PreTrainedTokenizer, texts: Iterable[str], batch_size: int = 1000) -> Set[int]:
+    ids = set()
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            ids.update(i for seq in tokenizer(batch)["input_ids"] for i in seq)
+            batch = []
+    if batch:
+        ids.update(i for seq in tokenizer(batch)["input_ids"] for i in seq)
+    return ids
+
+
+def _variants(word: str) -> List[str]:
+    # The same word tokenizes differently at the start of a text, after a space and after '.' / '('
+    return [word, f" {word}", f"T1.{word}", f"({word}", word.lower(), word.upper()]
+
+
+def used_token_ids(tokenizer: PreTrainedTokenizer, corpus_paths: List[str], schemas: Dict[str, dict]) -> List[int]:
+    """
+    Sorted token ids used by the training corpus (inputs and targets), every
+    schema identifier in `schemas`, SQL keywords/symbols, digits and the special tokens.
+    """
+    def corpus_texts():
+        for path in corpus_paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f, delimiter="\t"):
+                    yield row["input"]
+                    yield row["target"]
+
+    def schema_texts():
+        for schema in schemas.values():
+            names = list(schema.get("table_names_original", [])) + list(schema.get("table_names", []))
+            names += [name for _, name in schema.get("column_names_original", [])]
+            names += [name for _, name in schema.get("column_names", [])]
+            for name in names:
+                yield from _variants(name)
+
+    def sql_texts():
+        for word in list(SQL_KEYWORDS) + SQL_SYMBOLS + ALIASES + [str(d) for d in range(10)]:
+            yield from _variants(word)
+
+    ids = _texts_ids(tokenizer, corpus_texts()) | _texts_ids(tokenizer, schema_texts()) | _texts_ids(tokenizer, sql_texts())
+    ids.update(tokenizer.all_special_ids)
+    return sorted(ids)
+
+
+def prune_model(model: T5ForConditionalGeneration, kept_ids: List[int]) -> T5ForConditionalGeneration:
+    """Shrink the shared embedding and LM head to the kept rows, in place (config.vocab_size becomes len(kept_ids))."""
+    index = torch.tensor(kept_ids, dtype=torch.long)
+    embedding = model.get_input_embeddings()
+    pruned = nn.Embedding(len(kept_ids), embedding.embedding_dim)
+    pruned.weight.data = embedding.weight.data[index].clone()
+
+    head = model.get_output_embeddings()
+    model.set_input_embeddings(pruned)
+    model.lm_head = nn.Linear(pruned.embedding_dim, len(kept_ids), bias=False)
+    if model.config.tie_word_embeddings:
+        model.lm_head.weight = pruned.weight
+    else:
+        model.lm_head.weight.data = head.weight.data[index].clone()
+    model.config.vocab_size = len(kept_ids)
+    return model
+
+
+def apply_vocab_pruning(model: T5ForConditionalGeneration, kept_ids: List[int], full_vocab_size: int,
+                        unk_id: int) -> T5ForConditionalGeneration:
+    """Wrap a pruned checkpoint so it reads and emits original token ids."""
+    index = torch.tensor(kept_ids, dtype=torch.long)
+    unk_row = kept_ids.index(unk_id)
+    model.set_input_embeddings(PrunedEmbedding(model.get_input_embeddings(), index, full_vocab_size, unk_row))
+    model.lm_head = PrunedLMHead(model.lm_head, index, full_vocab_size)
+    model.config.vocab_size = full_vocab_size
+    return model
+
+
+def load_vocab_pruning(model_dir: str) -> Optional[dict]:
+    path = os.path.join(model_dir, VOCAB_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_pruned_checkpoint(model_dir: str, output_dir: str, tokenizer: PreTrainedTokenizer, kept_ids: List[int]):
+    model = T5ForConditionalGeneration.from_pretrained(model_dir)
+    full_vocab_size = model.config.vocab_size
+    prune_model(model, kept_ids)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+        json.dump({"full_vocab_size": full_vocab_size, "unk_id": tokenizer.unk_token_id, "kept_ids": kept_ids}, f)
+
+
+def verify(original, pruned, tokenizer: PreTrainedTokenizer, inputs: List[str], kept_ids: List[int],
+           batch_size: int = 16, max_length: int = 100, num_beams: int = 4) -> dict:
+    """
+    Generate with both models. An example is in-vocabulary when its input and
+    the original model's output only use kept ids; those outputs must be unchanged.
+    """
+    kept = set(kept_ids)
+    in_vocab = unchanged = 0
+    for start in range(0, len(inputs), batch_size):
+        encoded = tokenizer(inputs[start:start + batch_size], max_length=512, truncation=True,
+                            padding=True, return_tensors="pt")
+        with torch.no_grad():
+            outputs = [
+                model.generate(**encoded, max_length=max_length, num_beams=num_beams, early_stopping=True)
+                for model in (original, pruned)
+            ]
+        for row, (reference, candidate) in enumerate(zip(*(tokenizer.batch_decode(o, skip_special_tokens=True)
+                                                             for o in outputs))):
+            input_ids = encoded["input_ids"][row][encoded["attention_mask"][row].bool()].tolist()
+            # The generated ids themselves: re-tokenizing the decoded text can hide a pruned token
+            output_ids = outputs[0][row].tolist()
+            if set(input_ids) <= kept and set(output_ids) <= kept:
+                in_vocab += 1
+                unchanged += reference == candidate
+    return {
+        "examples": len(inputs),
+        "in_vocab": in_vocab,
+        "unchanged": unchanged,
+        "unchanged_rate": round(unchanged / in_vocab, 4) if in_vocab else 0.0,
+    }
+
+
+def main(argv=None):
+    from transformers import T5Tokenizer
+    from models.loading import load_model
+    from preprocess.schema_utils import load_tables
+
+    parser = argparse.ArgumentParser(description="Prune the T5 vocabulary to the tokens Spider SQL needs")
+    parser.add_argument("--model-dir", default="output/t5-spider-final")
+    parser.add_argument("--output-dir", default="output/t5-spider-pruned")
+    parser.add_argument("--corpus", nargs="+", default=["output/processed/train.tsv"])
+    parser.add_argument("--tables", default="data/spider_data/tables.json")
+    parser.add_argument("--verify-tsv", default="output/processed/dev.tsv")
+    parser.add_argument("--verify-limit", type=int, default=200, help="dev examples to verify (0 skips)")
+    args = parser.parse_args(argv)
+
+    tokenizer = T5Tokenizer.from_pretrained(args.model_dir)
+    kept_ids = used_token_ids(tokenizer, args.corpus, load_tables(args.tables))
+    save_pruned_checkpoint(args.model_dir, args.output_dir, tokenizer, kept_ids)
+
+    original = load_model(args.model_dir, device="cpu")
+    pruned = load_model(args.output_dir, device="cpu")
+    print(f"✂️ Kept {len(kept_ids)} of {original.config.vocab_size} tokens; "
+          f"parameters {sum(p.numel() for p in original.parameters()) / 1e6:.1f}M -> "
+          f"{sum(p.numel() for p in pruned.parameters()) / 1e6:.1f}M")
+    print(f"💾 Saved pruned checkpoint to {args.output_dir}")
+
+    if args.verify_limit:
+        with open(args.verify_tsv, "r", encoding="utf-8") as f:
+            inputs = [row["input"] for _, row in zip(range(args.verify_limit), csv.DictReader(f, delimiter="\t"))]
+        report = verify(original, pruned, tokenizer, inputs, kept_ids)
+        print(f"✅ {report['unchanged']}/{report['in_vocab']} in-vocabulary dev outputs unchanged "
+              f"({report['examples'] - report['in_vocab']} examples use pruned tokens)")
+
+
+if __name__ == "__main__":
+    main()
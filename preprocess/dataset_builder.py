@@ -1,28 +1,66 @@
+import argparse
+import hashlib
 import json
 import csv
-from typing import List, Tuple
-from schema_utils import load_tables, flatten_schema
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+from preprocess.schema_registry import SchemaRegistry, fingerprint_of, flat_schema
+from preprocess.schema_utils import load_tables, flatten_schema
+from preprocess.spider_data import iter_spider_data, load_spider_data
+from preprocess.schema_pruning import SchemaPruner
+from preprocess.value_index import ValueIndex, build_value_index
+from profiling.instrumentation import Instrumentation, stage_of
 
+SPLITS = ["train_spider", "train_others", "dev", "test"]
+TRAIN_SPLITS = ["train_spider", "train_others"]
+FORMATS = ["tsv", "jsonl", "tokenized"]
+# Bump when the shard contents change for the same inputs, to force a rebuild
+BUILDER_VERSION = 1
 
-def load_spider_data(path: str) -> List[dict]:
-    """Load Spider dataset from JSON file."""
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
 
+def build_input_text(question: str, schema_text: str, values_text: str = "") -> str:
+    """
+    T5 input for a question over a flattened schema. Database values matched in
+    the question (preprocess.value_index) go with the question, before the schema
+    segment, so split encoding can still cache the schema.
+    """
+    if values_text:
+        return f"question: {question} values: {values_text} schema: {schema_text}"
+    return f"question: {question} schema: {schema_text}"
 
-def build_t5_input_output_pairs(examples: List[dict], schemas: dict) -> List[Tuple[str, str, str]]:
+
+def build_t5_input_output_pairs(examples: List[dict], schemas: dict,
+                                pruner: Optional[SchemaPruner] = None,
+                                flat_cache: Optional[Dict[str, str]] = None,
+                                instrumentation: Optional[Instrumentation] = None,
+                                value_index: Optional[ValueIndex] = None) -> List[Tuple[str, str, str]]:
     """Convert Spider examples into (input, target, db_id) triples for T5."""
+    # Unpruned schemas are identical for every question of a database, so flatten each once
+    flat_cache = {} if flat_cache is None else flat_cache
     pairs = []
     for ex in examples:
         question = ex["question"].strip()
         db_id = ex["db_id"]
         sql = ex["query"].strip()  # raw SQL string
 
-        # Flatten schema for the current db
-        schema = flatten_schema(schemas[db_id]).strip()
+        # Flatten schema for the current db (optionally only the tables relevant to the question)
+        with stage_of(instrumentation, "schema_flattening"):
+            if pruner is not None:
+                schema = flatten_schema(pruner.prune(question, schemas[db_id])).strip()
+            else:
+                if db_id not in flat_cache:
+                    flat_cache[db_id] = flat_schema(schemas, db_id)
+                schema = flat_cache[db_id]
+
+        values = ""
+        if value_index is not None:
+            with stage_of(instrumentation, "value_lookup"):
+                values = value_index.values_text(db_id, question)
 
         # Build input and output
-        input_text = f"question: {question} schema: {schema}"
+        input_text = build_input_text(question, schema, values)
         target_text = sql
 
         pairs.append((input_text, target_text, db_id))
@@ -37,24 +75,318 @@ def save_to_tsv(pairs: List[Tuple[str, str, str]], path: str):
         writer.writerows(pairs)
 
 
-if __name__ == "__main__":
+# === Sharded builder ===
+
+# Per-process state of the pool workers: flattened schemas and the tokenizer are
+# built once per worker rather than once per shard
+_worker_flat_cache = {}
+_worker_tokenizers = {}
+_worker_pruners = {}
+_worker_value_indexes = {}
+_worker_schemas = {}
+
+
+def _shard_hash(examples: List[dict], schema_hashes: Dict[str, str], config: dict,
+                value_hashes: Optional[Dict[str, str]] = None) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for ex in examples:
+        digest.update(json.dumps(ex, sort_keys=True).encode("utf-8"))
+    for db_id in sorted({ex["db_id"] for ex in examples}):
+        digest.update(f"{db_id}:{schema_hashes.get(db_id, '')}".encode("utf-8"))
+        # Shards using database values are rebuilt when one of their databases changes
+        if value_hashes is not None:
+            digest.update(f":{value_hashes.get(db_id, '')}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _build_shard(task: dict) -> dict:
+    """Write one shard in every requested format (runs in a pool worker)."""
+    shard_dir, name = task["shard_dir"], task["name"]
+    config = task["config"]
+    instrumentation = Instrumentation() if task.get("instrument") else None
+
+    pruner = None
+    if config["prune"]:
+        key = json.dumps(config["prune"], sort_keys=True)
+        if key not in _worker_pruners:
+            _worker_pruners[key] = SchemaPruner(**config["prune"])
+        pruner = _worker_pruners[key]
+
+    value_index = None
+    if config.get("values"):
+        key = json.dumps(config["values"], sort_keys=True)
+        if key not in _worker_value_indexes:
+            _worker_value_indexes[key] = ValueIndex(**config["values"])
+        value_index = _worker_value_indexes[key]
+
+    # Cached flattened schemas are keyed by content, so a changed database is re-flattened
+    flat_cache = {}
+    for db_id, schema_hash in task["schema_hashes"].items():
+        if (db_id, schema_hash) in _worker_flat_cache:
+            flat_cache[db_id] = _worker_flat_cache[(db_id, schema_hash)]
+    schemas = task.get("schemas")
+    if schemas is None:
+        # Every worker maps the same compiled registry instead of receiving schema dicts with each shard
+        key = json.dumps(task["schema_paths"])
+        if key not in _worker_schemas:
+            _worker_schemas[key] = SchemaRegistry(task["schema_paths"])
+        schemas = _worker_schemas[key]
+    pairs = build_t5_input_output_pairs(task["examples"], schemas, pruner=pruner, flat_cache=flat_cache,
+                                        instrumentation=instrumentation, value_index=value_index)
+    for db_id, flat in flat_cache.items():
+        _worker_flat_cache[(db_id, task["schema_hashes"][db_id])] = flat
+
+    rows = [pair + (example_id,) for pair, example_id in zip(pairs, task["example_ids"])]
+    tsv_path = os.path.join(shard_dir, f"{name}.tsv")
+    with open(tsv_path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["input", "target", "db_id", "example_id"])
+        writer.writerows(rows)
+    os.replace(tsv_path + ".tmp", tsv_path)
+
+    if "jsonl" in config["formats"]:
+        jsonl_path = os.path.join(shard_dir, f"{name}.jsonl")
+        with open(jsonl_path + ".tmp", "w", encoding="utf-8") as f:
+            for input_text, target_text, db_id, example_id in rows:
+                f.write(json.dumps({"example_id": example_id, "db_id": db_id,
+                                    "input": input_text, "target": target_text}, ensure_ascii=False) + "\n")
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+
+    if "tokenized" in config["formats"]:
+        from training.tokenized_dataset import write_tokenized
+        from transformers import T5Tokenizer
+
+        if config["tokenizer"] not in _worker_tokenizers:
+            _worker_tokenizers[config["tokenizer"]] = T5Tokenizer.from_pretrained(config["tokenizer"])
+        tokenized_dir = os.path.join(shard_dir, f"{name}_tokenized")
+        with stage_of(instrumentation, "tokenization"):
+            write_tokenized([tsv_path], _worker_tokenizers[config["tokenizer"]], tokenized_dir + ".tmp",
+                            max_input_length=config["max_input_length"],
+                            max_target_length=config["max_target_length"])
+        shutil.rmtree(tokenized_dir, ignore_errors=True)
+        os.replace(tokenized_dir + ".tmp", tokenized_dir)
+
+    result = {"name": name, "hash": task["hash"], "examples": len(rows)}
+    if instrumentation is not None:
+        instrumentation.count(examples=len(rows))
+        result["instrumentation"] = instrumentation.state()
+    return result
+
+
+def _shard_outputs(shard_dir: str, name: str, formats: List[str]) -> List[str]:
+    paths = [os.path.join(shard_dir, f"{name}.tsv")]
+    if "jsonl" in formats:
+        paths.append(os.path.join(shard_dir, f"{name}.jsonl"))
+    if "tokenized" in formats:
+        paths.append(os.path.join(shard_dir, f"{name}_tokenized"))
+    return paths
+
+
+def build_split(split: str, data_path: str, schemas: Dict[str, dict], output_dir: str, config: dict,
+                executor: ProcessPoolExecutor, shard_size: int = 1000, max_pending: int = 8,
+                instrumentation: Optional[Instrumentation] = None,
+                value_hashes: Optional[Dict[str, str]] = None) -> dict:
+    """
+    Stream one split into shards of `shard_size` examples. Shards whose content hash
+    (examples + schemas they use + build config, + database file hashes when values
+    are added) matches the previous manifest are kept as they are; only new or
+    changed shards are rebuilt. The stage timings of rebuilt shards are merged into
+    `instrumentation`.
+    """
+    shard_dir = os.path.join(output_dir, split)
+    manifest_path = os.path.join(shard_dir, "manifest.json")
+    os.makedirs(shard_dir, exist_ok=True)
 
-    schema_path = "data/spider_data/tables.json"
-    dev_path = "data/spider_data/dev.json"
-    dev_output = "output/processed/dev.tsv"
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = {shard["name"]: shard for shard in json.load(f)["shards"]}
 
-    import os
-    os.makedirs(os.path.dirname(dev_output), exist_ok=True)
+    schema_hashes = {db_id: fingerprint_of(schemas, db_id) for db_id in schemas}
+    shards, pending = [], set()
+    rebuilt = 0
 
-    schemas = load_tables(schema_path)
-    examples = load_spider_data(dev_path)
+    def collect(result: dict):
+        state = result.pop("instrumentation", None)
+        if state is not None and instrumentation is not None:
+            instrumentation.merge(state)
+        shards.append(result)
 
-    pairs = build_t5_input_output_pairs(examples, schemas)
+    def submit(index: int, examples: List[dict], first_id: int):
+        nonlocal rebuilt
+        name = f"shard-{index:05d}"
+        shard_hash = _shard_hash(examples, schema_hashes, config, value_hashes)
+        up_to_date = (previous.get(name, {}).get("hash") == shard_hash
+                      and all(os.path.exists(p) for p in _shard_outputs(shard_dir, name, config["formats"])))
+        if up_to_date:
+            shards.append(previous[name])
+            return
 
-    print("Sample:")
-    print("Input: ", pairs[0][0])
-    print("Target:", pairs[0][1])
-    
-    save_to_tsv(pairs, dev_output)
-    print(f"Saved {len(pairs)} examples to {dev_output}")
+        db_ids = {ex["db_id"] for ex in examples}
+        task = {
+            "shard_dir": shard_dir,
+            "name": name,
+            "hash": shard_hash,
+            "examples": examples,
+            "example_ids": [f"{split}-{first_id + i:05d}" for i in range(len(examples))],
+            "schema_hashes": {db_id: schema_hashes[db_id] for db_id in db_ids},
+            "config": config,
+            "instrument": instrumentation is not None and instrumentation.enabled,
+        }
+        if isinstance(schemas, SchemaRegistry):
+            task["schema_paths"] = schemas.paths
+        else:
+            task["schemas"] = {db_id: schemas[db_id] for db_id in db_ids}
+        # Bound the number of shards held in memory while workers catch up
+        while len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                collect(future.result())
+        pending.add(executor.submit(_build_shard, task))
+        rebuilt += 1
 
+    chunk, index, count = [], 0, 0
+    for example in iter_spider_data(data_path):
+        chunk.append(example)
+        if len(chunk) == shard_size:
+            submit(index, chunk, count)
+            count += len(chunk)
+            chunk, index = [], index + 1
+    if chunk:
+        submit(index, chunk, count)
+        count += len(chunk)
+        index += 1
+
+    for future in pending:
+        collect(future.result())
+    shards.sort(key=lambda shard: shard["name"])
+
+    # Drop shards left over from a previous, longer build
+    current = {shard["name"] for shard in shards}
+    for name in previous:
+        if name not in current:
+            for path in _shard_outputs(shard_dir, name, FORMATS):
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+
+    manifest = {"split": split, "source": data_path, "config": config, "examples": count, "shards": shards}
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return {"split": split, "examples": count, "shards": len(shards), "rebuilt": rebuilt}
+
+
+def merge_shards(output_dir: str, splits: List[str], output_path: str, tokenized_dir: Optional[str] = None):
+    """
+    Concatenate the TSV shards of one or more splits into a single TSV file and,
+    with `tokenized_dir`, their tokenized shards into the single directory that
+    training and evaluation read.
+    """
+    shard_paths = []
+    for split in splits:
+        with open(os.path.join(output_dir, split, "manifest.json"), "r", encoding="utf-8") as f:
+            shard_paths += [os.path.join(output_dir, split, shard["name"]) for shard in json.load(f)["shards"]]
+
+    with open(output_path + ".tmp", "w", encoding="utf-8", newline="") as out:
+        header_written = False
+        for shard_path in shard_paths:
+            with open(f"{shard_path}.tsv", "r", encoding="utf-8") as f:
+                header = f.readline()
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(f, out)
+    os.replace(output_path + ".tmp", output_path)
+
+    if tokenized_dir is not None:
+        from training.tokenized_dataset import merge_tokenized
+
+        merge_tokenized([f"{shard_path}_tokenized" for shard_path in shard_paths], tokenized_dir, [output_path])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build T5 input/output shards for the Spider splits")
+    parser.add_argument("--data-dir", default="data/spider_data")
+    parser.add_argument("--output-dir", default="output/processed")
+    parser.add_argument("--splits", nargs="+", default=SPLITS, choices=SPLITS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument("--formats", nargs="+", default=["tsv", "jsonl"], choices=FORMATS)
+    parser.add_argument("--tokenizer", default="t5-small", help="tokenizer for the 'tokenized' format")
+    parser.add_argument("--max-input-length", type=int, default=512)
+    parser.add_argument("--max-target-length", type=int, default=256)
+    parser.add_argument("--prune", action="store_true", help="prune schemas to the tables relevant to each question")
+    parser.add_argument("--max-tables", type=int, default=4)
+    parser.add_argument("--values", action="store_true",
+                        help="add database values matched in each question to the input (see preprocess.value_index)")
+    parser.add_argument("--value-index", default="output/value_index", help="value index, updated before building")
+    parser.add_argument("--instrument", metavar="JSON", help="write per-stage timings of rebuilt shards here")
+    args = parser.parse_args(argv)
+
+    def tokenized_path(name: str) -> Optional[str]:
+        # output/processed/train_tokenized and dev_tokenized are what train.py and evaluate.py read
+        return os.path.join(args.output_dir, f"{name}_tokenized") if "tokenized" in args.formats else None
+
+    # Spider ships the test split's databases in a separate tables file
+    tables = [os.path.join(args.data_dir, "tables.json")]
+    test_tables = os.path.join(args.data_dir, "test_tables.json")
+    if "test" in args.splits and os.path.exists(test_tables):
+        tables.append(test_tables)
+    schemas = load_tables(tables)
+
+    config = {
+        "version": BUILDER_VERSION,
+        "formats": sorted(args.formats),
+        "tokenizer": args.tokenizer if "tokenized" in args.formats else None,
+        "max_input_length": args.max_input_length,
+        "max_target_length": args.max_target_length,
+        "prune": {"max_tables": args.max_tables} if args.prune else None,
+    }
+
+    value_hashes = None
+    if args.values:
+        # Only databases whose file changed since the last build are re-indexed
+        summary = build_value_index(os.path.join(args.data_dir, "database"), args.value_index)
+        print(f"Value index: {summary['built']} databases indexed, {summary['unchanged']} unchanged")
+        value_index = ValueIndex(args.value_index)
+        config["values"] = value_index.params()
+        value_hashes = {db_id: value_index.database_hash(db_id) for db_id in schemas}
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    instrumentation = Instrumentation() if args.instrument else None
+    built = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for split in args.splits:
+            data_path = os.path.join(args.data_dir, f"{split}.json")
+            if not os.path.exists(data_path):
+                print(f"⚠️ Skipping {split}: {data_path} not found")
+                continue
+            summary = build_split(split, data_path, schemas, args.output_dir, config, executor,
+                                  shard_size=args.shard_size, max_pending=2 * args.workers,
+                                  instrumentation=instrumentation, value_hashes=value_hashes)
+            print(f"{split}: {summary['examples']} examples in {summary['shards']} shards "
+                  f"({summary['rebuilt']} rebuilt)")
+            merge_shards(args.output_dir, [split], os.path.join(args.output_dir, f"{split}.tsv"),
+                         tokenized_dir=tokenized_path(split))
+            built.append(split)
+
+    # train.py reads a single train.tsv covering both training splits
+    train_splits = [split for split in TRAIN_SPLITS if split in built]
+    if train_splits:
+        merge_shards(args.output_dir, train_splits, os.path.join(args.output_dir, "train.tsv"),
+                     tokenized_dir=tokenized_path("train"))
+
+    print(f"Saved {', '.join(built)} to {args.output_dir}")
+    if instrumentation is not None:
+        instrumentation.stop()
+        instrumentation.report()
+        instrumentation.dump(args.instrument)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#Precompute token-id prefix tries over the table names of every database,
+#so constrained decoding can check table-name continuations with a tensor lookup
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import torch
+from transformers import PreTrainedTokenizer
+
+from preprocess.schema_utils import load_tables
+
+
+class TokenTrie:
+    """
+    Prefix trie over the token ids of a set of identifiers, stored as flat tensors
+    (CSR layout: node_offsets[n]:node_offsets[n + 1] indexes node n's children).
+    """
+
+    def __init__(self, node_offsets: torch.Tensor, child_tokens: torch.Tensor,
+                 child_nodes: torch.Tensor, terminal: torch.Tensor, vocab_size: int):
+        self.node_offsets = node_offsets
+        self.child_tokens = child_tokens
+        self.child_nodes = child_nodes
+        self.terminal = terminal
+        self.vocab_size = vocab_size
+        self._children = {}
+        self._masks = {}
+
+    @classmethod
+    def build(cls, sequences: Iterable[List[int]], vocab_size: int) -> 'TokenTrie':
+        children = [{}]
+        terminal = [False]
+        for token_ids in sequences:
+            node = 0
+            for token_id in token_ids:
+                if token_id not in children[node]:
+                    children[node][token_id] = len(children)
+                    children.append({})
+                    terminal.append(False)
+                node = children[node][token_id]
+            terminal[node] = True
+
+        offsets, tokens, nodes = [0], [], []
+        for node_children in children:
+            for token_id, child in sorted(node_children.items()):
+                tokens.append(token_id)
+                nodes.append(child)
+            offsets.append(len(tokens))
+
+        return cls(
+            node_offsets=torch.tensor(offsets, dtype=torch.long),
+            child_tokens=torch.tensor(tokens, dtype=torch.long),
+            child_nodes=torch.tensor(nodes, dtype=torch.long),
+            terminal=torch.tensor(terminal, dtype=torch.bool),
+            vocab_size=vocab_size,
+        )
+
+    def child(self, node: int, token_id: int) -> Optional[int]:
+        """Node reached from `node` by `token_id`, or None if no identifier continues that way."""
+        if node not in self._children:
+            start, end = self.node_offsets[node].item(), self.node_offsets[node + 1].item()
+            self._children[node] = dict(zip(self.child_tokens[start:end].tolist(),
+                                            self.child_nodes[start:end].tolist()))
+        return self._children[node].get(token_id)
+
+    def is_terminal(self, node: int) -> bool:
+        return bool(self.terminal[node])
+
+    def mask(self, node: int) -> torch.Tensor:
+        """Boolean vocabulary mask of the tokens that continue an identifier from `node`."""
+        if node not in self._masks:
+            start, end = self.node_offsets[node].item(), self.node_offsets[node + 1].item()
+            mask = torch.zeros(self.vocab_size, dtype=torch.bool)
+            mask[self.child_tokens[start:end]] = True
+            self._masks[node] = mask
+        return self._masks[node]
+
+    def state_dict(self) -> dict:
+        return {
+            'node_offsets': self.node_offsets,
+            'child_tokens': self.child_tokens,
+            'child_nodes': self.child_nodes,
+            'terminal': self.terminal,
+            'vocab_size': self.vocab_size,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state: dict) -> 'TokenTrie':
+        return cls(**state)
+
+
+class DatabaseTokenIndex:
+    """
+    Table-name trie for one database. Only table names are constrained while
+    decoding (models.picard_interface), so no column trie is kept.
+    """
+
+    ROOT = 0
+
+    def __init__(self, db_id: str, tables: TokenTrie):
+        self.db_id = db_id
+        self.tables = tables
+
+    def state_dict(self) -> dict:
+        return {
+            'db_id': self.db_id,
+            'tables': self.tables.state_dict(),
+        }
+
+    @classmethod
+    def from_state_dict(cls, state: dict) -> 'DatabaseTokenIndex':
+        # Indexes saved with a 'columns' trie load as well; it is ignored
+        return cls(state['db_id'], TokenTrie.from_state_dict(state['tables']))
+
+
+def identifier_token_ids(tokenizer: PreTrainedTokenizer, names: Iterable[str]) -> List[List[int]]:
+    """
+    Token ids of every name as it appears after a space in generated SQL, both as
+    written and lowercased (Spider gold queries use either spelling).
+    """
+    variants = sorted({variant for name in names for variant in (name, name.lower())})
+    if not variants:
+        return []
+    return tokenizer(variants, add_special_tokens=False)['input_ids']
+
+
+def build_database_index(tokenizer: PreTrainedTokenizer, schema: dict) -> DatabaseTokenIndex:
+    """Build the table-name trie for a single tables.json entry."""
+    table_names = schema.get('table_names_original', [])
+    return DatabaseTokenIndex(
+        db_id=schema['db_id'],
+        tables=TokenTrie.build(identifier_token_ids(tokenizer, table_names), len(tokenizer)),
+    )
+
+
+class SchemaTokenIndex:
+    """
+    Per-database token indexes, loaded lazily one database at a time.
+
+    Databases are read from `index_dir` (written by build_schema_index) on first
+    access; databases missing there are built in memory from `schemas` when a
+    tokenizer is available.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, index_dir: Optional[str] = None, tokenizer: Optional[PreTrainedTokenizer] = None,
+                 schemas: Optional[Dict[str, dict]] = None):
+        self.index_dir = index_dir
+        self.tokenizer = tokenizer
+        self.schemas = schemas or {}
+        self._indexes = {}
+
+        self.databases = set()
+        if index_dir and os.path.exists(os.path.join(index_dir, self.MANIFEST)):
+            with open(os.path.join(index_dir, self.MANIFEST), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if tokenizer is None or manifest['vocab_size'] == len(tokenizer):
+                self.databases = set(manifest['databases'])
+            else:
+                print(f"⚠️ Ignoring schema index in {index_dir}: built for a different vocabulary")
+
+    def get(self, db_id: str) -> Optional[DatabaseTokenIndex]:
+        if db_id not in self._indexes:
+            self._indexes[db_id] = self._load(db_id)
+        return self._indexes[db_id]
+
+    def _load(self, db_id: str) -> Optional[DatabaseTokenIndex]:
+        if db_id in self.databases:
+            state = torch.load(os.path.join(self.index_dir, f"{db_id}.pt"))
+            return DatabaseTokenIndex.from_state_dict(state)
+        if self.tokenizer is not None and db_id in self.schemas:
+            return build_database_index(self.tokenizer, self.schemas[db_id])
+        return None
+
+
+def build_schema_index(tokenizer: PreTrainedTokenizer, schemas: Dict[str, dict], output_dir: str):
+    """Build and save the token index of every database in `schemas`."""
+    os.makedirs(output_dir, exist_ok=True)
+    for db_id, schema in schemas.items():
+        index = build_database_index(tokenizer, schema)
+        torch.save(index.state_dict(), os.path.join(output_dir, f"{db_id}.pt"))
+
+    manifest = {
+        'tokenizer': getattr(tokenizer, 'name_or_path', ''),
+        'vocab_size': len(tokenizer),
+        'databases': sorted(schemas),
+    }
+    with open(os.path.join(output_dir, SchemaTokenIndex.MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+if __name__ == "__main__":
+    from transformers import T5Tokenizer
+
+    tables_path = "data/spider_data/tables.json"
+    model_dir = "output/t5-spider-final"
+    index_dir = "output/schema_index"
+
+    tokenizer = T5Tokenizer.from_pretrained(model_dir)
+    schemas = load_tables(tables_path)
+
+    build_schema_index(tokenizer, schemas, index_dir)
+    print(f"Saved token index for {len(schemas)} databases to {index_dir}")
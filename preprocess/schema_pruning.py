@@ -0,0 +1,288 @@
+#Question-driven schema pruning: keep only the tables/columns a question is likely to need,
+#so flatten_schema produces shorter encoder inputs and large schemas stop getting truncated
+
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from preprocess.schema_utils import flatten_schema
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])")
+GOLD_TABLE_RE = re.compile(r"\b(?:from|join)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+# Words that appear in most questions and say nothing about the schema
+STOPWORDS = frozenset({
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'to', 'and', 'or', 'by', 'with', 'is', 'are',
+    'was', 'were', 'be', 'what', 'which', 'who', 'whose', 'how', 'many', 'much', 'show',
+    'list', 'find', 'give', 'return', 'all', 'each', 'every', 'that', 'than', 'have', 'has',
+    'do', 'does', 'did', 'their', 'its', 'from', 'as', 'at', 'me', 'there', 'number', 'id',
+})
+
+
+def normalize_word(word: str) -> str:
+    """Lowercase and strip a plural suffix, so 'singers' matches 'singer'."""
+    word = word.lower()
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def name_words(name: str) -> List[str]:
+    """Split a schema identifier (snake_case, CamelCase or natural text) into normalized words."""
+    name = CAMEL_RE.sub(r"\1 \2", name).replace('_', ' ')
+    return [normalize_word(word) for word in WORD_RE.findall(name.lower())]
+
+
+def question_words(question: str) -> Set[str]:
+    return {normalize_word(word) for word in WORD_RE.findall(question.lower())} - STOPWORDS
+
+
+def char_ngrams(word: str, n: int = 3) -> Set[str]:
+    padded = f"#{word}#"
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+def gold_tables(sql: str) -> Set[str]:
+    """Lowercased table names referenced after FROM/JOIN in a gold query."""
+    return {name.lower() for name in GOLD_TABLE_RE.findall(sql)}
+
+
+class _SchemaNgramIndex:
+    """Word and character n-gram lookup tables over one database's identifiers."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.table_words = []
+        for table_id, name in enumerate(schema['table_names_original']):
+            words = set(name_words(name))
+            if 'table_names' in schema:
+                words |= set(name_words(schema['table_names'][table_id]))
+            self.table_words.append(words - STOPWORDS)
+
+        self.column_words = []
+        natural = schema.get('column_names', schema['column_names_original'])
+        for col_id, (table_id, name) in enumerate(schema['column_names_original']):
+            words = set(name_words(name)) | set(name_words(natural[col_id][1]))
+            self.column_words.append(words - STOPWORDS)
+
+        # character n-gram -> schema words containing it, for fuzzy matches
+        self.ngram_index = {}
+        for words in self.table_words + self.column_words:
+            for word in words:
+                for gram in char_ngrams(word):
+                    self.ngram_index.setdefault(gram, set()).add(word)
+
+        self.neighbours = {table_id: set() for table_id in range(len(self.table_words))}
+        columns = schema['column_names_original']
+        for col_a, col_b in schema.get('foreign_keys', []):
+            table_a, table_b = columns[col_a][0], columns[col_b][0]
+            if table_a != table_b:
+                self.neighbours[table_a].add(table_b)
+                self.neighbours[table_b].add(table_a)
+
+    def fuzzy_matches(self, word: str, threshold: float) -> Set[str]:
+        """Schema words whose trigram Dice similarity with `word` is at least `threshold`."""
+        grams = char_ngrams(word)
+        counts = {}
+        for gram in grams:
+            for candidate in self.ngram_index.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        return {
+            candidate for candidate, shared in counts.items()
+            if 2 * shared / (len(grams) + len(char_ngrams(candidate))) >= threshold
+        }
+
+
+class SchemaPruner:
+    """
+    Keeps the tables (and optionally columns) of a schema that a question is likely to use.
+
+    Tables are scored by word overlap between the question and the table name
+    (weight `table_weight`) and its column names (weight 1), where a question word
+    also matches schema words with a similar character-trigram profile. The best
+    `max_tables` tables scoring at least `min_score` are kept, then closed over
+    foreign keys so join paths between kept tables survive. If nothing matches,
+    the full schema is kept.
+    """
+
+    def __init__(self, max_tables: int = 4, min_score: float = 1.0, table_weight: float = 2.0,
+                 fuzzy_threshold: float = 0.7, fk_closure: bool = True,
+                 max_columns_per_table: Optional[int] = None):
+        self.max_tables = max_tables
+        self.min_score = min_score
+        self.table_weight = table_weight
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fk_closure = fk_closure
+        self.max_columns_per_table = max_columns_per_table
+        self._indexes = {}
+
+    def _index(self, schema: dict) -> _SchemaNgramIndex:
+        db_id = schema['db_id']
+        if db_id not in self._indexes:
+            self._indexes[db_id] = _SchemaNgramIndex(schema)
+        return self._indexes[db_id]
+
+    def _expand(self, index: _SchemaNgramIndex, words: Set[str]) -> Set[str]:
+        expanded = set(words)
+        if self.fuzzy_threshold < 1.0:
+            for word in words:
+                expanded |= index.fuzzy_matches(word, self.fuzzy_threshold)
+        return expanded
+
+    def table_scores(self, question: str, schema: dict) -> List[float]:
+        index = self._index(schema)
+        words = self._expand(index, question_words(question))
+
+        scores = [self.table_weight * len(table_words & words) for table_words in index.table_words]
+        for (table_id, _), col_words in zip(schema['column_names_original'], index.column_words):
+            if table_id != -1 and col_words & words:
+                scores[table_id] += 1
+        return scores
+
+    def select_tables(self, question: str, schema: dict) -> List[int]:
+        scores = self.table_scores(question, schema)
+        ranked = sorted(range(len(scores)), key=lambda t: (-scores[t], t))
+        kept = [t for t in ranked[:self.max_tables] if scores[t] >= self.min_score]
+        if not kept:
+            return list(range(len(scores)))
+
+        if self.fk_closure:
+            kept = self._close_over_foreign_keys(self._index(schema), set(kept))
+        return sorted(kept)
+
+    def _close_over_foreign_keys(self, index: _SchemaNgramIndex, kept: Set[int]) -> Set[int]:
+        """Add the tables on a shortest foreign-key path between every pair of kept tables."""
+        closed = set(kept)
+        for source in kept:
+            parents = {source: None}
+            queue = deque([source])
+            while queue:
+                table = queue.popleft()
+                for neighbour in index.neighbours[table]:
+                    if neighbour not in parents:
+                        parents[neighbour] = table
+                        queue.append(neighbour)
+            for target in kept:
+                node = parents.get(target) if target != source else None
+                while node is not None and node != source:
+                    closed.add(node)
+                    node = parents[node]
+        return closed
+
+    def _select_columns(self, question: str, schema: dict, tables: Set[int]) -> List[int]:
+        columns = schema['column_names_original']
+        candidates = [col_id for col_id, (table_id, _) in enumerate(columns) if table_id in tables]
+        if self.max_columns_per_table is None:
+            return candidates
+
+        index = self._index(schema)
+        words = self._expand(index, question_words(question))
+        # Composite keys appear as lists of column ids in some tables.json files
+        keys = {col_id for key in schema.get('primary_keys', []) for col_id in (key if isinstance(key, list) else [key])}
+        for col_a, col_b in schema.get('foreign_keys', []):
+            keys.update((col_a, col_b))
+
+        kept = []
+        for table_id in sorted(tables):
+            table_columns = [col_id for col_id in candidates if columns[col_id][0] == table_id]
+            ranked = sorted(table_columns, key=lambda c: (c not in keys, -len(index.column_words[c] & words), c))
+            kept.extend(ranked[:self.max_columns_per_table])
+        return sorted(kept)
+
+    def prune(self, question: str, schema: dict) -> dict:
+        """Return a copy of `schema` (tables.json layout) restricted to the relevant tables/columns."""
+        tables = self.select_tables(question, schema)
+        if len(tables) == len(schema['table_names_original']) and self.max_columns_per_table is None:
+            return schema
+
+        table_map = {old: new for new, old in enumerate(tables)}
+        columns = [0] + self._select_columns(question, schema, set(tables))  # keep "*"
+        column_map = {old: new for new, old in enumerate(columns)}
+
+        pruned = {key: value for key, value in schema.items()}
+        for key in ('table_names_original', 'table_names'):
+            if key in schema:
+                pruned[key] = [schema[key][t] for t in tables]
+        for key in ('column_names_original', 'column_names'):
+            if key in schema:
+                pruned[key] = [
+                    [table_map.get(schema[key][c][0], -1), schema[key][c][1]] for c in columns
+                ]
+        if 'column_types' in schema:
+            pruned['column_types'] = [schema['column_types'][c] for c in columns]
+        pruned['primary_keys'] = []
+        for key in schema.get('primary_keys', []):
+            if not isinstance(key, list):
+                if key in column_map:
+                    pruned['primary_keys'].append(column_map[key])
+            elif all(c in column_map for c in key):
+                # A composite key is kept only if every one of its columns survives
+                pruned['primary_keys'].append([column_map[c] for c in key])
+        pruned['foreign_keys'] = [
+            [column_map[a], column_map[b]] for a, b in schema.get('foreign_keys', [])
+            if a in column_map and b in column_map
+        ]
+        return pruned
+
+
+def pruning_report(examples: Iterable[dict], schemas: Dict[str, dict], pruner: SchemaPruner,
+                   tokenizer=None, max_input_length: int = 512) -> dict:
+    """
+    Compare full and pruned inputs over Spider examples: average input length
+    (tokens if a tokenizer is given, characters otherwise), how often every gold
+    table survives pruning, and how many inputs exceed `max_input_length`.
+    """
+    full_lengths, pruned_lengths = [], []
+    gold_kept = 0
+    total = 0
+    for ex in examples:
+        schema = schemas[ex['db_id']]
+        question = ex['question'].strip()
+        pruned = pruner.prune(question, schema)
+
+        texts = [f"question: {question} schema: {flatten_schema(s).strip()}" for s in (schema, pruned)]
+        if tokenizer is not None:
+            full_len, pruned_len = (len(ids) for ids in tokenizer(texts)['input_ids'])
+        else:
+            full_len, pruned_len = (len(text) for text in texts)
+        full_lengths.append(full_len)
+        pruned_lengths.append(pruned_len)
+
+        kept_tables = {name.lower() for name in pruned['table_names_original']}
+        if gold_tables(ex['query']) <= kept_tables:
+            gold_kept += 1
+        total += 1
+
+    if not total:
+        return {}
+    avg_full = sum(full_lengths) / total
+    avg_pruned = sum(pruned_lengths) / total
+    return {
+        'examples': total,
+        'unit': 'tokens' if tokenizer is not None else 'chars',
+        'avg_full_length': round(avg_full, 1),
+        'avg_pruned_length': round(avg_pruned, 1),
+        'length_reduction': round(1 - avg_pruned / avg_full, 4),
+        'gold_table_recall': round(gold_kept / total, 4),
+        'over_max_full': sum(length > max_input_length for length in full_lengths),
+        'over_max_pruned': sum(length > max_input_length for length in pruned_lengths),
+    }
+
+
+if __name__ == "__main__":
+    import json
+    from preprocess.schema_utils import load_tables
+
+    schemas = load_tables("data/spider_data/tables.json")
+    with open("data/spider_data/dev.json", "r", encoding="utf-8") as f:
+        examples = json.load(f)
+
+    # Recall / length trade-off for a few settings
+    for max_tables in (2, 3, 4, 6):
+        for max_columns in (None, 8):
+            pruner = SchemaPruner(max_tables=max_tables, max_columns_per_table=max_columns)
+            report = pruning_report(examples, schemas, pruner)
+            print(f"max_tables={max_tables} max_columns={max_columns}: {report}")
@@ -0,0 +1,296 @@
+#Compact, lazily loaded schema registry. tables.json is compiled once into a binary file with an offset
+#index; opening it reads only the index, and a database is unpickled on first access from a shared mmap
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple, Union
+
+from preprocess.schema_utils import SCHEMA_CACHE_DIR, flatten_schema
+
+MAGIC = b"SCHEMAREG1\n"
+# Bump when the entry layout or the precomputed fields change, to force a recompile
+REGISTRY_VERSION = 1
+REGISTRY_DIR = SCHEMA_CACHE_DIR
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+def schema_fingerprint(schema: dict) -> str:
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read_tables(file_path: str) -> Dict[str, dict]:
+    """Parse a tables.json file into db_id -> schema dicts (everything at once)."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        tables = json.load(f)
+    return {table['db_id']: table for table in tables}
+
+
+class SchemaEntry:
+    """One database's tables.json entry plus the lookups derived from it."""
+
+    __slots__ = ("db_id", "schema", "flat", "table_names", "table_prefixes", "table_columns", "column_tables",
+                 "primary_keys", "foreign_keys", "neighbours")
+
+    def __init__(self, db_id: str, schema: dict, flat: str, table_names: FrozenSet[str],
+                 table_prefixes: FrozenSet[str], table_columns: Dict[str, FrozenSet[str]],
+                 column_tables: Dict[str, Tuple[str, ...]], primary_keys: Tuple[str, ...],
+                 foreign_keys: Tuple[Tuple[str, str], ...], neighbours: Dict[str, FrozenSet[str]]):
+        self.db_id = db_id
+        self.schema = schema
+        # flatten_schema(schema).strip()
+        self.flat = flat
+        # Lowercased table names and every non-empty prefix of them (models.sql_state)
+        self.table_names = table_names
+        self.table_prefixes = table_prefixes
+        # Lowercased table -> its columns, and column -> the tables that have it
+        self.table_columns = table_columns
+        self.column_tables = column_tables
+        # "table.column" keys and the foreign-key graph between tables
+        self.primary_keys = primary_keys
+        self.foreign_keys = foreign_keys
+        self.neighbours = neighbours
+
+    @classmethod
+    def build(cls, schema: dict) -> 'SchemaEntry':
+        tables = [name.lower() for name in schema.get('table_names_original', [])]
+        columns = schema.get('column_names_original', [])
+
+        def qualified(column_id: int) -> str:
+            table_id, name = columns[column_id]
+            return f"{tables[table_id]}.{name.lower()}" if table_id >= 0 else name.lower()
+
+        table_columns, column_tables = {}, {}
+        for table_id, name in columns:
+            if table_id >= 0:
+                table_columns.setdefault(tables[table_id], set()).add(name.lower())
+                column_tables.setdefault(name.lower(), []).append(tables[table_id])
+        neighbours = {table: set() for table in tables}
+        foreign_keys = []
+        for col_a, col_b in schema.get('foreign_keys', []):
+            foreign_keys.append((qualified(col_a), qualified(col_b)))
+            table_a, table_b = tables[columns[col_a][0]], tables[columns[col_b][0]]
+            if table_a != table_b:
+                neighbours[table_a].add(table_b)
+                neighbours[table_b].add(table_a)
+
+        names = frozenset(tables)
+        return cls(
+            db_id=schema['db_id'],
+            schema=schema,
+            flat=flatten_schema(schema).strip(),
+            table_names=names,
+            table_prefixes=frozenset(name[:i] for name in names for i in range(1, len(name) + 1)),
+            table_columns={table: frozenset(names) for table, names in table_columns.items()},
+            column_tables={column: tuple(owners) for column, owners in column_tables.items()},
+            # Composite keys appear as lists of column ids in some tables.json files
+            primary_keys=tuple(qualified(column_id) for key in schema.get('primary_keys', [])
+                               for column_id in (key if isinstance(key, list) else [key])),
+            foreign_keys=tuple(foreign_keys),
+            neighbours={table: frozenset(others) for table, others in neighbours.items()},
+        )
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def _source_stats(paths: Sequence[str]) -> List[dict]:
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append({"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime})
+    return stats
+
+
+def _sources_hash(paths: Sequence[str]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def compile_registry(paths: Sequence[str]) -> bytes:
+    """
+    Registry file contents for one or more tables.json files (later files win on
+    duplicate db_ids): MAGIC, the header length, a JSON header with the sources and
+    db_id -> [offset, length, fingerprint], then one pickled SchemaEntry per database.
+    """
+    schemas = {}
+    for path in paths:
+        schemas.update(read_tables(path))
+
+    blobs, index, offset = [], {}, 0
+    for db_id in sorted(schemas):
+        blob = pickle.dumps(SchemaEntry.build(schemas[db_id]), protocol=pickle.HIGHEST_PROTOCOL)
+        index[db_id] = [offset, len(blob), schema_fingerprint(schemas[db_id])]
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = json.dumps({
+        "version": REGISTRY_VERSION,
+        "sources": _source_stats(paths),
+        "sources_hash": _sources_hash(paths),
+        "databases": index,
+    }).encode("utf-8")
+    return b"".join([MAGIC, _HEADER_LENGTH.pack(len(header)), header] + blobs)
+
+
+def _read_header(buffer) -> Tuple[dict, int]:
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a schema registry file")
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    (length,) = _HEADER_LENGTH.unpack(bytes(buffer[len(MAGIC):start]))
+    return json.loads(bytes(buffer[start:start + length]).decode("utf-8")), start + length
+
+
+def registry_path(paths: Sequence[str], cache_dir: str = REGISTRY_DIR) -> str:
+    key = hashlib.sha1("|".join(os.path.abspath(path) for path in paths).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(paths[0]))[0]
+    return os.path.join(cache_dir, f"{stem}-{key}.schemas")
+
+
+def _is_fresh(header: dict, paths: Sequence[str]) -> bool:
+    if header.get("version") != REGISTRY_VERSION:
+        return False
+    if [source["path"] for source in header["sources"]] != [os.path.abspath(path) for path in paths]:
+        return False
+    if header["sources"] == _source_stats(paths):
+        return True
+    # Touched but possibly unchanged (e.g. a fresh checkout): compare contents
+    return header["sources_hash"] == _sources_hash(paths)
+
+
+class SchemaRegistry(Mapping):
+    """
+    Read-only db_id -> schema mapping over a compiled registry file.
+
+    Opening reads only the header; a database is unpickled on first access.
+    The file is memory-mapped, so forked workers share its pages instead of
+    each holding parsed copies. Pickling a registry (spawned workers) sends the
+    tables.json paths, and the receiving process maps the same compiled file.
+
+    registry[db_id] is the tables.json dict as before; entry(db_id) adds the
+    precomputed lookups (see SchemaEntry). With cache_dir=None the registry is
+    compiled in memory and nothing is written.
+    """
+
+    def __init__(self, paths: Union[str, Sequence[str]], cache_dir: Optional[str] = REGISTRY_DIR):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.cache_dir = cache_dir
+        self.path = registry_path(self.paths, cache_dir) if cache_dir is not None else None
+        self._entries = {}
+        self._buffer = self._open()
+        header, self._data_start = _read_header(self._buffer)
+        self._index = {db_id: tuple(value) for db_id, value in header["databases"].items()}
+
+    def _open(self):
+        if self.path is None:
+            return memoryview(compile_registry(self.paths))
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if _is_fresh(_read_header(buffer)[0], self.paths):
+                    return buffer
+            except (ValueError, KeyError):
+                pass
+            buffer.close()
+
+        contents = compile_registry(self.paths)
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # A temporary file per process: ranks starting together must not truncate each other's file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(self.path) + ".",
+                                            suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(contents)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            # Read-only output directory (or the file is mapped elsewhere on Windows): serve from memory
+            return memoryview(contents)
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entry(self, db_id: str) -> SchemaEntry:
+        entry = self._entries.get(db_id)
+        if entry is None:
+            offset, length, _ = self._index[db_id]
+            start = self._data_start + offset
+            entry = self._entries[db_id] = pickle.loads(self._buffer[start:start + length])
+        return entry
+
+    def __getitem__(self, db_id: str) -> dict:
+        return self.entry(db_id).schema
+
+    def __contains__(self, db_id) -> bool:
+        return db_id in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def fingerprint(self, db_id: str) -> str:
+        """schema_fingerprint of the database, read from the index without loading it."""
+        return self._index[db_id][2]
+
+    def flat(self, db_id: str) -> str:
+        return self.entry(db_id).flat
+
+    def loaded(self) -> int:
+        return len(self._entries)
+
+    def __getstate__(self):
+        return {"paths": self.paths, "cache_dir": self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state["paths"], state["cache_dir"])
+
+
+def flat_schema(schemas: Mapping, db_id: str) -> str:
+    """Flattened schema text, precomputed when `schemas` is a SchemaRegistry."""
+    if isinstance(schemas, SchemaRegistry):
+        return schemas.flat(db_id)
+    return flatten_schema(schemas[db_id]).strip()
+
+
+def fingerprint_of(schemas: Mapping, db_id: str) -> str:
+    """schema_fingerprint of a database, without loading it when `schemas` is a SchemaRegistry."""
+    if isinstance(schemas, SchemaRegistry):
+        return schemas.fingerprint(db_id)
+    return schema_fingerprint(schemas[db_id])
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Compile tables.json files into a schema registry")
+    parser.add_argument("tables", nargs="*", default=["data/spider_data/tables.json"])
+    parser.add_argument("--cache-dir", default=REGISTRY_DIR)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    registry = SchemaRegistry(args.tables, cache_dir=args.cache_dir)
+    print(f"💾 {len(registry)} databases in {registry.path} "
+          f"({os.path.getsize(registry.path) / 2 ** 20:.2f} MB, opened in {1000 * (time.perf_counter() - start):.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 import json
-from typing import List, Dict
+from typing import List, Dict, Mapping, Optional, Union
 
-def load_tables(file_path: str) -> Dict[str, dict]:
-    with open(file_path, 'r') as f:
-        tables = json.load(f)
-    return {table['db_id']: table for table in tables}
+# Where load_tables keeps compiled schema registries, relative to the working directory
+SCHEMA_CACHE_DIR = "output/cache/schemas"
+
+def load_tables(file_path: Union[str, List[str]], cache_dir: Optional[str] = SCHEMA_CACHE_DIR) -> Mapping[str, dict]:
+    """
+    db_id -> schema mapping over one or more tables.json files (later files win on duplicate db_ids).
+
+    The result is a read-only, lazily loaded SchemaRegistry (see preprocess.schema_registry),
+    not a dict: use dict(load_tables(...)) where a mutable copy is needed. The files are
+    compiled once into a registry file under `cache_dir`, which later calls and other
+    processes reuse; pass cache_dir=None to compile in memory without writing anything.
+    """
+    from preprocess.schema_registry import SchemaRegistry
+    return SchemaRegistry(file_path, cache_dir=cache_dir)
 
 def flatten_schema(db_schema: dict) -> str:
     table_names = db_schema["table_names_original"]
@@ -0,0 +1,37 @@
+#Readers for the Spider JSON files (examples and prediction arrays). Kept free of the builder's
+#dependencies so the scoring commands can stream their inputs without importing pruning or value indexes
+
+import json
+from typing import Iterator, List
+
+
+def load_spider_data(path: str) -> List[dict]:
+    """Load Spider dataset from JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_spider_data(path: str, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """Stream the examples of a Spider JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} is not a JSON array")
+        pos = 1
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                example, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield example
+            pos = end
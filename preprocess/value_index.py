@@ -0,0 +1,359 @@
+#Offline inverted index over the text cell values of every database, so values quoted in a question
+#("students from France") can be added to the prompt as table.column = "value" without querying SQLite
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from preprocess.schema_pruning import STOPWORDS, WORD_RE, char_ngrams
+
+# Bump when the index layout or the value selection changes, to force a rebuild
+VALUE_INDEX_VERSION = 1
+MAX_VALUE_LENGTH = 64
+MAX_VALUES_PER_COLUMN = 5000
+# Character trigrams shared by more value words than this are dropped from the fuzzy index
+MAX_POSTINGS = 1000
+
+
+class ValueMatch(NamedTuple):
+    table: str
+    column: str
+    value: str
+    score: float
+
+
+def database_file(db_path: str, db_id: str) -> str:
+    """Spider layout: <db_path>/<db_id>/<db_id>.sqlite"""
+    return os.path.join(db_path, db_id, f"{db_id}.sqlite")
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_text_values(sqlite_path: str, max_values_per_column: int = MAX_VALUES_PER_COLUMN
+                     ) -> Iterable[Tuple[str, str, str]]:
+    """(table, column, value) for the distinct short text values of every column."""
+    connection = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    # Some Spider databases hold text that is not valid UTF-8
+    connection.text_factory = lambda data: data.decode("utf-8", errors="ignore")
+    try:
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+            for column in columns:
+                try:
+                    rows = connection.execute(
+                        f'SELECT DISTINCT "{column}" FROM "{table}" WHERE typeof("{column}") = \'text\' LIMIT ?',
+                        (max_values_per_column,)).fetchall()
+                except sqlite3.Error:
+                    continue
+                for (value,) in rows:
+                    value = value.strip()
+                    if value and len(value) <= MAX_VALUE_LENGTH:
+                        yield table, column, value
+    finally:
+        connection.close()
+
+
+def value_words(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower())
+
+
+class DatabaseValueIndex:
+    """
+    Values of one database, keyed by their normalized word sequence.
+
+    A question word matches a value word exactly or by trigram Dice similarity;
+    a value matches when its non-stopword words are matched well enough on
+    average. Per-key word ids and the entries (column, original spelling) of
+    each key are stored in CSR layout (offsets into flat arrays).
+    """
+
+    def __init__(self, db_id: str, columns: List[Tuple[str, str]], words: List[str], key_offsets: array,
+                 key_words: array, entry_offsets: array, entry_columns: array, entry_values: List[str],
+                 word_keys: Dict[int, array], gram_words: Dict[str, array]):
+        self.db_id = db_id
+        self.columns = columns
+        self.words = words
+        self.word_ids = {word: word_id for word_id, word in enumerate(words)}
+        self.key_offsets = key_offsets
+        self.key_words = key_words
+        self.entry_offsets = entry_offsets
+        self.entry_columns = entry_columns
+        self.entry_values = entry_values
+        self.word_keys = word_keys
+        self.gram_words = gram_words
+        self._word_grams = {}
+
+    @classmethod
+    def build(cls, db_id: str, rows: Iterable[Tuple[str, str, str]]) -> 'DatabaseValueIndex':
+        columns, column_ids = [], {}
+        keys = {}  # word tuple -> {column id: original value}
+        for table, column, value in rows:
+            words = tuple(value_words(value))
+            # Numbers are copied from the question by the model anyway
+            if not words or all(word.isdigit() for word in words):
+                continue
+            column_id = column_ids.setdefault((table, column), len(columns))
+            if column_id == len(columns):
+                columns.append((table, column))
+            keys.setdefault(words, {}).setdefault(column_id, value)
+
+        words, word_ids = [], {}
+        key_offsets, key_words = array('i', [0]), array('i')
+        entry_offsets, entry_columns, entry_values = array('i', [0]), array('i'), []
+        word_keys = {}
+        for key_id, (key, entries) in enumerate(sorted(keys.items())):
+            for word in key:
+                word_id = word_ids.setdefault(word, len(words))
+                if word_id == len(words):
+                    words.append(word)
+                key_words.append(word_id)
+                word_keys.setdefault(word_id, array('i'))
+                if not word_keys[word_id] or word_keys[word_id][-1] != key_id:
+                    word_keys[word_id].append(key_id)
+            key_offsets.append(len(key_words))
+            for column_id, value in sorted(entries.items()):
+                entry_columns.append(column_id)
+                entry_values.append(value)
+            entry_offsets.append(len(entry_columns))
+
+        gram_words = {}
+        for word_id, word in enumerate(words):
+            if not word.isdigit():
+                for gram in char_ngrams(word):
+                    gram_words.setdefault(gram, array('i')).append(word_id)
+        gram_words = {gram: ids for gram, ids in gram_words.items() if len(ids) <= MAX_POSTINGS}
+
+        return cls(db_id, columns, words, key_offsets, key_words, entry_offsets, entry_columns, entry_values,
+                   word_keys, gram_words)
+
+    def __len__(self):
+        return len(self.key_offsets) - 1
+
+    def _grams(self, word_id: int) -> int:
+        if word_id not in self._word_grams:
+            self._word_grams[word_id] = len(char_ngrams(self.words[word_id]))
+        return self._word_grams[word_id]
+
+    def similar_words(self, word: str, min_similarity: float = 0.8, min_fuzzy_length: int = 4) -> Dict[int, float]:
+        """Value word id -> similarity (1.0 for the word itself, trigram Dice otherwise)."""
+        word_id = self.word_ids.get(word)
+        if word_id is not None:
+            return {word_id: 1.0}
+        if len(word) < min_fuzzy_length or word.isdigit():
+            return {}
+        grams = char_ngrams(word)
+        shared = {}
+        for gram in grams:
+            for candidate in self.gram_words.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        similar = {}
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + self._grams(candidate))
+            if score >= min_similarity:
+                similar[candidate] = score
+        return similar
+
+    def match(self, question: str, max_matches: int = 5, min_score: float = 0.8,
+              min_similarity: float = 0.8) -> List[ValueMatch]:
+        """Values whose words all occur in the question (exactly or fuzzily), best first."""
+        similarity = {}
+        for word in set(value_words(question)) - STOPWORDS:
+            for word_id, score in self.similar_words(word, min_similarity).items():
+                similarity[word_id] = max(score, similarity.get(word_id, 0.0))
+
+        candidates = set()
+        for word_id in similarity:
+            candidates.update(self.word_keys.get(word_id, ()))
+
+        scored = []
+        for key_id in candidates:
+            key = self.key_words[self.key_offsets[key_id]:self.key_offsets[key_id + 1]]
+            required = [word_id for word_id in key if self.words[word_id] not in STOPWORDS] or key
+            score = sum(similarity.get(word_id, 0.0) for word_id in required) / len(required)
+            if score >= min_score:
+                # Prefer exact over fuzzy, then longer (more specific) values
+                scored.append((-score, -len(required), key_id, score))
+        scored.sort()
+
+        matches = []
+        for _, _, key_id, score in scored[:max_matches]:
+            for entry in range(self.entry_offsets[key_id], self.entry_offsets[key_id + 1]):
+                table, column = self.columns[self.entry_columns[entry]]
+                matches.append(ValueMatch(table, column, self.entry_values[entry], round(score, 3)))
+        return matches[:max_matches]
+
+    def state_dict(self) -> dict:
+        return {
+            'db_id': self.db_id, 'columns': self.columns, 'words': self.words, 'key_offsets': self.key_offsets,
+            'key_words': self.key_words, 'entry_offsets': self.entry_offsets, 'entry_columns': self.entry_columns,
+            'entry_values': self.entry_values, 'word_keys': self.word_keys, 'gram_words': self.gram_words,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state: dict) -> 'DatabaseValueIndex':
+        return cls(**state)
+
+
+def format_values(matches: List[ValueMatch]) -> str:
+    """Prompt segment for matched values: table.column = "value", ..."""
+    return ", ".join(f'{match.table}.{match.column} = "{match.value}"' for match in matches)
+
+
+class ValueIndex:
+    """
+    Per-database value indexes written by build_value_index, loaded lazily one
+    database at a time. Databases missing from the index have no values.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, index_dir: str, max_matches: int = 5, min_score: float = 0.8):
+        self.index_dir = index_dir
+        self.max_matches = max_matches
+        self.min_score = min_score
+        self._indexes = {}
+        self.databases = {}
+        manifest_path = os.path.join(index_dir, self.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == VALUE_INDEX_VERSION:
+                self.databases = manifest['databases']
+            else:
+                print(f"⚠️ Ignoring value index in {index_dir}: built by another version, rebuild it")
+
+    def get(self, db_id: str) -> Optional[DatabaseValueIndex]:
+        if db_id not in self._indexes:
+            index = None
+            if db_id in self.databases:
+                with open(os.path.join(self.index_dir, f"{db_id}.pkl"), 'rb') as f:
+                    index = DatabaseValueIndex.from_state_dict(pickle.load(f))
+            self._indexes[db_id] = index
+        return self._indexes[db_id]
+
+    def match(self, db_id: str, question: str) -> List[ValueMatch]:
+        index = self.get(db_id)
+        if index is None:
+            return []
+        return index.match(question, max_matches=self.max_matches, min_score=self.min_score)
+
+    def values_text(self, db_id: str, question: str) -> str:
+        return format_values(self.match(db_id, question))
+
+    def database_hash(self, db_id: str) -> str:
+        """Content hash of the database file the index of `db_id` was built from ('' if not indexed)."""
+        return self.databases.get(db_id, {}).get('hash', '')
+
+    def fingerprint(self) -> str:
+        """Changes whenever any indexed database or the match settings change."""
+        digest = hashlib.sha256(f"{VALUE_INDEX_VERSION}:{self.max_matches}:{self.min_score}".encode('utf-8'))
+        for db_id in sorted(self.databases):
+            digest.update(f"{db_id}:{self.databases[db_id]['hash']}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def params(self) -> dict:
+        return {'index_dir': self.index_dir, 'max_matches': self.max_matches, 'min_score': self.min_score}
+
+
+def build_value_index(db_path: str, output_dir: str, db_ids: Optional[List[str]] = None,
+                      max_values_per_column: int = MAX_VALUES_PER_COLUMN) -> dict:
+    """
+    (Re)build the value index of every database under `db_path` (or of `db_ids`).
+    A database is only re-read when its file's content hash changed since the
+    last build; the hash is only recomputed when the file's size or mtime changed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, ValueIndex.MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == VALUE_INDEX_VERSION:
+            previous = manifest['databases']
+
+    # A full build drops databases that are gone; a partial one keeps the others as they are
+    databases = {}
+    if db_ids is None:
+        db_ids = sorted(name for name in os.listdir(db_path) if os.path.exists(database_file(db_path, name)))
+    else:
+        databases = {db_id: entry for db_id, entry in previous.items() if db_id not in db_ids}
+    built = unchanged = 0
+    for db_id in db_ids:
+        path = database_file(db_path, db_id)
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        entry = previous.get(db_id)
+        index_path = os.path.join(output_dir, f"{db_id}.pkl")
+        if entry is not None and os.path.exists(index_path):
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                databases[db_id] = entry
+                unchanged += 1
+                continue
+            content_hash = file_hash(path)
+            if entry['hash'] == content_hash:
+                databases[db_id] = {**entry, 'size': stat.st_size, 'mtime': stat.st_mtime}
+                unchanged += 1
+                continue
+        else:
+            content_hash = file_hash(path)
+
+        index = DatabaseValueIndex.build(db_id, read_text_values(path, max_values_per_column))
+        with open(index_path + '.tmp', 'wb') as f:
+            pickle.dump(index.state_dict(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_path + '.tmp', index_path)
+        databases[db_id] = {'hash': content_hash, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                            'values': len(index)}
+        built += 1
+
+    for db_id in set(previous) - set(databases):
+        stale = os.path.join(output_dir, f"{db_id}.pkl")
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': VALUE_INDEX_VERSION, 'db_path': db_path, 'databases': databases}, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return {'databases': len(databases), 'built': built, 'unchanged': unchanged}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the cell-value index of the Spider databases")
+    parser.add_argument("--db-path", default="data/spider_data/database")
+    parser.add_argument("--output-dir", default="output/value_index")
+    parser.add_argument("--max-values-per-column", type=int, default=MAX_VALUES_PER_COLUMN)
+    parser.add_argument("--query", nargs=2, metavar=("DB_ID", "QUESTION"), help="print the values matched in a question")
+    args = parser.parse_args(argv)
+
+    if args.query:
+        index = ValueIndex(args.output_dir)
+        start = time.perf_counter()
+        matches = index.match(*args.query)
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        for match in matches:
+            print(f"  {match.table}.{match.column} = {match.value!r} ({match.score})")
+        print(f"⏱️ {len(matches)} matches in {elapsed_ms:.3f} ms (including loading the database's index)")
+        return
+
+    start = time.perf_counter()
+    summary = build_value_index(args.db_path, args.output_dir, max_values_per_column=args.max_values_per_column)
+    print(f"💾 Value index of {summary['databases']} databases in {args.output_dir}: {summary['built']} built, "
+          f"{summary['unchanged']} unchanged ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
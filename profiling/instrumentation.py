@@ -0,0 +1,265 @@
+#Lightweight instrumentation: named stage timers with log-scale histograms, throughput counters, a JSON dump
+#and an opt-in torch profiler window. A disabled Instrumentation hands out one shared no-op context manager.
+
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Optional
+
+# Histogram buckets are powers of two in milliseconds: bucket i holds durations up to 2 ** (i + MIN_EXPONENT) ms
+MIN_EXPONENT = -10
+NUM_BUCKETS = 32
+_NULL_STAGE = nullcontext()
+
+
+def _bucket(ms: float) -> int:
+    if ms <= 0:
+        return 0
+    return max(0, min(NUM_BUCKETS - 1, math.ceil(math.log2(ms)) - MIN_EXPONENT))
+
+
+def _bucket_upper_ms(index: int) -> float:
+    return 2.0 ** (index + MIN_EXPONENT)
+
+
+class _Stage:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record(self.name, 1000 * (time.perf_counter() - self.start))
+        return False
+
+
+class Instrumentation:
+    """
+    Stage timers and throughput counters.
+
+        with instrumentation.stage("tokenization"):
+            ...
+        instrumentation.count(examples=16, input_tokens=2048)
+
+    Stages may nest (e.g. "encoder" runs inside "generate"), so stage totals do
+    not add up to the wall clock. Each stage keeps its count, total, max and a
+    fixed-size histogram, so memory stays bounded and the states of several
+    processes can be merged.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self._start = time.perf_counter()
+        self._stop = None
+        self._hooks = []
+
+    def stage(self, name: str):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def record(self, name: str, ms: float):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * NUM_BUCKETS}
+        stage["count"] += 1
+        stage["total_ms"] += ms
+        stage["max_ms"] = max(stage["max_ms"], ms)
+        stage["buckets"][_bucket(ms)] += 1
+
+    def count(self, **counts: int):
+        if self.enabled:
+            for name, value in counts.items():
+                self.counters[name] += value
+
+    def start(self):
+        """Restart the wall clock the throughput figures are computed over."""
+        self._start = time.perf_counter()
+        self._stop = None
+
+    def stop(self):
+        self._stop = time.perf_counter()
+
+    def attach_encoder(self, model):
+        """Time every call of the model's encoder as the "encoder" stage (forward hooks, removed by detach)."""
+        if not self.enabled:
+            return
+        encoder = model.get_encoder()
+        starts = []
+
+        def before(module, args):
+            starts.append(time.perf_counter())
+
+        def after(module, args, output):
+            self.record("encoder", 1000 * (time.perf_counter() - starts.pop()))
+
+        self._hooks += [encoder.register_forward_pre_hook(before), encoder.register_forward_hook(after)]
+
+    def detach(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+    def state(self) -> dict:
+        """Picklable raw state, see merge."""
+        return {"stages": self.stages, "counters": dict(self.counters)}
+
+    def merge(self, state: dict):
+        """Add the stages and counters of another process's Instrumentation.state()."""
+        for name, other in state["stages"].items():
+            stage = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                  "buckets": [0] * NUM_BUCKETS})
+            stage["count"] += other["count"]
+            stage["total_ms"] += other["total_ms"]
+            stage["max_ms"] = max(stage["max_ms"], other["max_ms"])
+            stage["buckets"] = [a + b for a, b in zip(stage["buckets"], other["buckets"])]
+        for name, value in state["counters"].items():
+            self.counters[name] += value
+
+    @staticmethod
+    def _percentile(stage: dict, q: float) -> float:
+        """Upper edge of the histogram bucket holding the q-th percentile (capped at the max)."""
+        rank = q / 100 * stage["count"]
+        seen = 0
+        for index, count in enumerate(stage["buckets"]):
+            seen += count
+            if count and seen >= rank:
+                return min(_bucket_upper_ms(index), stage["max_ms"])
+        return stage["max_ms"]
+
+    def summary(self) -> dict:
+        wall_s = (self._stop or time.perf_counter()) - self._start
+        stages = {}
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]["total_ms"]):
+            stages[name] = {
+                "count": stage["count"],
+                "total_ms": round(stage["total_ms"], 3),
+                "mean_ms": round(stage["total_ms"] / stage["count"], 4),
+                "p50_ms": round(self._percentile(stage, 50), 4),
+                "p90_ms": round(self._percentile(stage, 90), 4),
+                "p99_ms": round(self._percentile(stage, 99), 4),
+                "max_ms": round(stage["max_ms"], 4),
+                # Upper bucket edge (ms) -> count, non-empty buckets only
+                "histogram": {f"{_bucket_upper_ms(i):g}": count for i, count in enumerate(stage["buckets"]) if count},
+            }
+        throughput = {f"{name}_per_sec": round(value / wall_s, 2) if wall_s > 0 else 0.0
+                      for name, value in sorted(self.counters.items())}
+        return {"wall_s": round(wall_s, 3), "counters": dict(self.counters), "throughput": throughput,
+                "stages": stages}
+
+    def dump(self, path: str) -> dict:
+        summary = self.summary()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def report(self):
+        summary = self.summary()
+        print(f"⏱️ {summary['wall_s']:.2f}s wall clock; "
+              + ", ".join(f"{value} {name.replace('_per_sec', '')}/s" for name, value in summary["throughput"].items()))
+        for name, stage in summary["stages"].items():
+            print(f"   {name:<20} {stage['count']:>8} calls {stage['total_ms']:>12.1f} ms total "
+                  f"{stage['mean_ms']:>10.3f} mean {stage['p90_ms']:>10.3f} p90 {stage['max_ms']:>10.3f} max")
+
+
+def parse_window(window: Optional[str]):
+    """Parse a START:COUNT step window such as "10:5" into (10, 5); None stays None."""
+    if not window:
+        return None
+    start, _, count = window.partition(":")
+    return int(start), int(count or 1)
+
+
+class ProfilerWindow:
+    """
+    torch.profiler trace of steps [start, start + count): call step() once per
+    training step or decoded batch. Outside the window step() costs one comparison.
+    """
+
+    def __init__(self, start: int, count: int, output_dir: str = "output/profiles", record_shapes: bool = True):
+        self.start = start
+        self.end = start + count
+        self.output_dir = output_dir
+        self.record_shapes = record_shapes
+        self.steps = 0
+        self._profiler = None
+        self.trace_path = None
+        if self.start == 0:
+            self._begin()
+
+    def _begin(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._profiler = profile(activities=activities, record_shapes=self.record_shapes)
+        self._profiler.__enter__()
+
+    def _finish(self):
+        self._profiler.__exit__(None, None, None)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.trace_path = os.path.join(self.output_dir, f"trace_steps_{self.start}-{self.steps - 1}.json")
+        self._profiler.export_chrome_trace(self.trace_path)
+        self._profiler = None
+        print(f"💾 Saved torch profiler trace of steps {self.start}-{self.steps - 1} to {self.trace_path}")
+
+    def step(self):
+        self.steps += 1
+        if self._profiler is not None and self.steps >= self.end:
+            self._finish()
+        elif self._profiler is None and self.steps == self.start:
+            self._begin()
+
+    def close(self):
+        """End a window that is still open (fewer steps than requested)."""
+        if self._profiler is not None:
+            self._finish()
+
+
+def training_callbacks(instrumentation: Optional[Instrumentation] = None,
+                       profiler: Optional[ProfilerWindow] = None) -> list:
+    """Trainer callbacks timing every optimizer step ("train_step") and driving the profiler window."""
+    from transformers import TrainerCallback
+
+    class InstrumentationCallback(TrainerCallback):
+        def __init__(self):
+            self._step_start = None
+
+        def on_train_begin(self, args, state, control, **kwargs):
+            if instrumentation is not None:
+                instrumentation.start()
+
+        def on_step_begin(self, args, state, control, **kwargs):
+            self._step_start = time.perf_counter()
+
+        def on_step_end(self, args, state, control, **kwargs):
+            if instrumentation is not None and self._step_start is not None:
+                instrumentation.record("train_step", 1000 * (time.perf_counter() - self._step_start))
+                instrumentation.count(steps=1)
+            if profiler is not None:
+                profiler.step()
+
+        def on_train_end(self, args, state, control, **kwargs):
+            if instrumentation is not None:
+                instrumentation.stop()
+            if profiler is not None:
+                profiler.close()
+
+    return [InstrumentationCallback()]
+
+
+def stage_of(instrumentation: Optional[Instrumentation], name: str):
+    """instrumentation.stage(name), or a no-op when there is no instrumentation."""
+    return instrumentation.stage(name) if instrumentation is not None else _NULL_STAGE
+
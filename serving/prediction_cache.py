@@ -0,0 +1,160 @@
+#Two-tier cache of decoded predictions: an in-memory LRU in front of a SQLite store, keyed by the
+#normalized question, the database schema and a fingerprint of the model weights and decode settings
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+
+from preprocess.schema_registry import fingerprint_of
+
+TRAILING_PUNCT_RE = re.compile(r"[\s?.!]+$")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Unicode-normalize, collapse whitespace and drop trailing punctuation. Case is
+    kept because values in the question (e.g. 'France') are copied into the SQL.
+    """
+    question = unicodedata.normalize("NFKC", question)
+    question = " ".join(question.split())
+    return TRAILING_PUNCT_RE.sub("", question)
+
+
+def _update_digest(digest, value):
+    if isinstance(value, (tuple, list)):
+        # Packed parameters of quantized layers
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, torch.Tensor):
+        tensor = value.detach().cpu()
+        if tensor.is_quantized:
+            tensor = tensor.dequantize()
+        tensor = tensor.contiguous()
+        digest.update(f"{tuple(tensor.shape)}:{tensor.dtype}".encode("utf-8"))
+        digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    else:
+        digest.update(repr(value).encode("utf-8"))
+
+
+def model_fingerprint(model, decode_params: Optional[dict] = None) -> str:
+    """Hash of the model config, every weight tensor (fp32 or quantized) and the decode parameters."""
+    digest = hashlib.sha256()
+    digest.update(model.config.to_json_string(use_diff=False).encode("utf-8"))
+    for name, value in sorted(model.state_dict().items()):
+        digest.update(name.encode("utf-8"))
+        _update_digest(digest, value)
+    digest.update(json.dumps(decode_params or {}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Decoded predictions keyed by (model fingerprint, db_id, schema hash, normalized
+    question).
+
+    Lookups go to the in-memory LRU first and then to the SQLite store. A changed
+    model, decode setting or schema changes the key, so stale predictions are
+    never returned; purge_stale() deletes them from disk.
+    """
+
+    def __init__(self, schemas: Dict[str, dict], model_fp: str, path: Optional[str] = None,
+                 max_size: int = 10000):
+        self.schemas = schemas
+        self.model_fp = model_fp
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._schema_fps = {}
+
+        self._connection = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Used from the server's event loop thread, which need not be the one that opened it
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, model_fp TEXT, db_id TEXT, schema_fp TEXT, value BLOB, created REAL)"
+            )
+            self._connection.commit()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+
+    def schema_fp(self, db_id: str) -> str:
+        if db_id not in self._schema_fps:
+            self._schema_fps[db_id] = fingerprint_of(self.schemas, db_id)
+        return self._schema_fps[db_id]
+
+    def key(self, question: str, db_id: str) -> str:
+        text = f"{self.model_fp}\x00{db_id}\x00{self.schema_fp(db_id)}\x00{normalize_question(question)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, value: dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, question: str, db_id: str) -> Optional[dict]:
+        key = self.key(question, db_id)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self._memory[key]
+
+        if self._connection is not None:
+            row = self._connection.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self._remember(key, value)
+                self.stats["disk_hits"] += 1
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, question: str, db_id: str, value: dict):
+        key = self.key(question, db_id)
+        self._remember(key, value)
+        self.stats["stores"] += 1
+        if self._connection is not None:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO predictions (key, model_fp, db_id, schema_fp, value, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self.model_fp, db_id, self.schema_fp(db_id), pickle.dumps(value), time.time()),
+            )
+            self._connection.commit()
+
+    def purge_stale(self) -> int:
+        """Delete stored predictions made by another model or against an outdated schema."""
+        if self._connection is None:
+            return 0
+        removed = self._connection.execute(
+            "DELETE FROM predictions WHERE model_fp != ?", (self.model_fp,)).rowcount
+        for (db_id,) in self._connection.execute("SELECT DISTINCT db_id FROM predictions").fetchall():
+            if db_id not in self.schemas:
+                removed += self._connection.execute("DELETE FROM predictions WHERE db_id = ?", (db_id,)).rowcount
+            else:
+                removed += self._connection.execute(
+                    "DELETE FROM predictions WHERE db_id = ? AND schema_fp != ?",
+                    (db_id, self.schema_fp(db_id))).rowcount
+        self._connection.commit()
+        return removed
+
+    def summary(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {**self.stats, "size": len(self._memory), "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,350 @@
+#Local inference service: an asyncio HTTP server that gathers concurrent (question, db_id) requests
+#into micro-batches and decodes each batch with T5 + PicardDecoder in one generate call
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import torch
+
+from models.loading import PRECISIONS, load_model
+from models.picard_interface import PicardDecoder
+from models.split_encoding import SchemaStateCache, is_split_encoding
+from preprocess.dataset_builder import build_input_text
+from preprocess.schema_pruning import SchemaPruner
+from preprocess.schema_registry import flat_schema
+from preprocess.schema_utils import flatten_schema
+from preprocess.value_index import ValueIndex
+from serving.prediction_cache import PredictionCache, model_fingerprint
+from training.spider_dataset import split_input_text
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class UnknownDatabase(KeyError):
+    pass
+
+
+class InferenceService:
+    """
+    Micro-batching front end for the model.
+
+    Requests are queued; a single batching task takes the first waiting request,
+    then keeps collecting until `max_batch_size` requests are gathered or
+    `max_wait_ms` has passed, and decodes them together on a worker thread so
+    the event loop keeps accepting requests meanwhile.
+
+    With `schema_states` (split-encoding models) only the question of each
+    request goes through the encoder; schema states come from the cache.
+    """
+
+    def __init__(self, model, tokenizer, schemas: Dict[str, dict], picard: Optional[PicardDecoder] = None,
+                 max_batch_size: int = 16, max_wait_ms: float = 10.0, max_input_length: int = 512,
+                 max_length: int = 100, num_beams: int = 4, use_constraints: bool = True,
+                 pruner: Optional[SchemaPruner] = None, latency_window: int = 10000,
+                 cache: Optional[PredictionCache] = None, schema_states: Optional[SchemaStateCache] = None,
+                 value_index: Optional[ValueIndex] = None):
+        if schema_states is not None and pruner is not None:
+            raise ValueError("schema pruning depends on the question, so pruned schemas cannot be cached")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.schemas = schemas
+        self.picard = picard or PicardDecoder(tokenizer=tokenizer, db_path="", schemas=schemas)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_input_length = max_input_length
+        self.max_length = max_length
+        self.num_beams = num_beams
+        self.use_constraints = use_constraints
+        self.pruner = pruner
+        # Repeated questions are answered from the cache without queueing
+        self.cache = cache
+        self.schema_states = schema_states
+        # Database values matched in the question are added to the prompt (models trained with --values)
+        self.value_index = value_index
+
+        self._flat_schemas = {}
+        self._queue = None
+        self._batch_task = None
+        # One decode at a time: generate already uses every core
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.batches = 0
+        self.decoded = 0
+        self.errors = 0
+
+    def prompt(self, question: str, db_id: str) -> str:
+        """T5 input for a request, built exactly like the training inputs (flattened schemas are cached)."""
+        if db_id not in self.schemas:
+            raise UnknownDatabase(db_id)
+        question = question.strip()
+        values = self.value_index.values_text(db_id, question) if self.value_index is not None else ""
+        if self.pruner is not None:
+            return build_input_text(question, flatten_schema(self.pruner.prune(question, self.schemas[db_id])).strip(),
+                                    values)
+        if db_id not in self._flat_schemas:
+            self._flat_schemas[db_id] = flat_schema(self.schemas, db_id)
+        return build_input_text(question, self._flat_schemas[db_id], values)
+
+    def decode_params(self) -> dict:
+        """Everything besides the weights that changes the output, for the cache fingerprint."""
+        params = {
+            "max_input_length": self.max_input_length,
+            "max_length": self.max_length,
+            "num_beams": self.num_beams,
+            "use_constraints": self.use_constraints,
+            "pruner": vars(self.pruner) if self.pruner is not None else None,
+            "split_encoding": self.schema_states is not None,
+        }
+        if self.value_index is not None:
+            params["values"] = self.value_index.fingerprint()
+        return params
+
+    def start(self):
+        """Start the batching task (call from inside the running event loop)."""
+        self._queue = asyncio.Queue()
+        self._batch_task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            try:
+                await self._batch_task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def predict(self, question: str, db_id: str) -> dict:
+        """Queue one request and wait for its batch to be decoded."""
+        prompt = self.prompt(question, db_id)
+        start = time.perf_counter()
+        result = self.cache.get(question, db_id) if self.cache is not None else None
+        if result is not None:
+            result = {**result, "cached": True}
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((prompt, db_id, future))
+            result = await future
+            if self.cache is not None:
+                self.cache.put(question, db_id, {"sql": result["sql"], "score": result["score"]})
+        latency_ms = 1000 * (time.perf_counter() - start)
+        self.latencies.append(latency_ms)
+        self.requests += 1
+        return {**result, "latency_ms": round(latency_ms, 2)}
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            prompts = [prompt for prompt, _, _ in batch]
+            db_ids = [db_id for _, db_id, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self._decode, prompts, db_ids)
+            except Exception as e:
+                self.errors += len(batch)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.decoded += len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result({**result, "batch_size": len(batch)})
+
+    def _decode(self, prompts: List[str], db_ids: List[str]) -> List[dict]:
+        if self.schema_states is not None:
+            segments = [split_input_text(prompt) for prompt in prompts]
+            encoder_outputs, attention_mask = self.schema_states.encode(
+                [question for question, _ in segments], [schema for _, schema in segments])
+            input_ids = None
+        else:
+            encoded = self.tokenizer(prompts, max_length=self.max_input_length, truncation=True,
+                                     padding=True, return_tensors="pt")
+            encoder_outputs = None
+            input_ids = encoded["input_ids"].to(self.model.device)
+            attention_mask = encoded["attention_mask"].to(self.model.device)
+        with torch.no_grad():
+            return self.picard.batch_decode(
+                model=self.model,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                db_ids=db_ids,
+                max_length=self.max_length,
+                num_beams=self.num_beams,
+                use_constraints=self.use_constraints,
+                encoder_outputs=encoder_outputs,
+            )
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        stats = {
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "avg_batch_size": round(self.decoded / self.batches, 2) if self.batches else 0.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p90": round(percentile(latencies, 90), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "max": round(latencies[-1], 2) if latencies else 0.0,
+            },
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.summary()
+        if self.schema_states is not None:
+            stats["schema_states"] = self.schema_states.summary()
+        return stats
+
+
+# === HTTP front end (stdlib only) ===
+
+async def _read_request(reader: asyncio.StreamReader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def _response(status: int, payload: dict) -> bytes:
+    body = json.dumps(payload).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def handle_request(service: InferenceService, method: str, path: str, body: bytes):
+    """Route one request; returns (status, payload)."""
+    if path == "/health":
+        return 200, {"status": "ok"}
+    if path == "/stats":
+        return 200, service.stats()
+    if path != "/predict":
+        return 404, {"error": f"unknown path {path}"}
+    if method != "POST":
+        return 405, {"error": "use POST"}
+
+    try:
+        request = json.loads(body or b"{}")
+        question, db_id = request["question"], request["db_id"]
+    except (ValueError, KeyError, TypeError):
+        return 400, {"error": 'expected a JSON body with "question" and "db_id"'}
+    try:
+        return 200, await service.predict(question, db_id)
+    except UnknownDatabase:
+        return 404, {"error": f"unknown db_id {db_id}"}
+
+
+async def start_server(service: InferenceService, host: str = "127.0.0.1", port: int = 8000) -> asyncio.AbstractServer:
+    """Start the batching task and an HTTP server for it (port 0 picks a free port)."""
+    service.start()
+
+    async def on_connection(reader, writer):
+        try:
+            request = await _read_request(reader)
+            if request is not None:
+                try:
+                    status, payload = await handle_request(service, *request)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                writer.write(_response(status, payload))
+                await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
+
+
+def main(argv=None):
+    from transformers import T5Tokenizer
+    from preprocess.schema_index import SchemaTokenIndex
+    from preprocess.schema_utils import load_tables
+
+    parser = argparse.ArgumentParser(description="Serve text-to-SQL predictions over HTTP with micro-batching")
+    parser.add_argument("--model-dir", default="output/t5-spider-final")
+    parser.add_argument("--tables", default="data/spider_data/tables.json")
+    parser.add_argument("--db-path", default="data/spider_data/database")
+    parser.add_argument("--schema-index", default="output/schema_index")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--num-beams", type=int, default=4)
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS, help="int8 modes quantize for CPU")
+    parser.add_argument("--cache", default="output/cache/predictions.sqlite", help="on-disk prediction cache")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--schema-cache", default="output/cache/schema_states.sqlite",
+                        help="on-disk schema encoder states (split-encoding models)")
+    parser.add_argument("--value-index", metavar="DIR",
+                        help="add matched database values to prompts (for models trained on dataset_builder --values)")
+    args = parser.parse_args(argv)
+
+    tokenizer = T5Tokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir, precision=args.precision)
+    schemas = load_tables(args.tables)
+    picard = PicardDecoder(tokenizer=tokenizer, db_path=args.db_path, schemas=schemas,
+                           schema_index=SchemaTokenIndex(args.schema_index, tokenizer=tokenizer, schemas=schemas))
+    schema_states = None
+    if is_split_encoding(model):
+        schema_states = SchemaStateCache(model, tokenizer, model_fp=model_fingerprint(model), path=args.schema_cache)
+    service = InferenceService(model, tokenizer, schemas, picard=picard, max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms, num_beams=args.num_beams, schema_states=schema_states,
+                               value_index=ValueIndex(args.value_index) if args.value_index else None)
+    if not args.no_cache:
+        service.cache = PredictionCache(schemas, model_fingerprint(model, service.decode_params()), path=args.cache)
+        removed = service.cache.purge_stale()
+        if removed:
+            print(f"🗑️ Removed {removed} cached predictions from an older model or schema")
+
+    async def serve():
+        server = await start_server(service, args.host, args.port)
+        print(f"🚀 Serving on http://{args.host}:{args.port} (POST /predict, GET /stats)")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
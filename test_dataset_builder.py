@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Smoke test for the sharded dataset builder's tokenized output: the per-shard
+token arrays must be merged into the single train_tokenized / dev_tokenized
+directories that training and evaluation read, in TSV order (synthetic data,
+tiny sentencepiece vocabulary, no network).
+"""
+
+import csv
+import json
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+
+from benchmarks.synthetic import build_tiny_model, synthetic_examples, synthetic_schemas
+from preprocess.dataset_builder import main as build_dataset
+from training.tokenized_dataset import TokenizedSpiderDataset, tokenized_mismatch
+
+
+def write_spider_data(data_dir, schemas):
+    os.makedirs(data_dir)
+    with open(os.path.join(data_dir, "tables.json"), "w", encoding="utf-8") as f:
+        json.dump(list(schemas.values()), f)
+    splits = {"train_spider": synthetic_examples(schemas, 23, seed=1), "dev": synthetic_examples(schemas, 17, seed=2)}
+    for split, examples in splits.items():
+        with open(os.path.join(data_dir, f"{split}.json"), "w", encoding="utf-8") as f:
+            json.dump([{"question": q, "query": sql, "db_id": db_id} for q, sql, db_id in examples], f)
+    return splits
+
+
+def read_tsv(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return list(csv.DictReader(f, delimiter="\t"))
+
+
+def test_tokenized_shards_are_merged():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)  # the schema registry cache goes to ./output
+        try:
+            schemas = synthetic_schemas(4)
+            splits = write_spider_data(os.path.join(work_dir, "data"), schemas)
+            corpus = [text for examples in splits.values() for example in examples for text in example[:2]]
+            corpus += [" ".join(schema["table_names_original"]) for schema in schemas.values()]
+            tokenizer, model = build_tiny_model(work_dir, corpus)
+            tokenizer_dir = os.path.join(work_dir, "tokenizer")
+            tokenizer.save_pretrained(tokenizer_dir)
+
+            output_dir = os.path.join(work_dir, "processed")
+            build_dataset(["--data-dir", os.path.join(work_dir, "data"), "--output-dir", output_dir,
+                           "--splits", "train_spider", "dev", "--workers", "2", "--shard-size", "5",
+                           "--formats", "tsv", "tokenized", "--tokenizer", tokenizer_dir])
+
+            for name, split_names in (("dev", ["dev"]), ("train", ["train_spider"])):
+                rows = read_tsv(os.path.join(output_dir, f"{name}.tsv"))
+                dataset = TokenizedSpiderDataset(os.path.join(output_dir, f"{name}_tokenized"),
+                                                 pad_to_max_length=False)
+                assert len(dataset) == len(rows) == sum(len(splits[split]) for split in split_names)
+                assert dataset.db_ids == [row["db_id"] for row in rows]
+                for idx, row in enumerate(rows):
+                    assert dataset.input_ids(idx).tolist() == tokenizer(row["input"], max_length=512,
+                                                                        truncation=True)["input_ids"]
+                    assert dataset.target_ids(idx).tolist() == tokenizer(row["target"], max_length=256,
+                                                                         truncation=True)["input_ids"]
+            print(f"✅ {len(dataset)} train / {len(read_tsv(os.path.join(output_dir, 'dev.tsv')))} dev examples "
+                  f"merged from 5-example shards")
+
+            # The merged directories must be recognised as stale once they no longer match their TSV
+            dev_tsv, dev_tokenized = os.path.join(output_dir, "dev.tsv"), os.path.join(output_dir, "dev_tokenized")
+            assert tokenized_mismatch(dev_tokenized, [dev_tsv], tokenizer, num_examples=17) is None
+            assert tokenized_mismatch(dev_tokenized, [os.path.join(output_dir, "train.tsv")], tokenizer) is not None
+            assert tokenized_mismatch(dev_tokenized, [dev_tsv], tokenizer, num_examples=16) is not None
+            os.utime(dev_tsv)  # touched, same contents
+            assert tokenized_mismatch(dev_tokenized, [dev_tsv], tokenizer) is None
+            with open(dev_tsv, "a", encoding="utf-8") as f:
+                f.write("question: extra\tSELECT 1\tdb_0000\tdev-99999\n")
+            assert "changed" in tokenized_mismatch(dev_tokenized, [dev_tsv], tokenizer)
+            print("✅ Stale tokenized directories are detected")
+
+            # One pass of training batches straight from the merged directory
+            dataset = TokenizedSpiderDataset(os.path.join(output_dir, "train_tokenized"))
+            model.train()
+            optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+            batches = 0
+            for batch in DataLoader(dataset, batch_size=8):
+                batch["labels"][batch["labels"] == tokenizer.pad_token_id] = -100
+                loss = model(**batch).loss
+                assert torch.isfinite(loss)
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad()
+                batches += 1
+            assert batches == -(-len(dataset) // 8)
+            print(f"✅ Trained {batches} batches from train_tokenized")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_tokenized_shards_are_merged()
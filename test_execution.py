@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for execution accuracy on small on-disk SQLite databases: the progress-handler
+timeout, reuse of cached gold results, timeouts staying out of the cache, and
+invalidation of cached results once a database file is edited.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from evaluation import execution
+from evaluation.execution import DatabasePool, evaluate_execution
+
+# Counts far past anything a 0.2s budget can finish
+RUNAWAY_SQL = ("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 100000000) "
+               "SELECT count(*) FROM n")
+
+
+def create_database(db_dir, db_id, values):
+    os.makedirs(os.path.join(db_dir, db_id))
+    connection = sqlite3.connect(os.path.join(db_dir, db_id, f"{db_id}.sqlite"))
+    connection.execute("CREATE TABLE singer (name TEXT, age INTEGER)")
+    connection.executemany("INSERT INTO singer VALUES (?, ?)", values)
+    connection.commit()
+    connection.close()
+
+
+def count_executions():
+    """Wrap execute_all so the test sees which queries were actually run."""
+    executed = []
+
+    def execute_all(queries, *args, **kwargs):
+        executed.extend(queries)
+        return original(queries, *args, **kwargs)
+
+    original = execution.execute_all
+    execution.execute_all = execute_all
+    return executed, original
+
+
+def test_timeout():
+    with tempfile.TemporaryDirectory() as db_dir:
+        create_database(db_dir, "music", [("Ann", 30)])
+        pool = DatabasePool(db_dir, timeout=0.2, progress_steps=1000)
+        assert pool.execute("music", RUNAWAY_SQL) == (False, "timeout")
+        assert pool.execute("music", "SELECT name FROM singer") == (True, [("Ann",)])
+        assert pool.execute("missing", "SELECT 1") == (False, "database not found: missing")
+        pool.close()
+    print("✅ Runaway queries are interrupted at the timeout")
+
+
+def test_gold_cache():
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_dir, cache_path = os.path.join(work_dir, "database"), os.path.join(work_dir, "gold.sqlite")
+        create_database(db_dir, "music", [("Ann", 30), ("Bob", 40)])
+        items = [
+            {"db_id": "music", "query": "SELECT name FROM singer WHERE age > 35",
+             "gold": "SELECT name FROM singer WHERE age = 40"},
+            {"db_id": "music", "query": "SELECT count(*) FROM singer", "gold": "SELECT count(*) FROM singer"},
+            {"db_id": "music", "query": "SELECT 1", "gold": RUNAWAY_SQL},
+        ]
+        executed, original = count_executions()
+        try:
+            def run():
+                executed.clear()
+                return evaluate_execution(items, db_dir, cache_path=cache_path, workers=1, timeout=0.2)
+
+            assert run() == [True, True, False]
+            assert len(executed) == 6
+            # Predictions always run; of the gold queries only the one that timed out runs again
+            assert run() == [True, True, False]
+            assert [sql for _, sql in executed[3:]] == [RUNAWAY_SQL], executed
+            print("✅ Gold results are reused, timeouts are not cached")
+
+            path = os.path.join(db_dir, "music", "music.sqlite")
+            os.utime(path)  # touched, same contents: still cached
+            run()
+            assert len(executed) == 4, executed
+
+            connection = sqlite3.connect(path)
+            connection.execute("UPDATE singer SET age = 45 WHERE name = 'Bob'")
+            connection.commit()
+            connection.close()
+            assert run() == [False, True, False]
+            assert len(executed) == 6, executed
+            print("✅ Cached gold results are invalidated when the database file changes")
+        finally:
+            execution.execute_all = original
+
+
+if __name__ == "__main__":
+    test_timeout()
+    test_gold_cache()
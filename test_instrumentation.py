@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Unit tests for profiling.instrumentation: merging the state of several
+processes, histogram percentiles, and which steps a ProfilerWindow traces.
+"""
+
+import os
+import tempfile
+
+import torch
+
+from profiling.instrumentation import Instrumentation, ProfilerWindow, parse_window, stage_of
+
+
+def test_merge_and_percentiles():
+    first, second = Instrumentation(), Instrumentation()
+    for _ in range(90):
+        first.record("generate", 1.0)
+    for _ in range(10):
+        second.record("generate", 100.0)
+    second.record("tokenization", 0.5)
+    first.count(examples=16, input_tokens=100)
+    second.count(examples=4)
+
+    first.merge(second.state())
+    stage = first.stages["generate"]
+    assert (stage["count"], stage["total_ms"], stage["max_ms"]) == (100, 1090.0, 100.0)
+    assert sum(stage["buckets"]) == 100
+    assert first.stages["tokenization"]["count"] == 1
+    assert dict(first.counters) == {"examples": 20, "input_tokens": 100}
+
+    summary = first.summary()["stages"]["generate"]
+    # 1 ms falls in the bucket ending at 1 ms; 100 ms in the one ending at 128 ms, capped at the max
+    assert (summary["p50_ms"], summary["p90_ms"], summary["p99_ms"]) == (1.0, 1.0, 100.0), summary
+    assert summary["histogram"] == {"1": 90, "128": 10}
+    assert summary["mean_ms"] == 10.9
+    print("✅ Merged stages, counters and percentiles")
+
+
+def test_disabled_and_stage_of():
+    disabled = Instrumentation(enabled=False)
+    with disabled.stage("generate"):
+        pass
+    disabled.count(examples=1)
+    assert not disabled.stages and not disabled.counters
+    with stage_of(None, "generate"):
+        pass
+    instrumentation = Instrumentation()
+    with stage_of(instrumentation, "generate"):
+        pass
+    assert instrumentation.stages["generate"]["count"] == 1
+    assert parse_window("10:5") == (10, 5) and parse_window("3") == (3, 1) and parse_window(None) is None
+    print("✅ Disabled instrumentation records nothing")
+
+
+class RecordingWindow(ProfilerWindow):
+    """ProfilerWindow that notes the steps where the trace would begin and end."""
+
+    def __init__(self, *args, **kwargs):
+        self.events = []
+        super().__init__(*args, **kwargs)
+
+    def _begin(self):
+        self.events.append(("begin", self.steps))
+        self._profiler = object()
+
+    def _finish(self):
+        self.events.append(("finish", self.steps))
+        self._profiler = None
+
+
+def test_profiler_window_boundaries():
+    window = RecordingWindow(2, 3)
+    for _ in range(8):
+        window.step()
+    # Steps 2, 3 and 4 are traced: begun after the 2nd step() call, finished after the 5th
+    assert window.events == [("begin", 2), ("finish", 5)], window.events
+
+    window = RecordingWindow(0, 2)
+    assert window.events == [("begin", 0)]
+    window.step()
+    window.close()  # fewer steps than requested
+    assert window.events == [("begin", 0), ("finish", 1)], window.events
+    window.close()
+    assert len(window.events) == 2
+    print("✅ Profiler window begins and ends on the requested steps")
+
+
+def test_profiler_trace():
+    with tempfile.TemporaryDirectory() as output_dir:
+        window = ProfilerWindow(1, 2, output_dir=output_dir)
+        for _ in range(4):
+            torch.ones(8, 8) @ torch.ones(8, 8)
+            window.step()
+        assert window.trace_path == os.path.join(output_dir, "trace_steps_1-2.json")
+        assert os.path.getsize(window.trace_path) > 0
+    print("✅ Profiler trace written for the window")
+
+
+if __name__ == "__main__":
+    test_merge_and_percentiles()
+    test_disabled_and_stage_of()
+    test_profiler_window_boundaries()
+    test_profiler_trace()
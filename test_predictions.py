@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental scoring of a predictions file: unchanged rows are skipped,
+while a canonicalizer version bump, a schema change or a partly written scores
+file makes the affected rows score again (synthetic data, no model).
+"""
+
+import csv
+import json
+import os
+import tempfile
+
+from benchmarks.synthetic import synthetic_examples, synthetic_schemas
+from evaluation import predictions
+from evaluation.predictions import update_scores
+
+
+def write_tsv(path, header, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def test_rescoring():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)  # the schema registry cache goes to ./output
+        try:
+            run_rescoring(work_dir)
+        finally:
+            os.chdir(cwd)
+
+
+def run_rescoring(work_dir):
+    schemas = synthetic_schemas(3)
+    examples = synthetic_examples(schemas, 12, seed=3)
+    tables_path = os.path.join(work_dir, "tables.json")
+    with open(tables_path, "w", encoding="utf-8") as f:
+        json.dump(list(schemas.values()), f)
+    examples_path = os.path.join(work_dir, "dev.tsv")
+    write_tsv(examples_path, ["input", "target", "db_id", "example_id"],
+              [(question, sql, db_id, f"dev-{i:05d}") for i, (question, sql, db_id) in enumerate(examples)])
+    predictions_path = os.path.join(work_dir, "predictions.tsv")
+    # Every other prediction is wrong
+    write_tsv(predictions_path, ["predicted_sql", "ground_truth_sql", "db_id", "example_id"],
+              [(sql if i % 2 == 0 else "SELECT 1", sql, db_id, f"dev-{i:05d}")
+               for i, (_, sql, db_id) in enumerate(examples)])
+    output_path = os.path.join(work_dir, "scores.jsonl")
+
+    def score():
+        return update_scores(predictions_path, examples_path, output_path, tables_path=tables_path,
+                             cache_path=os.path.join(work_dir, "canonical.sqlite"), workers=1)
+
+    stats = score()
+    assert (stats["scored"], stats["unchanged"], stats["exact_match"]) == (12, 0, 6), stats
+    stats = score()
+    assert (stats["scored"], stats["unchanged"]) == (0, 12), stats
+    print("✅ Unchanged predictions are not scored again")
+
+    db_id = examples[0][2]
+    schemas[db_id]["column_names_original"].append([0, "added"])
+    with open(tables_path, "w", encoding="utf-8") as f:
+        json.dump(list(schemas.values()), f)
+    stats = score()
+    assert stats["scored"] == sum(example[2] == db_id for example in examples) > 0, stats
+    print(f"✅ A schema change re-scores the {stats['scored']} predictions on that database")
+
+    # A crash mid-write leaves a partial last line: it is dropped and that example scored again
+    with open(output_path, "rb+") as f:
+        f.truncate(os.path.getsize(output_path) - 10)
+    stats = score()
+    assert (stats["scored"], stats["examples"], stats["exact_match"]) == (1, 12, 6), stats
+    print("✅ A truncated scores file is repaired on the next run")
+
+    version = predictions.CANONICAL_VERSION
+    predictions.CANONICAL_VERSION = version + 1
+    try:
+        stats = score()
+    finally:
+        predictions.CANONICAL_VERSION = version
+    assert (stats["scored"], stats["unchanged"], stats["exact_match"]) == (12, 0, 6), stats
+    print("✅ A canonicalizer version bump re-scores unchanged predictions")
+
+
+if __name__ == "__main__":
+    test_rescoring()
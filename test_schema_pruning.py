@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for question-driven schema pruning on a small hand-written schema, including
+a composite primary key (a list of column ids, as some tables.json files have).
+"""
+
+from preprocess.schema_pruning import SchemaPruner
+from preprocess.schema_utils import flatten_schema
+
+SCHEMA = {
+    "db_id": "school",
+    "table_names_original": ["student", "course", "enrollment", "building"],
+    "table_names": ["student", "course", "enrollment", "building"],
+    "column_names_original": [
+        [-1, "*"],
+        [0, "student_id"], [0, "name"], [0, "age"],
+        [1, "course_id"], [1, "title"], [1, "credits"],
+        [2, "student_id"], [2, "course_id"], [2, "grade"],
+        [3, "building_id"], [3, "floor_count"],
+    ],
+    "column_names": [
+        [-1, "*"],
+        [0, "student id"], [0, "name"], [0, "age"],
+        [1, "course id"], [1, "title"], [1, "credits"],
+        [2, "student id"], [2, "course id"], [2, "grade"],
+        [3, "building id"], [3, "floor count"],
+    ],
+    "column_types": ["text", "number", "text", "number", "number", "text", "number", "number", "number", "text",
+                     "number", "number"],
+    "primary_keys": [1, 4, [7, 8], 10],
+    "foreign_keys": [[7, 1], [8, 4]],
+}
+
+
+def column_names(schema, key):
+    return [schema["column_names_original"][c] for c in key] if isinstance(key, list) \
+        else schema["column_names_original"][key]
+
+
+def test_composite_primary_key():
+    question = "What grade did each student get in each course?"
+    for max_columns in (None, 2):
+        pruner = SchemaPruner(max_tables=3, max_columns_per_table=max_columns)
+        pruned = pruner.prune(question, SCHEMA)
+        assert "building" not in pruned["table_names_original"]
+        assert "enrollment" in pruned["table_names_original"]
+        keys = [column_names(pruned, key) for key in pruned["primary_keys"]]
+        # The composite key survives with both columns remapped
+        assert [[2, "student_id"], [2, "course_id"]] in keys, keys
+        assert [0, "student_id"] in keys and [1, "course_id"] in keys
+        for a, b in pruned["foreign_keys"]:
+            assert pruned["column_names_original"][a][1] == pruned["column_names_original"][b][1]
+        flatten_schema(pruned)
+    print("✅ Composite primary key remapped when all its columns are kept")
+
+
+def test_partial_composite_key_dropped():
+    # Only one column of the enrollment table may stay, and it is not enough for the composite key
+    pruner = SchemaPruner(max_tables=3, max_columns_per_table=1, fk_closure=False)
+    pruned = pruner.prune("What grade did each student get in each course?", SCHEMA)
+    assert "enrollment" in pruned["table_names_original"]
+    assert not any(isinstance(key, list) for key in pruned["primary_keys"]), pruned["primary_keys"]
+    kept = len(pruned["column_names_original"])
+    assert all(0 <= c < kept for c in pruned["primary_keys"])
+    print("✅ Composite primary key dropped when one of its columns is pruned")
+
+
+def test_unmatched_question_keeps_schema():
+    assert SchemaPruner().prune("zzz", SCHEMA) is SCHEMA
+    print("✅ Full schema kept when nothing matches")
+
+
+if __name__ == "__main__":
+    test_composite_primary_key()
+    test_partial_composite_key_dropped()
+    test_unmatched_question_keeps_schema()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test of SQL-domain vocabulary pruning on a tiny random T5 (no network): the pruned
+checkpoint, loaded through models.loading, must give the same logits over the kept
+ids and the same generations for in-vocabulary inputs, also after tie_weights().
+"""
+
+import csv
+import os
+import tempfile
+
+import torch
+
+from benchmarks.synthetic import build_tiny_model, synthetic_examples, synthetic_schemas
+from models.loading import load_model
+from models.vocab_pruning import save_pruned_checkpoint, used_token_ids, verify
+from preprocess.schema_utils import flatten_schema
+
+
+def test_prune_load_unchanged():
+    with tempfile.TemporaryDirectory() as work_dir:
+        schemas = synthetic_schemas(4)
+        examples = synthetic_examples(schemas, 40, seed=5)
+        inputs = [f"question: {q} schema: {flatten_schema(schemas[db_id]).strip()}" for q, _, db_id in examples]
+        # The vocabulary also covers words the corpus below never uses, so pruning has something to drop
+        corpus = inputs + [sql for _, sql, _ in examples] + [f"unused filler word{i} zq{i}x" for i in range(200)]
+        tokenizer, model = build_tiny_model(work_dir, corpus, vocab_size=600)
+        model_dir, pruned_dir = os.path.join(work_dir, "model"), os.path.join(work_dir, "pruned")
+        model.save_pretrained(model_dir)
+        tokenizer.save_pretrained(model_dir)
+
+        corpus_path = os.path.join(work_dir, "train.tsv")
+        with open(corpus_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["input", "target", "db_id"])
+            writer.writerows((text, sql, db_id) for text, (_, sql, db_id) in zip(inputs, examples))
+        kept_ids = used_token_ids(tokenizer, [corpus_path], schemas)
+        assert len(kept_ids) < len(tokenizer), (len(kept_ids), len(tokenizer))
+        save_pruned_checkpoint(model_dir, pruned_dir, tokenizer, kept_ids)
+
+        original = load_model(model_dir, device="cpu")
+        pruned = load_model(pruned_dir, device="cpu")
+        assert pruned.get_input_embeddings().weight.shape[0] == len(kept_ids)
+
+        encoded = tokenizer(inputs[:8], padding=True, return_tensors="pt")
+        decoder_input_ids = torch.tensor([[tokenizer.pad_token_id] + kept_ids[5:10]] * 8)
+        kept = torch.tensor(kept_ids)
+
+        def kept_logits(m):
+            with torch.no_grad():
+                return m(**encoded, decoder_input_ids=decoder_input_ids).logits[..., kept]
+
+        expected = kept_logits(original)
+        assert torch.allclose(kept_logits(pruned), expected, atol=1e-5)
+        print(f"✅ Kept {len(kept_ids)} of {len(tokenizer)} tokens with the same logits")
+
+        # Re-tying goes through the wrappers to the kept rows instead of failing
+        pruned.tie_weights()
+        assert pruned.lm_head.weight is pruned.get_input_embeddings().weight
+        assert torch.allclose(kept_logits(pruned), expected, atol=1e-5)
+
+        # Greedy: beam scores are log-probabilities normalised over a smaller vocabulary, so beams may reorder
+        report = verify(original, pruned, tokenizer, inputs[:16], kept_ids, max_length=20, num_beams=1)
+        assert report["in_vocab"] == 16 and report["unchanged"] == report["in_vocab"], report
+        print(f"✅ {report['unchanged']}/{report['in_vocab']} generations unchanged after tie_weights()")
+
+
+if __name__ == "__main__":
+    test_prune_load_unchanged()
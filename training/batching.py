@@ -0,0 +1,228 @@
+#length-bucketed batching and dynamic padding, so each batch is only padded to its own longest example
+
+import math
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from torch.utils.data import DataLoader, Sampler
+from transformers import Trainer, TrainerCallback
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Yields batches of indices with similar input lengths.
+
+    Every epoch the indices are shuffled, cut into buckets of
+    `batch_size * bucket_multiplier` examples, each bucket is sorted by length and
+    split into batches, and finally the batch order is shuffled. The order only
+    depends on (seed, epoch), so a resumed run sees the same batches.
+
+    With num_replicas > 1 every rank builds the same order and keeps batches
+    rank, rank + num_replicas, ...: one optimizer step of N ranks then covers
+    the same examples as N accumulated batches of a single process. Trailing
+    batches that would leave some ranks without one are dropped.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, bucket_multiplier: int = 50,
+                 shuffle: bool = True, seed: int = 42, drop_last: bool = False, num_replicas: int = 1,
+                 rank: int = 0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_multiplier
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batch = bucket[batch_start:batch_start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.num_replicas > 1:
+            batches = batches[:len(batches) - len(batches) % self.num_replicas][self.rank::self.num_replicas]
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        if self.drop_last:
+            num_batches = len(self.lengths) // self.batch_size
+        else:
+            num_batches = math.ceil(len(self.lengths) / self.batch_size)
+        return num_batches // self.num_replicas
+
+
+class DynamicPaddingCollator:
+    """
+    Pads input_ids/attention_mask/labels to the longest example in the batch.
+    Label padding uses -100 so padded positions are ignored by the loss.
+    """
+
+    def __init__(self, pad_token_id: int = 0, label_pad_token_id: int = -100):
+        self.pad_token_id = pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+
+    def _pad(self, sequences: List[torch.Tensor], value: int) -> torch.Tensor:
+        return torch.nn.utils.rnn.pad_sequence(
+            [torch.as_tensor(seq) for seq in sequences], batch_first=True, padding_value=value
+        )
+
+    def __call__(self, features: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        batch = {}
+        for key in features[0]:
+            sequences = [feature[key] for feature in features]
+            if key == 'labels':
+                labels = self._pad(sequences, self.label_pad_token_id)
+                # Datasets padded to max_length use the pad token in labels too
+                labels[labels == self.pad_token_id] = self.label_pad_token_id
+                batch[key] = labels
+            elif key.endswith('attention_mask'):
+                batch[key] = self._pad(sequences, 0)
+            else:
+                batch[key] = self._pad(sequences, self.pad_token_id)
+        return batch
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Peak resident set size of this process (None where it cannot be read)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)
+
+
+class _SamplerEpochCallback(TrainerCallback):
+    """Keeps the bucket sampler's shuffling in step with the trainer's epoch (also after resuming)."""
+
+    def __init__(self, sampler: LengthBucketBatchSampler):
+        self.sampler = sampler
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.sampler.set_epoch(int(math.floor(state.epoch + 1e-6)))
+
+
+class BucketingTrainer(Trainer):
+    """
+    Trainer that batches with LengthBucketBatchSampler and reports throughput
+    (real tokens/sec, the fraction of padding, seconds per optimizer step and
+    peak memory) with every log. An optional
+    profiling.instrumentation.Instrumentation also counts examples and tokens,
+    and an optional checkpointing.AsyncCheckpointer writes checkpoints in a
+    background thread.
+    """
+
+    def __init__(self, *args, bucket_multiplier: int = 50, instrumentation=None, checkpointer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bucket_multiplier = bucket_multiplier
+        self.instrumentation = instrumentation
+        self.checkpointer = checkpointer
+        self._last_log_step = None
+        self._batch_sampler = None
+        self._tokens = 0
+        self._padded_tokens = 0
+        self._last_log_time = time.perf_counter()
+
+    def _lengths(self) -> Sequence[int]:
+        return self.train_dataset.input_lengths
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self._batch_sampler is None:
+            self._batch_sampler = LengthBucketBatchSampler(
+                self._lengths(), self.args.per_device_train_batch_size,
+                bucket_multiplier=self.bucket_multiplier, seed=self.args.seed,
+                drop_last=self.args.dataloader_drop_last, num_replicas=self.args.world_size,
+                rank=self.args.process_index,
+            )
+            self.add_callback(_SamplerEpochCallback(self._batch_sampler))
+
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self._batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        if self.args.world_size > 1:
+            # Already sharded by the sampler; accelerate would shard the batches a second time
+            return dataloader
+        return self.accelerator.prepare(dataloader)
+
+    def train(self, *args, **kwargs):
+        self._last_log_step = None
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+
+    def _save_checkpoint(self, model, trial):
+        # Every process of a distributed run writes its own RNG state, so those save synchronously
+        if self.checkpointer is None or trial is not None or self.args.world_size > 1:
+            return super()._save_checkpoint(model, trial)
+        self.checkpointer.save(self, self._get_output_dir(trial=trial))
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.checkpointer is not None:
+            # Rotates old checkpoints here, on the training thread, once a background save is done
+            self.checkpointer.poll()
+        if self._last_log_step is None:
+            # First step of this run, possibly resumed from a checkpoint
+            self._last_log_step = self.state.global_step
+            self._last_log_time = time.perf_counter()
+        self._tokens += int(inputs['attention_mask'].sum()) + int((inputs['labels'] != -100).sum())
+        self._padded_tokens += inputs['input_ids'].numel() + inputs['labels'].numel()
+        if 'schema_input_ids' in inputs:
+            self._tokens += int(inputs['schema_attention_mask'].sum())
+            self._padded_tokens += inputs['schema_input_ids'].numel()
+        if self.instrumentation is not None:
+            self.instrumentation.count(examples=inputs['input_ids'].shape[0],
+                                       input_tokens=int(inputs['attention_mask'].sum()),
+                                       target_tokens=int((inputs['labels'] != -100).sum()))
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs: Dict[str, float], *args, **kwargs):
+        elapsed = time.perf_counter() - self._last_log_time
+        if self._padded_tokens and elapsed > 0:
+            logs['tokens_per_sec'] = round(self._tokens / elapsed, 1)
+            logs['padding_ratio'] = round(1 - self._tokens / self._padded_tokens, 4)
+        steps = self.state.global_step - (self._last_log_step or 0)
+        if self._last_log_step is not None and steps > 0 and elapsed > 0:
+            logs['step_time_s'] = round(elapsed / steps, 4)
+        peak_mb = peak_memory_mb()
+        if peak_mb is not None:
+            logs['peak_rss_mb'] = peak_mb
+        if torch.cuda.is_available():
+            logs['peak_cuda_mb'] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+        self._tokens = 0
+        self._padded_tokens = 0
+        self._last_log_time = time.perf_counter()
+        self._last_log_step = self.state.global_step
+        super().log(logs, *args, **kwargs)
@@ -0,0 +1,112 @@
+#Checkpoints written in a background thread: the weights and optimizer state are snapshotted to CPU memory,
+#then saved into tmp-checkpoint-N and renamed to checkpoint-N once complete, so an interrupted save is never resumed
+
+import copy
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers.trainer import (OPTIMIZER_NAME, PREFIX_CHECKPOINT_DIR, SCHEDULER_NAME, TRAINER_STATE_NAME,
+                                  TRAINING_ARGS_NAME)
+from transformers.trainer_callback import ExportableState
+
+
+def snapshot_state_dict(state_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """CPU copy of a state dict; tensors sharing storage (tied embeddings) stay shared in the copy."""
+    copies = {}
+    snapshot = {}
+    for name, tensor in state_dict.items():
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if key not in copies:
+            copies[key] = tensor.detach().to("cpu", copy=True)
+        snapshot[name] = copies[key]
+    return snapshot
+
+
+class AsyncCheckpointer:
+    """
+    Saves Trainer checkpoints without blocking the training loop.
+
+    At most one save is in flight: a new checkpoint first waits for the
+    previous one, so the extra memory is bounded by one copy of the weights
+    and optimizer state (use synchronous saves when even that does not fit).
+    Errors of the background save are raised by the next save or wait().
+    Old checkpoints are rotated (save_total_limit) on the training thread,
+    by the first poll() or wait() after the write completes, so deleting them
+    never overlaps a save.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._rotate: Optional[tuple] = None
+        self.saved = []
+        self.blocking_s = 0.0
+
+    def wait(self):
+        """Block until the save in flight is written, then rotate old checkpoints on the calling thread."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        if self._rotate is not None:
+            trainer, run_dir = self._rotate
+            self._rotate = None
+            trainer._rotate_checkpoints(use_mtime=False, output_dir=run_dir)
+
+    def poll(self):
+        """wait() if the save in flight has already finished; cheap enough to call every training step."""
+        if self._thread is not None and not self._thread.is_alive():
+            self.wait()
+
+    def save(self, trainer, run_dir: str):
+        """Snapshot the trainer's state now and write checkpoint-{global_step} in the background."""
+        start = time.perf_counter()
+        self.wait()
+        step = trainer.state.global_step
+        output_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{step}")
+        tmp_dir = os.path.join(run_dir, f"tmp-{PREFIX_CHECKPOINT_DIR}-{step}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        trainer.store_flos()
+        model = trainer.accelerator.unwrap_model(trainer.model, keep_torch_compile=False)
+        weights = snapshot_state_dict(model.state_dict())
+        optimizer = copy.deepcopy(trainer.optimizer.state_dict()) if not trainer.args.save_only_model else None
+
+        # Small files are written right away, as Trainer._save_checkpoint does
+        if optimizer is not None:
+            torch.save(trainer.lr_scheduler.state_dict(), os.path.join(tmp_dir, SCHEDULER_NAME))
+            trainer._save_rng_state(tmp_dir)
+        for callback in trainer.callback_handler.callbacks + [trainer.control]:
+            if isinstance(callback, ExportableState):
+                name = callback.__class__.__name__
+                if isinstance(trainer.state.stateful_callbacks[name], list):
+                    trainer.state.stateful_callbacks[name].append(callback.state())
+                else:
+                    trainer.state.stateful_callbacks[name] = callback.state()
+        trainer.state.save_to_json(os.path.join(tmp_dir, TRAINER_STATE_NAME))
+        torch.save(trainer.args, os.path.join(tmp_dir, TRAINING_ARGS_NAME))
+
+        def write():
+            try:
+                model.save_pretrained(tmp_dir, state_dict=weights, safe_serialization=trainer.args.save_safetensors)
+                if trainer.processing_class is not None:
+                    trainer.processing_class.save_pretrained(tmp_dir)
+                if optimizer is not None:
+                    torch.save(optimizer, os.path.join(tmp_dir, OPTIMIZER_NAME))
+                shutil.rmtree(output_dir, ignore_errors=True)
+                os.replace(tmp_dir, output_dir)
+                self.saved.append(output_dir)
+                self._rotate = (trainer, run_dir)
+            except BaseException as error:
+                self._error = error
+
+        self._thread = threading.Thread(target=write, name=f"checkpoint-{step}", daemon=True)
+        self._thread.start()
+        self.blocking_s += time.perf_counter() - start
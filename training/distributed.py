@@ -0,0 +1,88 @@
+#data-parallel CPU training: launches train.py as several gloo ranks per host (one or more hosts) via torchrun,
+#with each rank's intra-op thread count fixed and optionally pinned to its own block of cores
+
+import argparse
+import os
+from typing import List, Optional
+
+import torch
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+
+
+def local_rank() -> int:
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def local_world_size() -> int:
+    return int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+
+
+def world_size() -> int:
+    return int(os.environ.get("WORLD_SIZE", 1))
+
+
+def is_main_process() -> bool:
+    return int(os.environ.get("RANK", 0)) == 0
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def setup_threads(threads: Optional[int] = None, pin_cores: bool = False) -> int:
+    """
+    Fix this rank's torch thread count (default: the host's cores split evenly
+    between its ranks) and, with pin_cores, bind the process to its own block of
+    cores so ranks do not migrate onto each other's. Returns the thread count.
+    """
+    cores = available_cores()
+    threads = threads or max(1, len(cores) // local_world_size())
+    torch.set_num_threads(threads)
+    if pin_cores and hasattr(os, "sched_setaffinity"):
+        start = (local_rank() * threads) % len(cores)
+        block = cores[start:start + threads] or cores
+        os.sched_setaffinity(0, block)
+    return threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Launch train.py as data-parallel gloo ranks on this host (and others, with --nnodes)",
+        epilog="Arguments after -- go to train.py, e.g. -- --global-batch-size 32 --epochs 2",
+    )
+    parser.add_argument("--nproc-per-node", type=int, default=2, help="ranks on this host")
+    parser.add_argument("--nnodes", type=int, default=1, help="hosts taking part (run this launcher on each)")
+    parser.add_argument("--node-rank", type=int, default=0)
+    parser.add_argument("--master-addr", default="127.0.0.1", help="host of rank 0, reachable from every node")
+    parser.add_argument("--master-port", type=int, default=29500)
+    parser.add_argument("--threads-per-rank", type=int,
+                        help="intra-op threads of each rank (default: cores / --nproc-per-node)")
+    parser.add_argument("--pin-cores", action="store_true", help="bind each rank to its own block of cores")
+    parser.add_argument("train_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    train_args = args.train_args[1:] if args.train_args[:1] == ["--"] else args.train_args
+    threads = args.threads_per_rank or max(1, len(available_cores()) // args.nproc_per_node)
+    # Read by OpenMP/MKL when each rank starts; torchrun would otherwise default it to 1
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    train_args += ["--threads-per-rank", str(threads)] + (["--pin-cores"] if args.pin_cores else [])
+
+    print(f"🚀 Launching {args.nproc_per_node} ranks x {threads} threads on node {args.node_rank} "
+          f"of {args.nnodes} (gloo, rank 0 at {args.master_addr}:{args.master_port})")
+    from torch.distributed.run import main as torchrun
+    torchrun([
+        f"--nnodes={args.nnodes}",
+        f"--nproc-per-node={args.nproc_per_node}",
+        f"--node-rank={args.node_rank}",
+        f"--master-addr={args.master_addr}",
+        f"--master-port={args.master_port}",
+        TRAIN_SCRIPT,
+        *train_args,
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,41 @@
 from torch.utils.data import Dataset
 from transformers import PreTrainedTokenizer
 import csv
+from contextlib import nullcontext
+
+try:
+    from profiling.instrumentation import stage_of
+except ImportError:
+    # train.py run from training/ without the repository root on the path, where nothing is instrumented
+    def stage_of(instrumentation, name):
+        return nullcontext()
+
+SCHEMA_MARKER = ' schema: '
+
+
+def split_input_text(input_text): #"question: ... schema: ..." -> ("question: ...", "schema: ...")
+    # Flattened schemas never contain the marker, questions occasionally might
+    question, marker, schema = input_text.rpartition(SCHEMA_MARKER)
+    if not marker:
+        return input_text, ''
+    return question, marker.lstrip() + schema
+
 
 class SpiderDataset(Dataset):
-    def __init__(self, file_path,tokenizer: PreTrainedTokenizer, max_input_length=512, max_target_length=256):
+    def __init__(self, file_path,tokenizer: PreTrainedTokenizer, max_input_length=512, max_target_length=256,
+                 pad_to_max_length=True, split_inputs=False, instrumentation=None):
         self.examples = []
+        self.example_ids = [] # Stable ids from the dataset builder ("dev-00042"); empty for older files
         self.tokenizer = tokenizer
+        # False leaves padding to the collator (see batching.DynamicPaddingCollator)
+        self.padding = 'max_length' if pad_to_max_length else False
+        self._input_lengths = None
+        # Split inputs encode the question and the schema as separate sequences (models.split_encoding);
+        # each distinct schema segment is tokenized once
+        self.split_inputs = split_inputs
+        self._schema_encodings = {}
+        # Optional profiling.instrumentation.Instrumentation timing the "tokenization" stage
+        self.instrumentation = instrumentation
 
         with open(file_path, 'r', encoding='utf-8') as f:
             reader=csv.DictReader(f, delimiter='\t')
@@ -17,10 +47,19 @@ class SpiderDataset(Dataset):
                     self.examples.append((row['input'], row['target'], row['db_id']))
                 else:
                     self.examples.append((row['input'], row['target'], 'unknown'))
+                self.example_ids.append(row.get('example_id') or '')
 
         self.max_input_length = max_input_length
         self.max_target_length = max_target_length
     
+    @property
+    def input_lengths(self): #Token counts of the inputs, used to bucket examples of similar length
+        if self._input_lengths is None:
+            input_texts = [example[0] for example in self.examples]
+            encodings = self.tokenizer(input_texts, max_length=self.max_input_length, truncation=True)
+            self._input_lengths = [len(ids) for ids in encodings['input_ids']]
+        return self._input_lengths
+
     def __len__(self): #To tell the dataloader that the dataset has X training samples
         return len(self.examples) #Telss how manu batcheds to run per epoch
     
@@ -32,25 +71,46 @@ class SpiderDataset(Dataset):
             input_text, target_text = self.examples[idx][:2]
             db_id = 'unknown'
 
+        schema_text = None
+        if self.split_inputs:
+            input_text, schema_text = split_input_text(input_text)
+
         # Tokenize input and target
-        input_enc = self.tokenizer(
-            input_text,
-            max_length=self.max_input_length,
-            truncation=True,
-            padding='max_length',
-            return_tensors='pt'
-        )
-        target_enc = self.tokenizer(
-            target_text,
-            max_length=self.max_target_length,
-            truncation=True,
-            padding='max_length',
-            return_tensors='pt'
-        )
-
-        return {
+        with stage_of(self.instrumentation, 'tokenization'):
+            input_enc = self.tokenizer(
+                input_text,
+                max_length=self.max_input_length,
+                truncation=True,
+                padding=self.padding,
+                return_tensors='pt'
+            )
+            target_enc = self.tokenizer(
+                target_text,
+                max_length=self.max_target_length,
+                truncation=True,
+                padding=self.padding,
+                return_tensors='pt'
+            )
+
+        item = {
             'input_ids': input_enc['input_ids'].squeeze(0),
             'attention_mask': input_enc['attention_mask'].squeeze(0),
             'labels': target_enc['input_ids'].squeeze(0)
         }
+        if schema_text is not None:
+            item['schema_input_ids'], item['schema_attention_mask'] = self._encode_schema(schema_text)
+        return item
+
+    def _encode_schema(self, schema_text):
+        if schema_text not in self._schema_encodings:
+            schema_enc = self.tokenizer(
+                schema_text,
+                max_length=self.max_input_length,
+                truncation=True,
+                padding=self.padding,
+                return_tensors='pt'
+            )
+            self._schema_encodings[schema_text] = (schema_enc['input_ids'].squeeze(0),
+                                                   schema_enc['attention_mask'].squeeze(0))
+        return self._schema_encodings[schema_text]
 
@@ -0,0 +1,292 @@
+#offline tokenization of the tsv files into flat numpy arrays, and a Dataset that memory-maps them
+#so every epoch (and every dataloader worker) reuses the same token ids without re-running the tokenizer
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from transformers import PreTrainedTokenizer
+
+META_FILE = "meta.json"
+# name -> dtype of the arrays written by write_tokenized
+ARRAYS = {
+    "input_ids": np.int32,
+    "input_offsets": np.int64,
+    "input_lengths": np.int32,
+    "target_ids": np.int32,
+    "target_offsets": np.int64,
+    "target_lengths": np.int32,
+}
+
+
+def iter_tsv(file_path: str) -> Iterator[Tuple[str, str, str]]:
+    """Stream (input, target, db_id) rows from a processed TSV file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        for row in reader:
+            yield row['input'], row['target'], row.get('db_id', 'unknown')
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_stats(path: str) -> dict:
+    """What meta.json records about a source TSV, to tell later whether it is still the same file."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_sha256(path)}
+
+
+def tokenizer_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    """Hash of the vocabulary, so a fine-tuned model's copy of a tokenizer matches the original."""
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False)
+    return hashlib.sha256(vocab.encode('utf-8')).hexdigest()
+
+
+def _chunks(rows: Iterator[Tuple[str, str, str]], size: int) -> Iterator[List[Tuple[str, str, str]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_tokenized(file_paths: List[str], tokenizer: PreTrainedTokenizer, output_dir: str,
+                    max_input_length: int = 512, max_target_length: int = 256, chunk_size: int = 1000) -> int:
+    """
+    Tokenize one or more TSV files into flat input/target id arrays with offsets
+    and lengths. Returns the number of examples written.
+    """
+    token_arrays = {"input": array('i'), "target": array('i')}
+    offsets = {"input": array('q', [0]), "target": array('q', [0])}
+    db_ids = []
+
+    for file_path in file_paths:
+        for chunk in _chunks(iter_tsv(file_path), chunk_size):
+            inputs, targets, chunk_db_ids = zip(*chunk)
+            encoded = {
+                "input": tokenizer(list(inputs), max_length=max_input_length, truncation=True)['input_ids'],
+                "target": tokenizer(list(targets), max_length=max_target_length, truncation=True)['input_ids'],
+            }
+            for side, sequences in encoded.items():
+                for ids in sequences:
+                    token_arrays[side].extend(ids)
+                    offsets[side].append(len(token_arrays[side]))
+            db_ids.extend(chunk_db_ids)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for side in ("input", "target"):
+        side_offsets = np.frombuffer(offsets[side], dtype=np.int64)
+        np.save(os.path.join(output_dir, f"{side}_ids.npy"), np.frombuffer(token_arrays[side], dtype=np.int32))
+        np.save(os.path.join(output_dir, f"{side}_offsets.npy"), side_offsets)
+        np.save(os.path.join(output_dir, f"{side}_lengths.npy"), np.diff(side_offsets).astype(np.int32))
+
+    meta = {
+        "num_examples": len(db_ids),
+        "sources": file_paths,
+        "source_files": [source_stats(path) for path in file_paths],
+        "tokenizer": getattr(tokenizer, "name_or_path", ""),
+        "tokenizer_fingerprint": tokenizer_fingerprint(tokenizer),
+        "vocab_size": len(tokenizer),
+        "pad_token_id": tokenizer.pad_token_id,
+        "max_input_length": max_input_length,
+        "max_target_length": max_target_length,
+        "db_ids": db_ids,
+    }
+    with open(os.path.join(output_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    return len(db_ids)
+
+
+def merge_tokenized(data_dirs: List[str], output_dir: str, sources: List[str]) -> int:
+    """
+    Concatenate directories written by write_tokenized (e.g. the dataset builder's
+    per-shard ones) into one, rebasing the offsets; `sources` are the TSV files the
+    merged directory corresponds to. Returns the number of examples written.
+    """
+    metas = []
+    for data_dir in data_dirs:
+        with open(os.path.join(data_dir, META_FILE), 'r', encoding='utf-8') as f:
+            metas.append(json.load(f))
+    settings = ("tokenizer", "tokenizer_fingerprint", "vocab_size", "pad_token_id", "max_input_length",
+                "max_target_length")
+    for data_dir, meta in zip(data_dirs[1:], metas[1:]):
+        if any(meta.get(key) != metas[0].get(key) for key in settings):
+            raise ValueError(f"{data_dir} was tokenized with different settings than {data_dirs[0]}")
+
+    tmp_dir = output_dir + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for side in ("input", "target"):
+        ids, offsets, base = [], [np.zeros(1, dtype=np.int64)], 0
+        for data_dir in data_dirs:
+            part_ids = np.load(os.path.join(data_dir, f"{side}_ids.npy"), mmap_mode='r')
+            part_offsets = np.load(os.path.join(data_dir, f"{side}_offsets.npy"), mmap_mode='r')
+            ids.append(part_ids)
+            offsets.append(part_offsets[1:] + base)
+            base += len(part_ids)
+        side_offsets = np.concatenate(offsets)
+        np.save(os.path.join(tmp_dir, f"{side}_ids.npy"), np.concatenate(ids).astype(np.int32) if ids
+                else np.zeros(0, dtype=np.int32))
+        np.save(os.path.join(tmp_dir, f"{side}_offsets.npy"), side_offsets)
+        np.save(os.path.join(tmp_dir, f"{side}_lengths.npy"), np.diff(side_offsets).astype(np.int32))
+
+    meta = dict(metas[0]) if metas else {}
+    meta.update({
+        "num_examples": sum(part["num_examples"] for part in metas),
+        "sources": sources,
+        "source_files": [source_stats(path) for path in sources],
+        "db_ids": [db_id for part in metas for db_id in part["db_ids"]],
+    })
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    return meta["num_examples"]
+
+
+def is_tokenized_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def tokenized_mismatch(data_dir: str, sources: List[str], tokenizer: PreTrainedTokenizer,
+                       num_examples: Optional[int] = None, max_input_length: Optional[int] = None) -> Optional[str]:
+    """
+    Why `data_dir` is not `sources` tokenized by `tokenizer`, or None if it is. The
+    arrays are used by row number, so a stale directory (or one built from another
+    file or tokenizer) would silently feed every example the wrong ids.
+    """
+    with open(os.path.join(data_dir, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if num_examples is not None and meta["num_examples"] != num_examples:
+        return f"it holds {meta['num_examples']} examples, not {num_examples}"
+    if max_input_length is not None and meta["max_input_length"] != max_input_length:
+        return f"inputs were truncated to {meta['max_input_length']} tokens, not {max_input_length}"
+
+    recorded = meta.get("source_files")
+    if recorded is None:
+        return "it predates source tracking"
+    if [entry["path"] for entry in recorded] != [os.path.abspath(path) for path in sources]:
+        return f"it was built from {', '.join(entry['path'] for entry in recorded)}"
+    for entry, path in zip(recorded, sources):
+        if not os.path.exists(path):
+            return f"{path} does not exist"
+        stat = os.stat(path)
+        # Same size and mtime: unchanged; otherwise it may only have been rewritten with the same rows
+        if (stat.st_size, stat.st_mtime) != (entry["size"], entry["mtime"]) and file_sha256(path) != entry["sha256"]:
+            return f"{path} changed after it was tokenized"
+
+    if (meta["tokenizer"] != getattr(tokenizer, "name_or_path", "")
+            and meta.get("tokenizer_fingerprint") != tokenizer_fingerprint(tokenizer)):
+        return f"it was tokenized with {meta['tokenizer']}"
+    return None
+
+
+class TokenizedSpiderDataset(Dataset):
+    """
+    Memory-mapped view of a directory written by write_tokenized.
+
+    The arrays are opened lazily in each process, so forked dataloader workers
+    share the page cache instead of holding their own copy of the corpus.
+    Items have the same layout as SpiderDataset.
+    """
+
+    def __init__(self, data_dir: str, pad_to_max_length: bool = True):
+        self.data_dir = data_dir
+        self.pad_to_max_length = pad_to_max_length
+
+        with open(os.path.join(data_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.num_examples = meta["num_examples"]
+        self.db_ids = meta["db_ids"]
+        self.pad_token_id = meta["pad_token_id"]
+        self.max_input_length = meta["max_input_length"]
+        self.max_target_length = meta["max_target_length"]
+
+        self._arrays = None
+
+    @property
+    def arrays(self) -> dict:
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(os.path.join(self.data_dir, f"{name}.npy"), mmap_mode='r')
+                for name in ARRAYS
+            }
+        return self._arrays
+
+    @property
+    def input_lengths(self) -> np.ndarray:
+        return self.arrays["input_lengths"]
+
+    @property
+    def target_lengths(self) -> np.ndarray:
+        return self.arrays["target_lengths"]
+
+    def __getstate__(self):
+        # Never pickle the memory maps (spawned workers would copy the whole corpus)
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def __len__(self):
+        return self.num_examples
+
+    def input_ids(self, idx: int) -> np.ndarray:
+        offsets = self.arrays["input_offsets"]
+        return self.arrays["input_ids"][offsets[idx]:offsets[idx + 1]]
+
+    def target_ids(self, idx: int) -> np.ndarray:
+        offsets = self.arrays["target_offsets"]
+        return self.arrays["target_ids"][offsets[idx]:offsets[idx + 1]]
+
+    def _to_tensor(self, ids: np.ndarray, max_length: int) -> torch.Tensor:
+        tensor = torch.from_numpy(ids.astype(np.int64))
+        if self.pad_to_max_length and len(tensor) < max_length:
+            tensor = torch.cat([tensor, tensor.new_full((max_length - len(tensor),), self.pad_token_id)])
+        return tensor
+
+    def __getitem__(self, idx):
+        input_ids = self._to_tensor(self.input_ids(idx), self.max_input_length)
+        labels = self._to_tensor(self.target_ids(idx), self.max_target_length)
+
+        attention_mask = torch.zeros_like(input_ids)
+        attention_mask[:len(self.input_ids(idx))] = 1
+
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': labels
+        }
+
+
+if __name__ == "__main__":
+    from transformers import T5Tokenizer
+
+    parser = argparse.ArgumentParser(description="Pre-tokenize processed TSV files into memory-mappable arrays")
+    parser.add_argument("inputs", nargs="+", help="processed TSV files, e.g. output/processed/train.tsv")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--tokenizer", default="t5-small")
+    parser.add_argument("--max-input-length", type=int, default=512)
+    parser.add_argument("--max-target-length", type=int, default=256)
+    args = parser.parse_args()
+
+    tokenizer = T5Tokenizer.from_pretrained(args.tokenizer)
+    count = write_tokenized(args.inputs, tokenizer, args.output_dir,
+                            max_input_length=args.max_input_length, max_target_length=args.max_target_length)
+    print(f"Saved {count} tokenized examples to {args.output_dir}")
@@ -1,49 +1,195 @@
+import argparse
+
+import torch
 from transformers import (
     T5Tokenizer,
     T5ForConditionalGeneration,
-    Trainer,
     TrainingArguments,
 )
+from transformers.trainer_utils import get_last_checkpoint
 
 from spider_dataset import SpiderDataset
+from tokenized_dataset import TokenizedSpiderDataset, is_tokenized_dir, tokenized_mismatch
+from batching import BucketingTrainer, DynamicPaddingCollator, peak_memory_mb
+from checkpointing import AsyncCheckpointer
+from distributed import is_main_process, setup_threads, world_size
+
+# Batch size the default learning rate was tuned for (see --scale-lr)
+REFERENCE_BATCH_SIZE = 4
+
+
+def bf16_supported() -> bool:
+    """bf16 autocast is used only where the hardware has native bf16 support."""
+    if torch.cuda.is_available():
+        return torch.cuda.is_bf16_supported()
+    # CPU autocast runs everywhere, but is only faster (and lighter) with AVX512-BF16 or AMX
+    native = [getattr(torch.cpu, name, None) for name in ("_is_avx512_bf16_supported", "_is_amx_tile_supported")]
+    return any(check is not None and check() for check in native)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fine-tune T5 on the preprocessed Spider data")
+    parser.add_argument("--model-name", default="t5-small", help="t5-small, t5-base, t5-large or a local path")
+    parser.add_argument("--output-dir", help="final model (default: output/t5-spider-final or -split)")
+    parser.add_argument("--checkpoint-dir", default="output/t5-spider-checkpoints")
+    parser.add_argument("--train-file", default="output/processed/train.tsv")
+    parser.add_argument("--tokenized-dir", default="output/processed/train_tokenized",
+                        help="memory-mapped token ids from tokenized_dataset.py, used instead of --train-file if present")
+    parser.add_argument("--batch-size", type=int, default=4, help="examples per batch on each rank")
+    parser.add_argument("--gradient-accumulation-steps", type=int, default=1,
+                        help="optimizer step every N batches (effective batch size = batch size * N * ranks)")
+    parser.add_argument("--global-batch-size", type=int,
+                        help="effective batch size; sets --gradient-accumulation-steps for the number of ranks")
+    parser.add_argument("--scale-lr", action="store_true",
+                        help=f"scale --learning-rate linearly with effective batch size / {REFERENCE_BATCH_SIZE}")
+    parser.add_argument("--epochs", type=float, default=2)
+    parser.add_argument("--max-steps", type=int, default=-1, help="stop after N optimizer steps (overrides --epochs)")
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--logging-steps", type=int, default=10)
+    parser.add_argument("--gradient-checkpointing", action="store_true",
+                        help="recompute activations in the backward pass instead of keeping them")
+    parser.add_argument("--optimizer", choices=["adamw_torch", "adafactor"], default="adamw_torch",
+                        help="adafactor keeps factored second moments and no first moment (far less memory)")
+    parser.add_argument("--bf16", action="store_true", help="bf16 autocast where the hardware supports it")
+    parser.add_argument("--save-steps", type=int, default=500, help="checkpoint every N optimizer steps (0 = never)")
+    parser.add_argument("--save-total-limit", type=int, default=3, help="checkpoints kept on disk")
+    parser.add_argument("--sync-checkpoints", action="store_true",
+                        help="save checkpoints in the training loop (no extra in-memory copy of the state)")
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="CHECKPOINT",
+                        help="resume from a checkpoint directory, or the latest one in --checkpoint-dir")
+    parser.add_argument("--split-encoding", action="store_true",
+                        help="encode question and schema separately (needs the repository root on PYTHONPATH)")
+    parser.add_argument("--instrument", metavar="JSON",
+                        help="time tokenization and every step, write the report here (needs the root on PYTHONPATH)")
+    parser.add_argument("--profile-steps", metavar="START:COUNT",
+                        help="torch profiler trace of these steps, saved to output/profiles")
+    parser.add_argument("--threads-per-rank", type=int, help="torch threads (set by distributed.py for each rank)")
+    parser.add_argument("--pin-cores", action="store_true", help="bind each rank to its own block of cores")
+    args = parser.parse_args(argv)
+
+    # Data-parallel ranks are started by distributed.py (torchrun); a plain run is a world of one
+    ranks = world_size()
+    if ranks > 1 or args.threads_per_rank or args.pin_cores:
+        setup_threads(args.threads_per_rank, args.pin_cores)
+    accumulation = args.gradient_accumulation_steps
+    if args.global_batch_size:
+        accumulation, remainder = divmod(args.global_batch_size, args.batch_size * ranks)
+        if remainder or not accumulation:
+            parser.error(f"--global-batch-size {args.global_batch_size} is not a multiple of "
+                         f"--batch-size {args.batch_size} x {ranks} ranks")
+    effective_batch_size = args.batch_size * accumulation * ranks
+    learning_rate = args.learning_rate
+    if args.scale_lr:
+        learning_rate *= effective_batch_size / REFERENCE_BATCH_SIZE
+    if is_main_process():
+        print(f"📈 {ranks} rank(s) x batch {args.batch_size} x {accumulation} accumulation steps = "
+              f"effective batch size {effective_batch_size}, learning rate {learning_rate:g}")
+
+    instrumentation, callbacks = None, []
+    if args.instrument or args.profile_steps:
+        from profiling.instrumentation import Instrumentation, ProfilerWindow, parse_window, training_callbacks
+        instrumentation = Instrumentation() if args.instrument else None
+        window = parse_window(args.profile_steps)
+        callbacks = training_callbacks(instrumentation, ProfilerWindow(*window) if window else None)
+
+    bf16 = args.bf16 and bf16_supported()
+    if args.bf16 and not bf16:
+        print("⚠️ No native bf16 support on this machine, training in fp32")
 
-def main():
     #  1. Load tokenizer and model
-    model_name = "t5-small"  # or "t5-base" / "t5-large"
-    tokenizer = T5Tokenizer.from_pretrained(model_name)
-    model = T5ForConditionalGeneration.from_pretrained(model_name)
+    tokenizer = T5Tokenizer.from_pretrained(args.model_name)
+    if args.split_encoding:
+        from models.split_encoding import SplitEncoderT5
+        model = SplitEncoderT5.from_pretrained(args.model_name)
+        model.config.split_encoding = True  # Saved with the checkpoint so models.loading picks the right class
+        output_dir = args.output_dir or "output/t5-spider-split"
+    else:
+        model = T5ForConditionalGeneration.from_pretrained(args.model_name)
+        output_dir = args.output_dir or "output/t5-spider-final"
 
-    # 2. Load training data
-    train_dataset = SpiderDataset(
-        file_path="output/processed/train.tsv",
-        tokenizer=tokenizer,
-        max_input_length=512,
-        max_target_length=256
-    )
+    # 2. Load training data (memory-mapped token ids if tokenized_dataset.py has been run)
+    #    Examples stay unpadded; batches are padded dynamically by the collator
+    #    Every rank builds the same length-bucketed batch order and only loads its own batches
+    use_tokenized = is_tokenized_dir(args.tokenized_dir) and not args.split_encoding
+    if use_tokenized:
+        mismatch = tokenized_mismatch(args.tokenized_dir, [args.train_file], tokenizer)
+        if mismatch is not None:
+            print(f"⚠️ Not using {args.tokenized_dir} ({mismatch}), tokenizing {args.train_file} instead")
+            use_tokenized = False
+    if use_tokenized:
+        train_dataset = TokenizedSpiderDataset(args.tokenized_dir, pad_to_max_length=False)
+    else:
+        train_dataset = SpiderDataset(
+            file_path=args.train_file,
+            tokenizer=tokenizer,
+            max_input_length=512,
+            max_target_length=256,
+            pad_to_max_length=False,
+            split_inputs=args.split_encoding,
+            instrumentation=instrumentation
+        )
 
+    # 3. Checkpoints hold the optimizer, scheduler and RNG states, so a resumed run
+    #    skips the batches it has seen and continues exactly where it stopped
     training_args = TrainingArguments(
-        output_dir="output/t5-spider-checkpoints",
-        per_device_train_batch_size=4,
-        num_train_epochs=2,
+        output_dir=args.checkpoint_dir,
+        per_device_train_batch_size=args.batch_size,
+        gradient_accumulation_steps=accumulation,
+        num_train_epochs=args.epochs,
+        max_steps=args.max_steps,
+        learning_rate=learning_rate,
+        seed=args.seed,
+        optim=args.optimizer,
+        gradient_checkpointing=args.gradient_checkpointing,
+        bf16=bf16,
+        use_cpu=bf16 and not torch.cuda.is_available(),
+        save_strategy="steps" if args.save_steps else "no",
+        save_steps=args.save_steps or 500,
+        save_total_limit=args.save_total_limit,
         logging_dir="output/logs",
-        logging_steps=10
-        # remove: save_strategy, evaluation_strategy, report_to
+        logging_steps=args.logging_steps,
+        report_to=[],
+        ddp_backend="gloo" if ranks > 1 and not torch.cuda.is_available() else None,
+        ddp_find_unused_parameters=False,
     )
 
+    resume = args.resume
+    if resume == "latest":
+        resume = get_last_checkpoint(args.checkpoint_dir)
+        if resume is None:
+            print(f"⚠️ No checkpoint in {args.checkpoint_dir}, starting from scratch")
+        else:
+            print(f"🔄 Resuming from {resume}")
 
-    # 4. Setup HuggingFace Trainer
-    trainer = Trainer(
+    # 4. Setup HuggingFace Trainer with length-bucketed batches
+    trainer = BucketingTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
-        tokenizer=tokenizer
+        data_collator=DynamicPaddingCollator(pad_token_id=tokenizer.pad_token_id),
+        tokenizer=tokenizer,
+        callbacks=callbacks,
+        instrumentation=instrumentation,
+        checkpointer=None if args.sync_checkpoints else AsyncCheckpointer()
     )
 
     #  5. Train the model
-    trainer.train()
-    model.save_pretrained("output/t5-spider-final")
-    tokenizer.save_pretrained("output/t5-spider-final")
+    trainer.train(resume_from_checkpoint=resume)
+    if not is_main_process():
+        return
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
     print(" Training complete!")
+    if trainer.checkpointer is not None and trainer.checkpointer.saved:
+        print(f"💾 {len(trainer.checkpointer.saved)} checkpoints saved in the background "
+              f"({trainer.checkpointer.blocking_s:.1f}s spent in the training loop)")
+    peak_mb = peak_memory_mb()
+    if peak_mb is not None:
+        print(f"📈 Peak RSS {peak_mb:.0f} MB")
+    if instrumentation is not None:
+        instrumentation.report()
+        instrumentation.dump(args.instrument)
 
 if __name__ == "__main__":
     main()